@@ -1,9 +1,25 @@
 # backend/app.py
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from auth.dependencies import authenticate_request
+from auth.firebase_auth import start_key_refresh, stop_key_refresh
+from auth.security import password_tokens_enabled, shutdown_password_pool
+from auth.user_store import close_user_store
 from routers import generate, auth
+from services.artifact_store import artifact_store
+from services.batch_generation_service import shutdown_process_pool
+from services.model_router import model_router
+from services.usage_ledger import usage_ledger
+from utils.cancellation import RequestStartMiddleware
+from utils.idempotency import REPLAYED_HEADER, IdempotencyMiddleware, close_idempotency_store
+from utils.logger import get_logger
+from utils.metrics import metrics
+from utils.rate_limit import RATE_LIMIT_HEADER_NAMES, RateLimitHeadersMiddleware, rate_limiter
+from utils.shared_cache import shared_cache
+
+logger = get_logger(__name__)
 # app.py
 
 
@@ -36,14 +52,27 @@ def create_app() -> FastAPI:
         # "https://www.getinfragenie.com",       # add this if you use www
     ]
 
+    # RateLimit-* headers on rate-limited routes (added first: runs inside CORS)
+    app.add_middleware(RateLimitHeadersMiddleware)
+
+    # Idempotency-Key replay for retried POSTs; replays skip rate limits and quotas
+    app.add_middleware(
+        IdempotencyMiddleware,
+        paths=("/api/generate", "/api/generate/bundle", "/api/generate/refine"),
+    )
+
     app.add_middleware(
         CORSMiddleware,
         allow_origins=origins,
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=RATE_LIMIT_HEADER_NAMES + ["X-Result-Id", REPLAYED_HEADER],
     )
 
+    # Outermost: stamps request arrival for deadlines (X-Request-Deadline-Ms)
+    app.add_middleware(RequestStartMiddleware)
+
     # Simple root route
     @app.get("/")
     async def read_root():
@@ -54,9 +83,45 @@ def create_app() -> FastAPI:
     async def health_check():
         return {"status": "ok", "service": "infrascribe-api"}
 
+    # In-process counters/timings (cancellations, cache hits, …)
+    @app.get("/metrics", tags=["health"])
+    async def get_metrics():
+        return {**metrics.snapshot(), "models": model_router.snapshot()}
+
+    @app.on_event("startup")
+    async def start_workers():
+        await generate.job_queue.start()
+        start_key_refresh()
+        usage_ledger.start()
+        if not password_tokens_enabled():
+            logger.warning(
+                "INFRASCRIBE_JWT_SECRET/INFRASCRIBE_JWT_KEYS not set: password sign-in "
+                "is disabled and password tokens are rejected"
+            )
+
+    @app.on_event("shutdown")
+    async def shutdown_workers():
+        await generate.job_queue.stop()
+        await stop_key_refresh()
+        await usage_ledger.stop()  # writes calls still buffered
+        shutdown_process_pool()
+        shutdown_password_pool()
+        close_user_store()
+        rate_limiter.close()
+        artifact_store.close()
+        shared_cache.close()
+        close_idempotency_store()
+
     # Include routers
     app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
-    app.include_router(generate.router, prefix="/api/generate", tags=["generate"])
+    # Bearer tokens are verified (and cached) per request; guests stay allowed
+    # unless INFRASCRIBE_REQUIRE_AUTH is set
+    app.include_router(
+        generate.router,
+        prefix="/api/generate",
+        tags=["generate"],
+        dependencies=[Depends(authenticate_request)],
+    )
 
     return app
 
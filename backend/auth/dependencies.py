@@ -0,0 +1,128 @@
+# backend/auth/dependencies.py
+
+import os
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, Header, Request, status
+from jose import JWTError, jwt
+
+from auth.firebase_auth import AuthUnavailable, InvalidFirebaseToken, verify_firebase_token
+from auth.security import decode_access_token
+from auth.token_cache import VerifiedTokenCache
+from utils.logger import get_logger
+from utils.metrics import metrics
+
+logger = get_logger(__name__)
+
+# Guests (no Authorization header) are let through unless this is set
+REQUIRE_AUTH = os.getenv("INFRASCRIBE_REQUIRE_AUTH", "").lower() in ("1", "true", "yes")
+JWT_CACHE_SIZE = int(os.getenv("INFRASCRIBE_JWT_CACHE_SIZE", "10000"))
+
+# token digest -> {"sub", "provider", "claims", "exp"}, for both token kinds
+_identity_cache = VerifiedTokenCache(JWT_CACHE_SIZE)
+
+
+class InvalidAccessToken(ValueError):
+    """
+    Bad signature, unknown key id, expired, or not a token we issued.
+    """
+
+
+def verify_access_token(token: str) -> Dict[str, Any]:
+    """
+    Verifies an HS256 access token from create_access_token (signature with
+    the key named by its kid, expiry) and returns the decoded claims.
+    """
+    started = time.perf_counter()
+    try:
+        header = jwt.get_unverified_header(token)
+        return decode_access_token(token, header.get("kid"))
+    except JWTError as e:
+        metrics.incr("auth.jwt.rejected")
+        raise InvalidAccessToken(str(e))
+    finally:
+        metrics.observe("auth.jwt.verify_seconds", time.perf_counter() - started)
+
+
+def _bearer(authorization: Optional[str]) -> Optional[str]:
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+async def identify(token: str) -> Dict[str, Any]:
+    """
+    {"sub", "provider", "claims", "exp"} for our own HS256 tokens and
+    Firebase ID tokens (RS256); raises InvalidAccessToken otherwise.
+
+    Verified identities are cached by token digest until the token's "exp",
+    so only the first request with a token decodes it and checks the
+    signature; later ones cost one hash and a dict lookup.
+    """
+    cached = _identity_cache.get(token)
+    if cached is not None:
+        metrics.incr("auth.jwt.cache_hits")
+        return cached
+    metrics.incr("auth.jwt.cache_misses")
+
+    try:
+        alg = jwt.get_unverified_header(token).get("alg")
+    except JWTError:
+        metrics.incr("auth.jwt.rejected")
+        raise InvalidAccessToken("Malformed token")
+
+    if alg == "RS256":
+        try:
+            claims = await verify_firebase_token(token)
+        except InvalidFirebaseToken as e:
+            raise InvalidAccessToken(str(e))
+        user = {"sub": claims["uid"], "provider": "firebase", "claims": claims}
+    else:
+        claims = verify_access_token(token)
+        user = {"sub": claims.get("sub"), "provider": "password", "claims": claims}
+
+    user["exp"] = claims.get("exp")
+    _identity_cache.put(token, user)
+    return user
+
+
+async def authenticate_request(
+    request: Request,
+    authorization: Optional[str] = Header(default=None),
+) -> Optional[Dict[str, Any]]:
+    """
+    Router dependency: verifies the bearer token (if any) and stores the
+    caller on request.state.user ({"sub", "provider", "claims", "exp"}), or None
+    for guests. Invalid tokens are rejected with 401 rather than silently
+    downgraded to guest access.
+    """
+    started = time.perf_counter()
+    user = None
+    token = _bearer(authorization)
+    if token is not None:
+        try:
+            user = await identify(token)
+        except InvalidAccessToken:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or expired token",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        except AuthUnavailable as e:
+            # Firebase not configured/reachable: the caller is no more than a guest
+            logger.warning(f"Could not verify Firebase token: {e}")
+
+    if user is None and REQUIRE_AUTH:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    request.state.user = user
+    metrics.observe("auth.request_seconds", time.perf_counter() - started)
+    return user
@@ -1,18 +1,213 @@
-from fastapi import Depends, HTTPException, status, Header
-from firebase_admin import auth
+# backend/auth/firebase_auth.py
 
-def get_firebase_user(
-    authorization: str | None = Header(default=None),
-):
+import asyncio
+import os
+import re
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+from fastapi import HTTPException, status, Header
+from jose import jwk, jwt
+from jose.exceptions import JOSEError
+
+from auth.token_cache import VerifiedTokenCache
+from utils.logger import get_logger
+from utils.metrics import metrics
+
+logger = get_logger(__name__)
+
+FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
+# Public signing keys for Firebase ID tokens, as a JWK set
+FIREBASE_JWKS_URL = os.getenv(
+    "INFRASCRIBE_FIREBASE_JWKS_URL",
+    "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com",
+)
+# Used when the key endpoint sends no Cache-Control max-age
+KEY_REFRESH_SECONDS = int(os.getenv("INFRASCRIBE_FIREBASE_KEY_REFRESH_SECONDS", "3600"))
+# An unknown kid triggers a refetch at most this often
+KEY_MIN_REFETCH_SECONDS = 30
+AUTH_CACHE_SIZE = int(os.getenv("INFRASCRIBE_AUTH_CACHE_SIZE", "10000"))
+CLOCK_SKEW_SECONDS = int(os.getenv("INFRASCRIBE_AUTH_CLOCK_SKEW_SECONDS", "5"))
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class InvalidFirebaseToken(ValueError):
+    """
+    The token is malformed, expired, or not signed for this project.
+    """
+
+
+class AuthUnavailable(RuntimeError):
+    """
+    Signing keys could not be loaded, so no token can be verified.
+    """
+
+
+class FirebaseKeyStore:
+    """
+    Firebase signing keys, fetched ahead of time and refreshed in the
+    background shortly before the endpoint's max-age runs out. Requests only
+    wait on the network when a token names a kid we have never seen (key
+    rotation), and then at most once per KEY_MIN_REFETCH_SECONDS.
+    """
+
+    def __init__(self, url: str = FIREBASE_JWKS_URL, refresh_seconds: int = KEY_REFRESH_SECONDS):
+        self.url = url
+        self.refresh_seconds = refresh_seconds
+        self._keys: Dict[str, Any] = {}
+        self._expires_at = 0.0
+        self._last_fetch = 0.0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> bool:
+        self._last_fetch = time.time()
+        started = time.perf_counter()
+        try:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                response = await client.get(self.url)
+                response.raise_for_status()
+            keys = {
+                spec["kid"]: jwk.construct(spec, algorithm=spec.get("alg", "RS256"))
+                for spec in response.json().get("keys", [])
+                if spec.get("kid")
+            }
+        except (httpx.HTTPError, ValueError, KeyError, JOSEError) as e:
+            metrics.incr("auth.firebase.key_refresh_failed")
+            logger.warning(f"Firebase key refresh failed, keeping {len(self._keys)} key(s): {e}")
+            return False
+
+        match = _MAX_AGE.search(response.headers.get("cache-control", ""))
+        max_age = int(match.group(1)) if match else self.refresh_seconds
+        self._keys = keys
+        self._expires_at = time.time() + max_age
+        metrics.incr("auth.firebase.key_refreshes")
+        metrics.observe("auth.firebase.key_refresh_seconds", time.perf_counter() - started)
+        logger.info(f"Loaded {len(keys)} Firebase signing key(s), valid for {max_age}s")
+        return True
+
+    async def get(self, kid: Optional[str]) -> Optional[Any]:
+        key = self._keys.get(kid) if kid else None
+        if key is not None:
+            return key
+
+        async with self._lock:
+            key = self._keys.get(kid) if kid else None
+            if key is None and time.time() - self._last_fetch >= KEY_MIN_REFETCH_SECONDS:
+                await self.refresh()
+                key = self._keys.get(kid) if kid else None
+        if key is None and not self._keys:
+            raise AuthUnavailable("Firebase signing keys are not available")
+        return key
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            if not await self.refresh():
+                await asyncio.sleep(KEY_MIN_REFETCH_SECONDS)
+                continue
+            # Refresh ahead of expiry; stale keys stay usable meanwhile
+            await asyncio.sleep(max(60.0, (self._expires_at - time.time()) * 0.9))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+key_store = FirebaseKeyStore()
+token_cache = VerifiedTokenCache(AUTH_CACHE_SIZE)
+
+
+async def verify_firebase_token(token: str) -> Dict[str, Any]:
+    """
+    Verifies a Firebase ID token locally (RS256 signature, audience,
+    issuer, expiry, subject) and returns its claims plus "uid", like
+    firebase_admin.auth.verify_id_token. Verified tokens are cached until
+    their "exp", so repeat requests skip the signature check.
+    """
+    claims = token_cache.get(token)
+    if claims is not None:
+        metrics.incr("auth.firebase.cache_hits")
+        return claims
+    metrics.incr("auth.firebase.cache_misses")
+
+    if not FIREBASE_PROJECT_ID:
+        raise AuthUnavailable("FIREBASE_PROJECT_ID is not configured")
+
+    started = time.perf_counter()
+    try:
+        header = jwt.get_unverified_header(token)
+    except JOSEError as e:
+        raise InvalidFirebaseToken(f"Malformed token: {e}")
+    if header.get("alg") != "RS256":
+        raise InvalidFirebaseToken("Unexpected signing algorithm")
+
+    key = await key_store.get(header.get("kid"))
+    if key is None:
+        raise InvalidFirebaseToken("Token signed with an unknown key")
+
+    try:
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=["RS256"],
+            audience=FIREBASE_PROJECT_ID,
+            issuer=f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}",
+            options={"leeway": CLOCK_SKEW_SECONDS},
+        )
+    except JOSEError as e:
+        raise InvalidFirebaseToken(str(e))
+
+    subject = claims.get("sub")
+    if not isinstance(subject, str) or not subject or len(subject) > 128:
+        raise InvalidFirebaseToken("Token has an invalid subject")
+    auth_time = claims.get("auth_time")
+    if isinstance(auth_time, (int, float)) and auth_time > time.time() + CLOCK_SKEW_SECONDS:
+        raise InvalidFirebaseToken("Token auth_time is in the future")
+
+    claims["uid"] = subject
+    token_cache.put(token, claims)
+    metrics.observe("auth.firebase.verify_seconds", time.perf_counter() - started)
+    return claims
+
+
+def start_key_refresh() -> None:
+    """
+    Starts background key refresh (app startup). No-op without a project.
+    """
+    if FIREBASE_PROJECT_ID:
+        key_store.start()
+
+
+async def stop_key_refresh() -> None:
+    await key_store.stop()
+
+
+async def get_firebase_user(
+    authorization: Optional[str] = Header(default=None),
+) -> Optional[Dict[str, Any]]:
     if not authorization:
         return None  # Guest user
 
+    token = authorization.replace("Bearer ", "").strip()
     try:
-        token = authorization.replace("Bearer ", "")
-        decoded = auth.verify_id_token(token)
-        return decoded  # contains uid, email, etc
-    except Exception:
+        return await verify_firebase_token(token)  # contains uid, email, etc
+    except InvalidFirebaseToken:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid Firebase token",
         )
+    except AuthUnavailable as e:
+        logger.error(f"Firebase auth unavailable: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication is temporarily unavailable",
+            headers={"Retry-After": "5"},
+        )
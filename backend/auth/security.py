@@ -1,12 +1,100 @@
+# backend/auth/security.py
+
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from jose import jwt
+from jose import JWTError, jwt
+
+from utils.metrics import metrics
 
-SECRET_KEY = "CHANGE_THIS_IN_ENV"
+# Placeholder only: tokens are neither issued nor accepted while the secret is unset
+DEFAULT_SECRET_KEY = "CHANGE_THIS_IN_ENV"
+SECRET_KEY = os.getenv("INFRASCRIBE_JWT_SECRET", DEFAULT_SECRET_KEY)
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
+# Every token we issue names us as issuer and the API as audience, and both are required
+JWT_ISSUER = os.getenv("INFRASCRIBE_JWT_ISSUER", "infrascribe")
+JWT_AUDIENCE = os.getenv("INFRASCRIBE_JWT_AUDIENCE", "infrascribe-api")
+
+# Key rotation: INFRASCRIBE_JWT_KEYS='{"2024-06": "secret", "2024-09": "secret"}'
+# with INFRASCRIBE_JWT_ACTIVE_KID naming the signing key. Retired keys stay
+# listed until the tokens they signed have expired. Tokens without a kid
+# (issued before rotation) verify against SECRET_KEY.
+JWT_KEYS: Dict[str, str] = {
+    kid: key
+    for kid, key in json.loads(os.getenv("INFRASCRIBE_JWT_KEYS") or "{}").items()
+    if key and key != DEFAULT_SECRET_KEY
+}
+
+
+def _active_kid() -> Optional[str]:
+    # Checked at import so a bad setting stops startup instead of failing every login
+    kid = os.getenv("INFRASCRIBE_JWT_ACTIVE_KID")
+    if not kid:
+        return next(iter(JWT_KEYS), None)
+    if kid not in JWT_KEYS:
+        raise ValueError(
+            f"INFRASCRIBE_JWT_ACTIVE_KID={kid!r} does not name a usable key in "
+            "INFRASCRIBE_JWT_KEYS (missing, empty or the placeholder secret)"
+        )
+    return kid
+
+
+JWT_ACTIVE_KID = _active_kid()
+
+# New hashes use PASSWORD_SCHEME; hashes with any other scheme or work
+# factor still verify and are transparently re-hashed on the next login.
+PASSWORD_SCHEME = os.getenv("INFRASCRIBE_PASSWORD_SCHEME", "bcrypt")  # "bcrypt" | "argon2"
+BCRYPT_ROUNDS = int(os.getenv("INFRASCRIBE_BCRYPT_ROUNDS", "12"))
+# argon2id (needs argon2-cffi): time cost, memory in KiB, lanes
+ARGON2_TIME_COST = int(os.getenv("INFRASCRIBE_ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("INFRASCRIBE_ARGON2_MEMORY_COST", "65536"))
+ARGON2_PARALLELISM = int(os.getenv("INFRASCRIBE_ARGON2_PARALLELISM", "1"))
+
+# Hashing runs on its own process pool; 0 workers = the default threadpool
+PASSWORD_HASH_WORKERS = int(
+    os.getenv("INFRASCRIBE_PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2))
+)
+# Hash/verify calls allowed to wait for a worker before new ones are refused
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("INFRASCRIBE_PASSWORD_HASH_MAX_PENDING", "64"))
+
+PASSWORD_SCHEMES = ("bcrypt", "argon2")
+
+
+def _build_context() -> CryptContext:
+    if PASSWORD_SCHEME not in PASSWORD_SCHEMES:
+        raise ValueError(f"Unknown password scheme: {PASSWORD_SCHEME}")
+    schemes = [PASSWORD_SCHEME] + [s for s in PASSWORD_SCHEMES if s != PASSWORD_SCHEME]
+    return CryptContext(
+        schemes=schemes,
+        deprecated="auto",  # every scheme but the first needs a rehash
+        # min = max = default: a changed work factor (up or down) means rehash
+        bcrypt__default_rounds=BCRYPT_ROUNDS,
+        bcrypt__min_rounds=BCRYPT_ROUNDS,
+        bcrypt__max_rounds=BCRYPT_ROUNDS,
+        argon2__type="ID",
+        argon2__rounds=ARGON2_TIME_COST,
+        argon2__memory_cost=ARGON2_MEMORY_COST,
+        argon2__parallelism=ARGON2_PARALLELISM,
+    )
+
+
+pwd_context = _build_context()
+
+
+class PasswordHasherBusy(RuntimeError):
+    """
+    More hash/verify calls are waiting than PASSWORD_HASH_MAX_PENDING allows.
+    """
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -14,8 +102,114 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return pwd_context.verify(password, hashed)
 
+def verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """
+    (valid, new_hash): new_hash is set when the stored hash uses an old
+    scheme or work factor and should replace it.
+    """
+    return pwd_context.verify_and_update(password, hashed)
+
+class SigningKeyNotConfigured(RuntimeError):
+    """
+    Neither INFRASCRIBE_JWT_SECRET nor INFRASCRIBE_JWT_KEYS is set to a real
+    secret, so password tokens can be neither issued nor trusted.
+    """
+
+
+def password_tokens_enabled() -> bool:
+    return bool(JWT_KEYS) or (bool(SECRET_KEY) and SECRET_KEY != DEFAULT_SECRET_KEY)
+
 def create_access_token(data: dict):
+    if not password_tokens_enabled():
+        raise SigningKeyNotConfigured("Set INFRASCRIBE_JWT_SECRET or INFRASCRIBE_JWT_KEYS")
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iss": JWT_ISSUER, "aud": JWT_AUDIENCE})
+    if JWT_ACTIVE_KID:
+        return jwt.encode(
+            to_encode, JWT_KEYS[JWT_ACTIVE_KID], algorithm=ALGORITHM, headers={"kid": JWT_ACTIVE_KID}
+        )
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+def signing_key(kid: Optional[str]) -> Optional[str]:
+    """
+    Verification key for a token's kid header (SECRET_KEY for tokens without
+    one). None when unknown, or when SECRET_KEY is still the placeholder.
+    """
+    if kid is None:
+        return SECRET_KEY if SECRET_KEY and SECRET_KEY != DEFAULT_SECRET_KEY else None
+    return JWT_KEYS.get(kid)
+
+def decode_access_token(token: str, kid: Optional[str]) -> Dict[str, Any]:
+    """
+    Verifies signature, expiry, issuer and audience of a token we issued;
+    raises JWTError.
+    """
+    key = signing_key(kid)
+    if key is None:
+        raise JWTError(f"No verification key for key id: {kid}")
+    return jwt.decode(
+        token,
+        key,
+        algorithms=[ALGORITHM],
+        audience=JWT_AUDIENCE,
+        issuer=JWT_ISSUER,
+        options={"require_exp": True, "require_aud": True, "require_iss": True},
+    )
+
+
+# ---------------------- Process pool ---------------------- #
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_in_flight = 0
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: never fork a process that already runs an event loop + threadpool
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, PASSWORD_HASH_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def shutdown_password_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+async def _offload(operation: str, fn, *args):
+    # Bounded: beyond workers + MAX_PENDING waiting calls, refuse instead of queueing
+    global _in_flight
+    if _in_flight >= max(1, PASSWORD_HASH_WORKERS) + PASSWORD_HASH_MAX_PENDING:
+        metrics.incr("auth.password.rejected")
+        raise PasswordHasherBusy("Too many password operations in progress")
+
+    _in_flight += 1
+    started = time.perf_counter()
+    try:
+        if PASSWORD_HASH_WORKERS <= 0:
+            return await asyncio.to_thread(fn, *args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_pool(), fn, *args)
+    finally:
+        _in_flight -= 1
+        metrics.observe(f"auth.password.{operation}_seconds", time.perf_counter() - started)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _offload("hash", hash_password, password)
+
+
+async def verify_and_update_async(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    valid, new_hash = await _offload("verify", verify_and_update, password, hashed)
+    if new_hash is not None:
+        metrics.incr("auth.password.rehashed")
+    return valid, new_hash
@@ -0,0 +1,292 @@
+# backend/auth/user_store.py
+
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from utils.logger import get_logger
+from utils.metrics import metrics
+from utils.storage import connect_sqlite, data_path
+
+logger = get_logger(__name__)
+
+USER_STORE_BACKEND = os.getenv("INFRASCRIBE_USER_STORE", "sqlite")  # "sqlite" | "memory"
+USERS_DB = os.getenv("INFRASCRIBE_USERS_DB") or None
+USER_DB_POOL_SIZE = int(os.getenv("INFRASCRIBE_USER_DB_POOL_SIZE", "4"))
+# Hot lookups (login bursts) are served from memory this long. Other worker
+# processes' writes become visible after at most this delay; only rehashes
+# of the same password go through update, so a stale entry still verifies.
+USER_CACHE_SECONDS = float(os.getenv("INFRASCRIBE_USER_CACHE_SECONDS", "30"))
+USER_CACHE_SIZE = int(os.getenv("INFRASCRIBE_USER_CACHE_SIZE", "1024"))
+
+# Constant SQL text: sqlite3 keeps prepared statements per connection and
+# reuses them for identical strings.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id                INTEGER PRIMARY KEY,
+    email             TEXT NOT NULL,
+    email_normalized  TEXT NOT NULL,
+    password_hash     TEXT NOT NULL,
+    created_at        REAL NOT NULL,
+    updated_at        REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users(email_normalized);
+"""
+_SELECT_BY_EMAIL = (
+    "SELECT id, email, email_normalized, password_hash, created_at, updated_at "
+    "FROM users WHERE email_normalized = ?"
+)
+_INSERT = (
+    "INSERT INTO users (email, email_normalized, password_hash, created_at, updated_at) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+_UPDATE_PASSWORD = (
+    "UPDATE users SET password_hash = ?, updated_at = ? WHERE email_normalized = ?"
+)
+
+
+class UserExists(Exception):
+    """
+    An account with this (normalized) email already exists.
+    """
+
+
+def normalize_email(email: str) -> str:
+    # Case-insensitive on both sides of the "@", like every provider we see
+    return (email or "").strip().lower()
+
+
+class UserStore(ABC):
+    """
+    Interface of the account store used by routers/auth.py. Users are
+    dicts: {"id", "email", "email_normalized", "password_hash",
+    "created_at", "updated_at"}. A store missing a method fails when it
+    is instantiated, not on its first request.
+    """
+
+    @abstractmethod
+    async def get(self, email: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def create(self, email: str, password_hash: str) -> Dict[str, Any]:
+        ...  # raises UserExists if the normalized email is taken
+
+    @abstractmethod
+    async def update_password(self, email: str, password_hash: str) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryUserStore(UserStore):
+    """
+    Process-local store for tests and single-process development.
+    """
+
+    def __init__(self):
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    async def get(self, email: str) -> Optional[Dict[str, Any]]:
+        user = self._users.get(normalize_email(email))
+        return dict(user) if user else None
+
+    async def create(self, email: str, password_hash: str) -> Dict[str, Any]:
+        key = normalize_email(email)
+        now = time.time()
+        with self._lock:
+            if key in self._users:
+                raise UserExists(email)
+            user = {
+                "id": len(self._users) + 1,
+                "email": email.strip(),
+                "email_normalized": key,
+                "password_hash": password_hash,
+                "created_at": now,
+                "updated_at": now,
+            }
+            self._users[key] = user
+        return dict(user)
+
+    async def update_password(self, email: str, password_hash: str) -> None:
+        with self._lock:
+            user = self._users.get(normalize_email(email))
+            if user is not None:
+                user.update(password_hash=password_hash, updated_at=time.time())
+
+
+class SQLiteUserStore(UserStore):
+    """
+    SQLite (WAL) store shared by all uvicorn workers on the host, with a
+    unique index on the normalized email, a small connection pool and a
+    read-through LRU/TTL cache in front of lookups.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = USERS_DB,
+        pool_size: int = USER_DB_POOL_SIZE,
+        cache_seconds: float = USER_CACHE_SECONDS,
+        cache_size: int = USER_CACHE_SIZE,
+    ):
+        self.db_path = db_path or str(data_path("users.sqlite3"))
+        self.pool_size = max(1, pool_size)
+        self.cache_seconds = cache_seconds
+        self.cache_size = max(1, cache_size)
+
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._created = 0
+        self._pool_lock = threading.Lock()
+        self._cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    # ---------------------- Connections ---------------------- #
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = connect_sqlite(self.db_path, check_same_thread=False)
+        conn.executescript(_SCHEMA)
+        return conn
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        # Opened lazily up to pool_size, then callers wait for a free one
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                create = self._created < self.pool_size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._pool_lock:
+                        self._created -= 1
+                    raise
+            else:
+                conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._pool_lock:
+            self._created = 0
+
+    # ---------------------- Cache ---------------------- #
+
+    def _cached(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[0]:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return dict(entry[1])
+
+    def _remember(self, key: str, user: Dict[str, Any]) -> None:
+        if self.cache_seconds <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = (time.monotonic() + self.cache_seconds, dict(user))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget(self, key: str) -> None:
+        with self._cache_lock:
+            self._cache.pop(key, None)
+
+    # ---------------------- Queries ---------------------- #
+
+    def _select(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._connection() as conn:
+            row = conn.execute(_SELECT_BY_EMAIL, (key,)).fetchone()
+        return dict(row) if row else None
+
+    def _insert(self, email: str, key: str, password_hash: str) -> Dict[str, Any]:
+        now = time.time()
+        with self._connection() as conn:
+            try:
+                cursor = conn.execute(_INSERT, (email, key, password_hash, now, now))
+            except sqlite3.IntegrityError:
+                raise UserExists(email)
+        return {
+            "id": cursor.lastrowid,
+            "email": email,
+            "email_normalized": key,
+            "password_hash": password_hash,
+            "created_at": now,
+            "updated_at": now,
+        }
+
+    def _update(self, key: str, password_hash: str) -> None:
+        with self._connection() as conn:
+            conn.execute(_UPDATE_PASSWORD, (password_hash, time.time(), key))
+
+    async def get(self, email: str) -> Optional[Dict[str, Any]]:
+        key = normalize_email(email)
+        user = self._cached(key)
+        if user is not None:
+            metrics.incr("users.cache_hits")
+            return user
+
+        metrics.incr("users.cache_misses")
+        user = await asyncio.to_thread(self._select, key)
+        if user is not None:
+            # Misses are not cached: a signup on another worker must show up at once
+            self._remember(key, user)
+        return user
+
+    async def create(self, email: str, password_hash: str) -> Dict[str, Any]:
+        key = normalize_email(email)
+        user = await asyncio.to_thread(self._insert, email.strip(), key, password_hash)
+        self._remember(key, user)
+        return dict(user)
+
+    async def update_password(self, email: str, password_hash: str) -> None:
+        key = normalize_email(email)
+        self._forget(key)
+        await asyncio.to_thread(self._update, key, password_hash)
+
+
+_store: Optional[UserStore] = None
+
+
+def get_user_store() -> UserStore:
+    """
+    Shared store, chosen by INFRASCRIBE_USER_STORE on first use.
+    """
+    global _store
+    if _store is None:
+        if USER_STORE_BACKEND.lower() == "memory":
+            _store = MemoryUserStore()
+        else:
+            _store = SQLiteUserStore()
+        logger.info(f"User store: {type(_store).__name__}")
+    return _store
+
+
+def close_user_store() -> None:
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
@@ -0,0 +1,585 @@
+# backend/cli.py
+"""
+Offline InfraScribe CLI.
+
+Runs the rule-based generator without the FastAPI app or an event loop,
+fanning specs out across CPU cores. Spec files use the same shape as
+POST /api/generate/batch: a list of GenerateRequest objects, or a monorepo
+manifest {"name", "defaults", "services"}.
+
+    python cli.py generate specs.json --out ./bundles
+    python cli.py generate specs.yaml --out ./bundles --format zip --workers 8
+    cat specs.json | python cli.py generate - --out ./bundles
+
+    # Pre-explain every rule-based artefact so /explain serves them locally
+    python cli.py build-explain-index --concurrency 8
+
+    # Logins/sec and tail latency with concurrent signups (password hashing)
+    python cli.py bench-auth --logins 500 --signups 100 --concurrency 32 --rounds 12
+
+    # Model usage (tokens, cost, latency) of the last 7 days per caller
+    python cli.py usage-report --days 7 --by subject
+
+    # Shared cache: stand-in Redis-protocol server, and per-backend latency
+    python cli.py cache-server --port 6380
+    python cli.py bench-cache --ops 5000 --value-kb 32
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.batch_generation_service import is_ai_mode, parse_manifest, spec_key
+from services.generation_service import GenerationService
+from utils.zip_builder import write_result_to_dir, write_zip_from_result
+
+_service: Optional[GenerationService] = None
+
+
+def _load_specs(source: str) -> Any:
+    text = sys.stdin.read() if source == "-" else Path(source).read_text(encoding="utf-8")
+
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    try:
+        import yaml
+    except ImportError:
+        raise SystemExit("Spec is not valid JSON and PyYAML is not installed for YAML input")
+
+    return yaml.safe_load(text)
+
+
+def _generate_and_write(
+    name: str,
+    spec: Dict[str, Any],
+    out_dir: str,
+    fmt: str,
+) -> Tuple[str, int, int]:
+    """
+    Worker entry point: generate one bundle and write it straight to disk,
+    so only a small summary travels back to the parent process.
+    """
+    global _service
+    if _service is None:
+        _service = GenerationService()
+
+    result = _service.generate_sync(SimpleNamespace(**spec))
+
+    if fmt == "zip":
+        target = Path(out_dir) / f"{name}.zip"
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, "wb") as fh:
+            write_zip_from_result(result, fh)
+        return name, 1, target.stat().st_size
+
+    files, size = write_result_to_dir(result, Path(out_dir) / name)
+    return name, files, size
+
+
+def _prepare(data: Any) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Validates every spec as a GenerateRequest (as POST /api/generate/batch
+    does), so defaults are applied before identical specs are deduplicated.
+    Reports all invalid specs, one error per line, before giving up.
+    """
+    from pydantic import ValidationError
+
+    from routers.generate import GenerateRequest
+
+    try:
+        _, services = parse_manifest(data)
+    except ValueError as e:
+        raise SystemExit(f"error: {e}")
+
+    prepared = []
+    errors = []
+    for name, spec in services:
+        try:
+            spec = GenerateRequest(**spec).model_dump()
+        except ValidationError as e:
+            for error in e.errors():
+                location = ".".join(str(part) for part in error["loc"]) or "spec"
+                errors.append(f"error: {name}: {location}: {error['msg']}")
+            continue
+        if is_ai_mode(spec["mode"]):
+            print(
+                f"warning: {name}: {spec['mode']} is not available offline, using rule_based",
+                file=sys.stderr,
+            )
+        spec["mode"] = "rule_based"
+        prepared.append((name, spec))
+
+    if errors:
+        print("\n".join(errors), file=sys.stderr)
+        raise SystemExit(f"{len(errors)} invalid field(s) in the spec file")
+    return prepared
+
+
+def cmd_generate(args: argparse.Namespace) -> int:
+    if not args.verbose:
+        # Per-bundle INFO lines drown the summary when generating hundreds of repos
+        logging.getLogger("services.generation_service").setLevel(logging.WARNING)
+
+    services = _prepare(_load_specs(args.specs))
+    out_dir = str(Path(args.out).resolve())
+
+    # Identical specs are generated once and copied under every name
+    first_by_key: Dict[str, str] = {}
+    for name, spec in services:
+        first_by_key.setdefault(spec_key(spec), name)
+
+    started = time.perf_counter()
+    files_total = 0
+    bytes_total = 0
+
+    unique_jobs = [(name, spec) for name, spec in services if first_by_key[spec_key(spec)] == name]
+    workers = max(1, args.workers)
+
+    if workers == 1 or len(unique_jobs) == 1:
+        summaries = [
+            _generate_and_write(name, spec, out_dir, args.format) for name, spec in unique_jobs
+        ]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_generate_and_write, name, spec, out_dir, args.format)
+                for name, spec in unique_jobs
+            ]
+            summaries = [f.result() for f in futures]
+
+    # Duplicates: reuse the first rendering instead of regenerating
+    by_name = {name: (files, size) for name, files, size in summaries}
+    for name, spec in services:
+        first = first_by_key[spec_key(spec)]
+        if first != name:
+            summaries.append(_copy_output(first, name, out_dir, args.format, by_name[first]))
+
+    for name, files, size in summaries:
+        files_total += files
+        bytes_total += size
+        if args.verbose:
+            print(f"{name}: {files} file(s), {size} bytes")
+
+    elapsed = time.perf_counter() - started
+    rate = len(services) / elapsed if elapsed > 0 else float("inf")
+    print(
+        f"Generated {len(services)} bundle(s) "
+        f"({len(first_by_key)} unique, {files_total} files, {bytes_total / 1024:.1f} KiB) "
+        f"in {elapsed:.2f}s – {rate:.1f} bundles/s with {workers} worker(s) → {out_dir}"
+    )
+    return 0
+
+
+def _copy_output(
+    source: str,
+    name: str,
+    out_dir: str,
+    fmt: str,
+    summary: Tuple[int, int],
+) -> Tuple[str, int, int]:
+    root = Path(out_dir)
+    if fmt == "zip":
+        dest = root / f"{name}.zip"
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(root / f"{source}.zip", dest)
+    else:
+        shutil.copytree(root / source, root / name, dirs_exist_ok=True)
+    return name, summary[0], summary[1]
+
+
+def cmd_build_explain_index(args: argparse.Namespace) -> int:
+    """
+    Explain every distinct rule-based artefact once and store the result
+    in the explanation index. Incremental: already indexed content is skipped.
+    """
+    from services.explain_index import ExplanationIndex, content_key, iter_rule_based_artifacts
+    from services.explain_service import EXPLAIN_MODEL, explain_with_model
+
+    logging.getLogger("services.generation_service").setLevel(logging.WARNING)
+    index = ExplanationIndex(Path(args.index)) if args.index else ExplanationIndex()
+
+    artifacts = list(iter_rule_based_artifacts())
+    todo = [(name, body) for name, body in artifacts if content_key(body) not in index]
+    print(f"{len(artifacts)} distinct artefacts, {len(todo)} to explain → {index.path}")
+    if args.dry_run or not todo:
+        return 0
+
+    async def run() -> int:
+        semaphore = asyncio.Semaphore(max(1, args.concurrency))
+        failures = 0
+
+        async def explain_one(name: str, body: str) -> None:
+            nonlocal failures
+            async with semaphore:
+                try:
+                    text, _ = await explain_with_model(os.path.basename(name), None, body)
+                except Exception as e:
+                    failures += 1
+                    print(f"error: {name}: {type(e).__name__}: {e}", file=sys.stderr)
+                    return
+            if text:
+                index.add(body, name, text)
+                if args.verbose:
+                    print(f"explained {name}")
+
+        await asyncio.gather(*(explain_one(name, body) for name, body in todo))
+        return failures
+
+    started = time.perf_counter()
+    failures = asyncio.run(run())
+    index.save(model=EXPLAIN_MODEL)
+    print(
+        f"Index has {len(index)} entries ({failures} failed) "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+    return 1 if failures else 0
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def cmd_bench_auth(args: argparse.Namespace) -> int:
+    """
+    Drives the real /api/auth routes in-process (ASGI, no network): seeds
+    users, then runs logins and new signups concurrently and reports login
+    throughput and latency percentiles.
+    """
+    # Hashing settings are read at import time, so set them first
+    if args.scheme:
+        os.environ["INFRASCRIBE_PASSWORD_SCHEME"] = args.scheme
+    if args.rounds is not None:
+        os.environ["INFRASCRIBE_BCRYPT_ROUNDS"] = str(args.rounds)
+    if args.workers is not None:
+        os.environ["INFRASCRIBE_PASSWORD_HASH_WORKERS"] = str(args.workers)
+    # A throwaway user database, so runs never collide with real accounts
+    bench_dir = tempfile.mkdtemp(prefix="infrascribe-bench-")
+    os.environ["INFRASCRIBE_USERS_DB"] = os.path.join(bench_dir, "users.sqlite3")
+    # Logins issue tokens, which needs a signing secret
+    os.environ.setdefault("INFRASCRIBE_JWT_SECRET", secrets.token_hex(32))
+
+    import httpx
+    from fastapi import FastAPI
+
+    from auth.security import PASSWORD_HASH_WORKERS, PASSWORD_SCHEME, shutdown_password_pool
+    from auth.user_store import close_user_store
+    from routers import auth as auth_router
+
+    app = FastAPI()
+    app.include_router(auth_router.router, prefix="/api/auth")  # as in app.py
+    signup_path, login_path = app.url_path_for("signup"), app.url_path_for("login")
+    password = "bench-password-123"
+
+    async def run() -> Tuple[List[float], Dict[int, int], float, int]:
+        transport = httpx.ASGITransport(app=app)
+        semaphore = asyncio.Semaphore(max(1, args.concurrency))
+        latencies: List[float] = []
+        statuses: Dict[int, int] = {}
+        signup_errors = 0
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+            async def signup(index: int) -> None:
+                nonlocal signup_errors
+                async with semaphore:
+                    response = await client.post(
+                        signup_path,
+                        json={"email": f"user{index}@example.com", "password": password},
+                    )
+                if response.status_code != 200:
+                    signup_errors += 1
+
+            async def login(index: int) -> None:
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.post(
+                        login_path,
+                        json={"email": f"user{index % args.users}@example.com", "password": password},
+                    )
+                    latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            await asyncio.gather(*(signup(i) for i in range(args.users)))
+
+            started = time.perf_counter()
+            await asyncio.gather(
+                *(login(i) for i in range(args.logins)),
+                *(signup(args.users + i) for i in range(args.signups)),
+            )
+            return latencies, statuses, time.perf_counter() - started, signup_errors
+
+    try:
+        latencies, statuses, elapsed, signup_errors = asyncio.run(run())
+    finally:
+        shutdown_password_pool()
+        close_user_store()
+        shutil.rmtree(bench_dir, ignore_errors=True)
+
+    ok = statuses.get(200, 0)
+    print(
+        f"{PASSWORD_SCHEME} (bcrypt rounds {os.getenv('INFRASCRIBE_BCRYPT_ROUNDS', '12')}), "
+        f"{PASSWORD_HASH_WORKERS} hash worker(s), concurrency {args.concurrency}"
+    )
+    print(
+        f"{len(latencies)} logins + {args.signups} signups in {elapsed:.2f}s – "
+        f"{ok / elapsed:.1f} logins/s"
+    )
+    print(
+        "login latency ms: "
+        + ", ".join(
+            f"p{pct}={_percentile(latencies, pct) * 1000:.1f}" for pct in (50, 95, 99)
+        )
+        + f", max={max(latencies) * 1000:.1f}"
+    )
+    print(f"login status codes: {dict(sorted(statuses.items()))}; signup errors: {signup_errors}")
+    return 0 if ok == len(latencies) and not signup_errors else 1
+
+
+def cmd_usage_report(args: argparse.Namespace) -> int:
+    from services.usage_ledger import usage_ledger
+
+    rows = usage_ledger.report(days=args.days, group_by=args.by)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+
+    print(
+        f"{args.by:<40} {'calls':>7} {'prompt':>10} {'completion':>11} "
+        f"{'cached':>10} {'cost_usd':>10} {'avg_ms':>9} {'max_ms':>9}"
+    )
+    for row in rows:
+        print(
+            f"{str(row['name'])[:40]:<40} {row['calls']:>7} {row['prompt_tokens']:>10} "
+            f"{row['completion_tokens']:>11} {row['cached_tokens']:>10} "
+            f"{row['cost_usd']:>10.4f} {row['avg_latency_ms']:>9.0f} {row['max_latency_ms']:>9.0f}"
+        )
+    return 0
+
+
+def cmd_cache_server(args: argparse.Namespace) -> int:
+    from utils.cache_server import CacheServer
+
+    server = CacheServer(max_bytes=args.max_mb * 1024 * 1024, password=args.password)
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_bench_cache(args: argparse.Namespace) -> int:
+    """
+    Times set / get (hit) / get (miss) through SharedCache for each backend
+    with the same payload (a generation-result-shaped JSON document of about
+    --value-kb), including serialization, and reports ops/s and latency
+    percentiles. "redis" uses --url, or a stand-in server process on a free port.
+    """
+    bench_dir = tempfile.mkdtemp(prefix="infrascribe-cache-bench-")
+
+    from utils.shared_cache import (
+        CacheBackendError,
+        MemoryCacheBackend,
+        RedisCacheBackend,
+        SharedCache,
+        SQLiteCacheBackend,
+    )
+
+    files = max(1, args.value_kb // 2)
+    # Mostly-text values like real bundles, so compression ratios are realistic
+    value = {
+        "files": {
+            f"path/file_{i}.yaml": "\n".join(
+                f"key_{i}_{j}: value-{(i * 31 + j * 7) % 97}" for j in range(80)
+            )[:2048]
+            for i in range(files)
+        },
+        "summary": "benchmark payload",
+    }
+
+    async def bench(backend) -> Dict[str, Tuple[List[float], float]]:
+        cache = SharedCache(backend, default_ttl=600)
+        semaphore = asyncio.Semaphore(max(1, args.concurrency))
+        keys = [f"k{i}" for i in range(args.ops)]
+        phases = {
+            "set": lambda key: cache.set("bench", key, value),
+            "get": lambda key: cache.get("bench", key),
+            "miss": lambda key: cache.get("bench", f"absent-{key}"),
+        }
+        results: Dict[str, Tuple[List[float], float]] = {}
+        for op, call in phases.items():
+            latencies: List[float] = []
+
+            async def timed(key: str) -> None:
+                async with semaphore:
+                    started = time.perf_counter()
+                    await call(key)
+                    latencies.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(timed(key) for key in keys))
+            results[op] = (latencies, time.perf_counter() - started)
+        return results
+
+    def run_redis() -> Dict[str, Tuple[List[float], float]]:
+        server = None
+        url = args.url
+        if not url:
+            # Stand-in server in its own process, as it would be deployed
+            with socket.socket() as probe:
+                probe.bind(("127.0.0.1", 0))
+                port = probe.getsockname()[1]
+            server = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "cache-server", "--port", str(port)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            url = f"redis://127.0.0.1:{port}/0"
+        backend = RedisCacheBackend(url, pool_size=args.concurrency)
+        try:
+            deadline = time.monotonic() + 10
+            while True:
+                try:
+                    backend.command("PING")
+                    break
+                except CacheBackendError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.05)
+            return asyncio.run(bench(backend))
+        finally:
+            if args.url:
+                backend.clear()
+            backend.close()
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    print(
+        f"{args.ops} ops per phase, ~{args.value_kb} KiB values, concurrency {args.concurrency}"
+    )
+    print(f"{'backend':<8} {'op':<5} {'ops/s':>9} {'p50_ms':>8} {'p99_ms':>8} {'max_ms':>8}")
+    try:
+        for name in args.backends:
+            if name == "memory":
+                timings = asyncio.run(bench(MemoryCacheBackend()))
+            elif name == "sqlite":
+                backend = SQLiteCacheBackend(os.path.join(bench_dir, "cache.sqlite3"))
+                try:
+                    timings = asyncio.run(bench(backend))
+                finally:
+                    backend.close()
+            else:
+                timings = run_redis()
+            for op, (values, elapsed) in timings.items():
+                print(
+                    f"{name:<8} {op:<5} {len(values) / elapsed:>9.0f} "
+                    f"{_percentile(values, 50) * 1000:>8.3f} {_percentile(values, 99) * 1000:>8.3f} "
+                    f"{max(values) * 1000:>8.3f}"
+                )
+    finally:
+        shutil.rmtree(bench_dir, ignore_errors=True)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="infrascribe", description="Offline InfraScribe tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="Generate bundles from a spec file")
+    gen.add_argument("specs", help="JSON/YAML spec file, or '-' for stdin")
+    gen.add_argument("--out", default="./infrascribe-out", help="Output directory")
+    gen.add_argument(
+        "--format",
+        choices=("dir", "zip"),
+        default="dir",
+        help="Write a directory tree per service, or one ZIP per service",
+    )
+    gen.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes (default: CPU count)",
+    )
+    gen.add_argument("-v", "--verbose", action="store_true")
+    gen.set_defaults(func=cmd_generate)
+
+    idx = sub.add_parser(
+        "build-explain-index",
+        help="Pre-compute explanations for all rule-based artefacts (needs OPENAI_API_KEY)",
+    )
+    idx.add_argument("--index", help="Index file (default: templates/explanations/index.json)")
+    idx.add_argument("--concurrency", type=int, default=4, help="Parallel model calls")
+    idx.add_argument("--dry-run", action="store_true", help="Only count what would be explained")
+    idx.add_argument("-v", "--verbose", action="store_true")
+    idx.set_defaults(func=cmd_build_explain_index)
+
+    bench = sub.add_parser(
+        "bench-auth",
+        help="Benchmark login throughput and latency under concurrent signups",
+    )
+    bench.add_argument("--users", type=int, default=50, help="Accounts created before timing")
+    bench.add_argument("--logins", type=int, default=500, help="Timed logins")
+    bench.add_argument("--signups", type=int, default=100, help="Signups during the timed run")
+    bench.add_argument("--concurrency", type=int, default=32, help="Requests in flight")
+    bench.add_argument("--scheme", choices=("bcrypt", "argon2"), help="Password hash scheme")
+    bench.add_argument("--rounds", type=int, help="bcrypt work factor (log2 rounds)")
+    bench.add_argument("--workers", type=int, help="Hash worker processes (0 = threadpool)")
+    bench.set_defaults(func=cmd_bench_auth)
+
+    usage = sub.add_parser("usage-report", help="Model usage and cost from the usage ledger")
+    usage.add_argument("--days", type=int, default=7, help="Look back this many days")
+    usage.add_argument(
+        "--by", choices=("subject", "operation", "model"), default="subject", help="Group rows by"
+    )
+    usage.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+    usage.set_defaults(func=cmd_usage_report)
+
+    server = sub.add_parser(
+        "cache-server", help="Run a stand-in Redis-protocol server for the shared cache"
+    )
+    server.add_argument("--host", default="127.0.0.1")
+    server.add_argument("--port", type=int, default=6380)
+    server.add_argument("--max-mb", type=int, default=256, help="Memory cap per database")
+    server.add_argument("--password", help="Require AUTH with this password")
+    server.set_defaults(func=cmd_cache_server)
+
+    bench_cache = sub.add_parser("bench-cache", help="Benchmark the shared cache backends")
+    bench_cache.add_argument(
+        "--backends",
+        nargs="+",
+        choices=("memory", "sqlite", "redis"),
+        default=["memory", "sqlite", "redis"],
+    )
+    bench_cache.add_argument("--ops", type=int, default=2000, help="Operations per phase")
+    bench_cache.add_argument("--value-kb", type=int, default=32, help="Approximate value size")
+    bench_cache.add_argument("--concurrency", type=int, default=8, help="Operations in flight")
+    bench_cache.add_argument("--url", help="Benchmark this Redis server instead of a stand-in")
+    bench_cache.set_defaults(func=cmd_bench_cache)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
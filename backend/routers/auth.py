@@ -1,12 +1,16 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, EmailStr
-from auth.security import hash_password, verify_password, create_access_token
+from auth.security import (
+    PasswordHasherBusy,
+    SigningKeyNotConfigured,
+    create_access_token,
+    hash_password_async,
+    verify_and_update_async,
+)
+from auth.user_store import UserExists, get_user_store
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-# TEMP in-memory store (replace with DB later)
-USERS = {}
-
 class SignupRequest(BaseModel):
     email: EmailStr
     password: str
@@ -15,19 +19,44 @@ class LoginRequest(BaseModel):
     email: EmailStr
     password: str
 
+def _busy(e: PasswordHasherBusy) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
 @router.post("/signup")
-def signup(payload: SignupRequest):
-    if payload.email in USERS:
+async def signup(payload: SignupRequest):
+    users = get_user_store()
+    if await users.get(payload.email):
         raise HTTPException(status_code=400, detail="User already exists")
 
-    USERS[payload.email] = hash_password(payload.password)
+    try:
+        hashed = await hash_password_async(payload.password)
+    except PasswordHasherBusy as e:
+        raise _busy(e)
+    try:
+        # The unique email index settles concurrent signups across workers
+        await users.create(payload.email, hashed)
+    except UserExists:
+        raise HTTPException(status_code=400, detail="User already exists")
     return {"message": "Account created"}
 
 @router.post("/login")
-def login(payload: LoginRequest):
-    hashed = USERS.get(payload.email)
-    if not hashed or not verify_password(payload.password, hashed):
+async def login(payload: LoginRequest):
+    users = get_user_store()
+    user = await users.get(payload.email)
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-
-    token = create_access_token({"sub": payload.email})
+    try:
+        valid, new_hash = await verify_and_update_async(payload.password, user["password_hash"])
+    except PasswordHasherBusy as e:
+        raise _busy(e)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash is not None:
+        # Scheme or work factor changed since this hash was made
+        await users.update_password(payload.email, new_hash)
+
+    try:
+        token = create_access_token({"sub": user["email_normalized"]})
+    except SigningKeyNotConfigured:
+        raise HTTPException(status_code=503, detail="Password sign-in is not configured")
     return {"access_token": token, "token_type": "bearer"}
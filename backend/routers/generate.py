@@ -1,24 +1,96 @@
 # backend/routers/generate.py
 
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple, Union
 
-from fastapi import APIRouter, HTTPException, Body
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+import asyncio
+import hashlib
+import json
+from types import SimpleNamespace
+
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
 import io
 import zipfile
 import os
-from openai import OpenAI  # use the same client lib you're already using
-
-client = OpenAI()
+import threading
 
+from services.artifact_store import artifact_store
 from services.generation_service import GenerationService
+from services.batch_generation_service import (
+    BatchGenerationService,
+    is_ai_mode,
+    parse_manifest,
+    spec_key,
+)
+from services.explain_service import (
+    EMPTY_FILE_EXPLANATION,
+    EXPLAIN_BATCH_MAX_FILES,
+    explain_many,
+    resolve_explanation,
+    stream_explanation,
+)
+from services.job_queue import JobQueue, QueueFullError
+from services.refine_service import check_refine_request, refine, stream_refine
+from services.usage_ledger import (
+    DAILY_COST_QUOTA_USD,
+    DAILY_TOKEN_QUOTA,
+    UNATTRIBUTED,
+    enforce_usage_quota,
+    set_usage_subject,
+    usage_ledger,
+    utc_day,
+)
+from utils.cancellation import (
+    RequestCancelled,
+    cancellation_http_error,
+    request_deadline,
+    run_cancellable,
+)
 from utils.logger import get_logger
-from utils.zip_builder import build_zip_from_result
+from utils.metrics import metrics
+from utils.rate_limit import client_key, enforce_rate_limit, rate_limited
+from utils.shared_cache import shared_cache
+from utils.token_budget import TokenBudgetExceeded
+from utils.sse import SSE_HEADERS, pump_events
+from utils.zip_builder import build_zip_from_result, iter_bundle_files, iter_monorepo_zip
 
 router = APIRouter()
 logger = get_logger(__name__)
 generation_service = GenerationService()
+batch_generation_service = BatchGenerationService(generation_service)
+
+# A finished AI upgrade is handed out again for identical requests this long
+UPGRADE_REUSE_SECONDS = int(os.getenv("INFRASCRIBE_UPGRADE_REUSE_SECONDS", "3600"))
+# Built ZIP bundles by result_id in the shared cache tier
+ZIP_CACHE_TTL_SECONDS = int(os.getenv("INFRASCRIBE_ZIP_CACHE_TTL_SECONDS", "3600"))
+
+# Model-backed routes: "ai" rate-limit budget, then the caller's daily usage quota
+AI_ROUTE_DEPENDENCIES = [Depends(rate_limited("ai")), Depends(enforce_usage_quota)]
+
+
+async def _run_generate_job(spec: Dict[str, Any], progress) -> Dict[str, Any]:
+    """
+    Job-queue runner for POST /api/generate?async=1 and speculative upgrades.
+    Model calls are billed to the caller who queued the job.
+    """
+    spec = dict(spec)
+    subject = spec.pop("subject", None)
+    set_usage_subject(subject or UNATTRIBUTED)
+    payload = SimpleNamespace(**spec)
+    mode = (spec.get("mode") or "rule_based").lower()
+
+    progress("generating", {"mode": mode})
+    if mode in ("ai_thick", "ai_speculative"):
+        result_dict = await generation_service.generate_ai_thick(payload)
+    else:
+        result_dict = await generation_service.generate(payload)
+
+    progress("validating")
+    return await _store_result(result_dict, subject)
+
+
+job_queue = JobQueue(runners={"generate": _run_generate_job})
 
 
 class GenerateRequest(BaseModel):
@@ -27,7 +99,7 @@ class GenerateRequest(BaseModel):
     """
     language: str                       # e.g. "python", "node", "java"
     framework: Optional[str] = None     # e.g. "flask", "express", "spring"
-    repo_url: Optional[str] = None      # optional GitHub repo for context (future use)
+    repo_url: Optional[str] = None      # local path / file:// URL of a checkout to analyse
     cicd_tool: str = "github_actions"   # "github_actions" | "jenkins" | "gitlab_ci"
     deploy_target: str = "kubernetes"   # "kubernetes" | "helm"
     cloud_provider: Optional[str] = "aws"   # "aws" | "gcp" | "azure" | None
@@ -35,7 +107,7 @@ class GenerateRequest(BaseModel):
     include_monitoring: bool = False
     infra_preset: Optional[str] = "all"     # "eks" | "ec2-k3s" | "ecs-fargate" | "all" | "none"
     extra_context: Optional[str] = None     # free-text description of the app
-    mode: str = "rule_based"
+    mode: str = "rule_based"            # "rule_based" | "ai_thick" | "ai_speculative"
 
 class GenerateResponse(BaseModel):
     """
@@ -52,6 +124,8 @@ class GenerateResponse(BaseModel):
     raw: Optional[Dict[str, Any]] = None
     explanation: Optional[str] = None
     readme_md: Optional[str] = None
+    upgrade: Optional[Dict[str, Any]] = None   # ai_speculative: background AI run, see below
+    result_id: Optional[str] = None            # stored result: GET /api/generate/{result_id}
 
 
 class BundlePayload(BaseModel):
@@ -69,6 +143,19 @@ class BundlePayload(BaseModel):
     terraform_configs: Optional[Dict[str, Dict[str, str]]] = None
     raw: Optional[Dict[str, Any]] = None
 
+class MonorepoManifest(BaseModel):
+    """
+    Batch payload for /batch.
+
+    `defaults` holds GenerateRequest fields shared by every service; each entry
+    in `services` overrides them and must carry a `name` (or `path`) that
+    becomes its folder in the combined archive.
+    """
+    name: str = "monorepo"
+    defaults: Dict[str, Any] = {}
+    services: List[Dict[str, Any]]
+
+
 class ExplainRequest(BaseModel):
     filename: str
     content: str
@@ -80,6 +167,8 @@ class ExplainRequest(BaseModel):
 class ExplainResponse(BaseModel):
 
     explanation: str
+    source: Optional[str] = None             # "index" | "cache" | "model"
+    usage: Optional[Dict[str, Any]] = None   # tokens + routed model, when the model was called
 
 class RefineRequest(BaseModel):
     filename: str
@@ -87,10 +176,15 @@ class RefineRequest(BaseModel):
     instructions: str     # what the user wants to change
     label: Optional[str] = None
     stack: Optional[str] = None  # optional context (language/framework)
+    mode: str = "full"    # "full" | "diff" | "auto" (diff for long files)
 
 
 class RefineResponse(BaseModel):
     updated_content: str
+    patch: Optional[str] = None          # unified diff, when the model returned one
+    applied_mode: Optional[str] = None   # "full" | "diff" | "full_fallback"
+    usage: Optional[Dict[str, Any]] = None   # token counts, routed model, escalations
+    validation: Optional[Dict[str, Any]] = None  # {"kind", "errors", "ms", "retried", ...}
 
 
 
@@ -159,10 +253,33 @@ def download_zip(bundle: BundlePayload = Body(...)):
 
 
 @router.post("/", response_model=GenerateResponse)
-async def generate_infra(payload: GenerateRequest) -> GenerateResponse:
+async def generate_infra(
+    payload: GenerateRequest,
+    request: Request,
+    async_mode: bool = Query(False, alias="async"),
+) -> GenerateResponse:
     """
     Main InfraScribe endpoint – returns JSON with all configs.
+
+    With ?async=1 the request is queued instead and a job ID is returned at
+    once (202); poll /jobs/{job_id} or subscribe to /jobs/{job_id}/events.
+
+    mode="ai_speculative" returns the rule-based bundle right away plus an
+    `upgrade` token: the ai_thick bundle is generated in the background and
+    fetched from upgrade.status_url or pushed over upgrade.events_url.
+
+    AI modes (including the speculative upgrade) spend the caller's "ai"
+    rate-limit budget and count against the daily usage quota, rule_based
+    only the cheaper "rule_based" budget.
     """
+    bucket = generation_bucket(payload.mode)
+    await enforce_rate_limit(request, bucket)
+    if bucket == "ai":
+        await enforce_usage_quota(request)
+
+    if async_mode:
+        return await _submit_generate_job(payload, client_key(request))
+
     try:
         logger.info(
             "Generation request received",
@@ -179,15 +296,28 @@ async def generate_infra(payload: GenerateRequest) -> GenerateResponse:
         mode = (payload.mode or "rule_based").lower()
 
         if mode == "ai_thick":
-            # For now, this just calls the same rule-based generator.
-            # Later we’ll plug in the AI Thick-Mode implementation here.
-            result_dict = await generation_service.generate_ai_thick(payload)
+            # Cancelled with the request if the client leaves or the deadline passes
+            result_dict = await run_cancellable(
+                request,
+                generation_service.generate_ai_thick(payload),
+                "generate_ai_thick",
+            )
+        elif mode == "ai_speculative":
+            result_dict = await generation_service.generate(payload)
+            stored = await _store_result(result_dict, client_key(request))
+            await _record_history(request, payload, stored["result_id"])
+            stored["upgrade"] = await _submit_upgrade(payload, client_key(request))
+            return GenerateResponse(**stored)
         else:
             # Existing rule-based generator
             result_dict = await generation_service.generate(payload)
 
-        return GenerateResponse(**result_dict)
+        stored = await _store_result(result_dict, client_key(request))
+        await _record_history(request, payload, stored["result_id"])
+        return GenerateResponse(**stored)
 
+    except RequestCancelled as e:
+        raise cancellation_http_error(e)
 
     except ValueError as e:
         logger.warning(f"Bad request for generate_infra: {e}")
@@ -199,54 +329,24 @@ async def generate_infra(payload: GenerateRequest) -> GenerateResponse:
             status_code=500,
             detail="Internal server error while generating infrastructure config.",
         )
-@router.post("/explain", response_model=ExplainResponse)
-def explain_file(req: ExplainRequest):
+@router.post("/explain", response_model=ExplainResponse, dependencies=AI_ROUTE_DEPENDENCIES)
+async def explain_file(req: ExplainRequest, request: Request):
     """
     Return a human-friendly explanation for a generated file.
     Always returns 200 with either an explanation or a graceful error message.
     """
     if not req.content.strip():
         # Don't throw 400, just explain why there's no explanation
-        return ExplainResponse(
-            explanation="This file is empty, so there is nothing to explain yet."
-        )
-
-    user_prompt = f"""
-You are InfraScribe, a DevOps assistant. Explain the following file to a developer
-in clear, concise language.
-
-File name: {req.filename}
-Label: {req.label or ""}
-
-File content:
-----------------
-{req.content}
-----------------
-
-Explain in this structure:
-1. Purpose – 2–4 sentences describing what this file does.
-2. Key settings – bullet points for the most important fields and what they control.
-3. Safe edits – bullet points for things the user can safely tweak (like replicas, image tag, resource limits, regions, ports).
-4. Cautions – bullet points for things they should be careful about before changing.
-
-Use Markdown-style bullets and short paragraphs.
-"""
+        return ExplainResponse(explanation=EMPTY_FILE_EXPLANATION)
 
     try:
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a DevOps expert who explains config files in simple language.",
-                },
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.3,
+        # Index (offline, rule-based artefacts) → in-process cache → model
+        explanation_text, source, usage = await run_cancellable(
+            request,
+            resolve_explanation(req.filename, req.label, req.content),
+            "explain",
         )
 
-        explanation_text = (completion.choices[0].message.content or "").strip()
-
         if not explanation_text:
             # Model responded but with empty content
             return ExplainResponse(
@@ -257,7 +357,26 @@ Use Markdown-style bullets and short paragraphs.
                 )
             )
 
-        return ExplainResponse(explanation=explanation_text)
+        return ExplainResponse(explanation=explanation_text, source=source, usage=usage)
+
+    except TokenBudgetExceeded as e:
+        logger.warning(f"Explain content over token budget: {e}")
+        return ExplainResponse(
+            explanation=(
+                "This file is too large for InfraScribe to explain in one request "
+                f"({e}). Try explaining a smaller part of it."
+            )
+        )
+
+    except RequestCancelled as e:
+        if e.reason == "deadline":
+            return ExplainResponse(
+                explanation=(
+                    "InfraScribe stopped generating this explanation because the "
+                    "request deadline was reached. Please try again."
+                )
+            )
+        raise cancellation_http_error(e)
 
     except Exception as e:
         # Log full stack trace for you in Render logs
@@ -274,8 +393,65 @@ Use Markdown-style bullets and short paragraphs.
         )
 
 
-@router.post("/bundle")
-async def generate_infra_bundle(payload: GenerateRequest):
+@router.post("/explain/batch", dependencies=AI_ROUTE_DEPENDENCIES)
+async def explain_bundle(bundle: GenerateResponse = Body(...)):
+    """
+    Explain every file of a GenerateResponse-shaped bundle in one call.
+
+    Streams newline-delimited JSON, one line per file as soon as it is ready
+    ({"path", "explanation", "source"}), then a final {"done": true, ...} line.
+    """
+    files = list(iter_bundle_files(bundle.model_dump()))
+    if not files:
+        raise HTTPException(status_code=400, detail="Bundle contains no files")
+    if len(files) > EXPLAIN_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Bundle has {len(files)} files; the limit is {EXPLAIN_BATCH_MAX_FILES}",
+        )
+
+    async def ndjson():
+        sources: Dict[str, int] = {}
+        async for item in explain_many(files):
+            sources[item["source"]] = sources.get(item["source"], 0) + 1
+            yield json.dumps(item) + "\n"
+        yield json.dumps({"done": True, "files": len(files), "sources": sources}) + "\n"
+
+    logger.info("Batch explain request received", extra={"files": len(files)})
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@router.post("/explain/stream", dependencies=AI_ROUTE_DEPENDENCIES)
+async def explain_file_stream(req: ExplainRequest, request: Request):
+    """
+    Streaming /explain over Server-Sent Events: "delta" events carry model
+    tokens as they arrive, "done" carries {"explanation", "source", "cached",
+    "usage"}. Indexed and cached files get "done" straight away.
+    """
+    if not req.content.strip():
+        events = _single_event(
+            "done",
+            {
+                "explanation": EMPTY_FILE_EXPLANATION,
+                "source": "empty",
+                "cached": False,
+                "usage": None,
+            },
+        )
+    else:
+        events = _stream_errors(
+            stream_explanation(req.filename, req.label, req.content), "explain"
+        )
+
+    return StreamingResponse(
+        pump_events(events, deadline=request_deadline(request)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+@router.post("/bundle", dependencies=[Depends(rate_limited("rule_based"))])
+async def generate_infra_bundle(payload: GenerateRequest, request: Request):
     """
     Same as /api/generate, but returns a ZIP file containing all generated artefacts.
 
@@ -293,15 +469,18 @@ async def generate_infra_bundle(payload: GenerateRequest):
         )
 
         result_dict = await generation_service.generate(payload)
-        zip_buffer = build_zip_from_result(result_dict)
+        result_id = (await _store_result(result_dict, client_key(request)))["result_id"]
+        zip_buffer = await _result_zip(result_dict, result_id, request)
 
-        return StreamingResponse(
-            zip_buffer,
-            media_type="application/zip",
-            headers={
-                "Content-Disposition": 'attachment; filename="infrascribe-bundle.zip"'
-            },
-        )
+        headers = {"Content-Disposition": 'attachment; filename="infrascribe-bundle.zip"'}
+        await _record_history(request, payload, result_id)
+        if result_id:
+            # Re-download later from /api/generate/{result_id}/zip without regenerating
+            headers["X-Result-Id"] = result_id
+        return StreamingResponse(zip_buffer, media_type="application/zip", headers=headers)
+
+    except RequestCancelled as e:
+        raise cancellation_http_error(e)
 
     except ValueError as e:
         logger.warning(f"Bad request for generate_infra_bundle: {e}")
@@ -313,8 +492,8 @@ async def generate_infra_bundle(payload: GenerateRequest):
             status_code=500,
             detail="Internal server error while generating bundle.",
         )
-@router.post("/refine", response_model=RefineResponse)
-async def refine_file(req: RefineRequest):
+@router.post("/refine", response_model=RefineResponse, dependencies=AI_ROUTE_DEPENDENCIES)
+async def refine_file(req: RefineRequest, request: Request):
     """
     Take a single generated file + user instructions and return a refined version
     of that file only (same format, no extra commentary).
@@ -325,63 +504,431 @@ async def refine_file(req: RefineRequest):
     if not req.instructions.strip():
         raise HTTPException(status_code=400, detail="Instructions cannot be empty")
 
-    refine_prompt = f"""
-You are InfraScribe, a DevOps assistant.
+    try:
+        refined = await run_cancellable(
+            request,
+            refine(req.filename, req.label, req.content, req.instructions, req.mode),
+            "refine",
+        )
+
+    except RequestCancelled as e:
+        raise cancellation_http_error(e)
+
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    except Exception as e:
+        logger.exception("Refine error")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to refine file: {e}",
+        )
 
-The user will give you:
-- An existing configuration file (Dockerfile, YAML, Terraform, CI pipeline, etc.)
-- Some instructions on how they want it changed.
+    if not refined["updated_content"]:
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to refine file: empty response from model",
+        )
 
-You MUST:
-- Return ONLY the updated file content.
-- Preserve the original format and structure (same language, same file type).
-- Do NOT add explanations, comments about what you changed, or markdown fences.
-- If something is unclear, make a safe reasonable assumption.
+    return RefineResponse(**refined)
 
-File name: {req.filename}
-Label: {req.label or ""}
 
-Current file content:
-----------------
-{req.content}
-----------------
+@router.post("/refine/stream", dependencies=AI_ROUTE_DEPENDENCIES)
+async def refine_file_stream(req: RefineRequest, request: Request):
+    """
+    Streaming /refine over Server-Sent Events: "delta" events with the new
+    content (or the patch in diff mode), "reset" if a patch had to be
+    abandoned for a full rewrite, then "done" with the RefineResponse fields.
+    """
+    if not req.content.strip():
+        raise HTTPException(status_code=400, detail="File content is empty")
 
-User instructions:
-----------------
-{req.instructions}
-----------------
-"""
+    if not req.instructions.strip():
+        raise HTTPException(status_code=400, detail="Instructions cannot be empty")
 
+    # Bad mode / oversized file are rejected before the stream starts
     try:
-        # Use the SAME global OpenAI client used by /explain
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a precise DevOps assistant. "
-                        "You ONLY output valid config files, no explanations."
-                    ),
-                },
-                {"role": "user", "content": refine_prompt},
-            ],
-            temperature=0.2,
-        )
+        check_refine_request(req.mode, req.content)
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    events = _stream_errors(
+        stream_refine(req.filename, req.label, req.content, req.instructions, req.mode),
+        "refine",
+    )
+    return StreamingResponse(
+        pump_events(events, deadline=request_deadline(request)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
 
-        updated = completion.choices[0].message.content.strip()
 
+async def _single_event(event: str, data: Dict[str, Any]):
+    yield {"event": event, "data": data}
+
+
+async def _stream_errors(events, operation: str):
+    """
+    Turns failures inside a streaming model call into a final "error" event;
+    the HTTP status is already 200 by the time they happen.
+    """
+    try:
+        async for event in events:
+            yield event
+    except TokenBudgetExceeded as e:
+        yield {"event": "error", "data": {"reason": "too_large", "detail": str(e)}}
     except Exception as e:
-        logger.exception("Refine error")
+        logger.exception(f"Streaming {operation} error")
+        yield {"event": "error", "data": {"reason": "error", "detail": f"{type(e).__name__}: {e}"}}
+
+
+def _parse_batch(
+    body: Union[MonorepoManifest, List[Dict[str, Any]]],
+) -> Tuple[str, List[Tuple[str, Dict[str, Any]]]]:
+    """
+    Expands the batch body and validates every service as a GenerateRequest.
+    """
+    raw = body.model_dump() if isinstance(body, MonorepoManifest) else body
+    archive_name, entries = parse_manifest(raw)
+
+    services = []
+    for name, spec in entries:
+        try:
+            services.append((name, GenerateRequest(**spec).model_dump()))
+        except ValidationError as e:
+            raise ValueError(f"Service {name!r}: {e.errors()}")
+    return archive_name, services
+
+
+@router.post("/batch")
+async def generate_infra_batch(
+    request: Request,
+    body: Union[MonorepoManifest, List[Dict[str, Any]]] = Body(...),
+):
+    """
+    Generate bundles for many services in one call.
+
+    Identical sub-requests are generated once; the result is a single
+    streamed ZIP with one folder per service plus shared Terraform/ArgoCD
+    written once at the root.
+    """
+    try:
+        archive_name, services = _parse_batch(body)
+        logger.info(
+            "Batch generation request received",
+            extra={"services": len(services)},
+        )
+
+        # Each AI service costs one AI request; all-rule-based batches count once
+        ai_services = sum(
+            1 for _, spec in services if generation_bucket(spec.get("mode")) == "ai"
+        )
+        if ai_services:
+            await enforce_rate_limit(request, "ai", cost=ai_services)
+            await enforce_usage_quota(request)
+        else:
+            await enforce_rate_limit(request, "rule_based")
+
+        results = await batch_generation_service.generate_many(services)
+
+        return StreamingResponse(
+            iter_monorepo_zip(results),
+            media_type="application/zip",
+            headers={
+                "Content-Disposition": f'attachment; filename="{archive_name}-bundle.zip"'
+            },
+        )
+
+    except HTTPException:
+        raise
+
+    except ValueError as e:
+        logger.warning(f"Bad request for generate_infra_batch: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    except Exception:
+        logger.exception("Unexpected error in generate_infra_batch")
         raise HTTPException(
             status_code=500,
-            detail=f"Failed to refine file: {e}",
+            detail="Internal server error while generating batch bundle.",
         )
 
-    if not updated:
+
+async def _store_result(result_dict: Dict[str, Any], subject: Optional[str]) -> Dict[str, Any]:
+    """
+    GenerateResponse fields of a result plus the result_id it is stored
+    under in the artifact store (None if it could not be stored). Only
+    `subject` (client_key of the caller) may read it back by id.
+    """
+    data = GenerateResponse(**result_dict).model_dump()
+    stored = {k: v for k, v in data.items() if k not in ("result_id", "upgrade")}
+    data["result_id"] = await artifact_store.save(stored, subject)
+    return data
+
+
+async def _result_zip(
+    result: Dict[str, Any], result_id: Optional[str], request: Optional[Request] = None
+) -> io.BytesIO:
+    """
+    ZIP bundle of a result; served from the shared cache when any worker
+    already zipped the same result_id.
+    """
+    if result_id:
+        cached = await shared_cache.get("zip", result_id)
+        if isinstance(cached, bytes):
+            return io.BytesIO(cached)
+
+    if request is not None:
+        # ZIP compression runs off the loop; the thread stops between files
+        # once the client leaves or the deadline passes
+        cancel = threading.Event()
+        try:
+            zip_buffer = await run_cancellable(
+                request, asyncio.to_thread(build_zip_from_result, result, cancel), "bundle_zip"
+            )
+        except BaseException:
+            cancel.set()
+            raise
+    else:
+        zip_buffer = await asyncio.to_thread(build_zip_from_result, result)
+    if result_id:
+        await shared_cache.set("zip", result_id, zip_buffer.getvalue(), ttl=ZIP_CACHE_TTL_SECONDS)
+    return zip_buffer
+
+
+async def _record_history(
+    request: Request, payload: GenerateRequest, result_id: Optional[str]
+) -> None:
+    """
+    Adds a stored result to the signed-in caller's history (guests have none).
+    """
+    if result_id is None or getattr(request.state, "user", None) is None:
+        return
+    await artifact_store.record_history(
+        client_key(request),
+        result_id,
+        {
+            "mode": payload.mode,
+            "language": payload.language,
+            "framework": payload.framework,
+            "cicd_tool": payload.cicd_tool,
+            "deploy_target": payload.deploy_target,
+        },
+    )
+
+
+async def _require_result_access(request: Request, *result_ids: str) -> None:
+    """
+    Stored results (and their repo-derived details) are readable only by
+    the caller who generated them or has them in its history. Anything
+    else is a 404, so probing ids does not reveal which results exist.
+    """
+    if not await artifact_store.can_read(client_key(request), result_ids):
+        raise HTTPException(status_code=404, detail="Result not found")
+
+
+def generation_bucket(mode: Optional[str]) -> str:
+    """
+    Rate-limit budget a generation mode draws from.
+    """
+    if is_ai_mode(mode):
+        return "ai"
+    return "rule_based"
+
+
+@router.get("/usage")
+async def get_usage(request: Request):
+    """
+    The caller's model usage today (UTC): calls, prompt/completion/cached
+    tokens, estimated cost and total latency, with the daily quotas.
+    """
+    subject = client_key(request)
+    totals = await usage_ledger.today(subject)
+    return {
+        "day": utc_day(),
+        **totals,
+        "quota": {
+            "tokens": DAILY_TOKEN_QUOTA or None,
+            "cost_usd": DAILY_COST_QUOTA_USD or None,
+        },
+    }
+
+
+@router.get("/history")
+async def get_history(
+    request: Request,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+):
+    """
+    The caller's previous generations, newest first: {"items": [{"id",
+    "result_id", "created_at", "mode", "language", ...}], "next_cursor"}.
+    Fetch a run with GET /{result_id}, compare two with /diff.
+    """
+    if getattr(request.state, "user", None) is None:
         raise HTTPException(
-            status_code=500,
-            detail="Failed to refine file: empty response from model",
+            status_code=401,
+            detail="Sign in to see your generation history",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    try:
+        before = int(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    items, next_id = await artifact_store.history(client_key(request), limit, before)
+    return {"items": items, "next_cursor": str(next_id) if next_id is not None else None}
+
+
+@router.get("/diff")
+async def diff_results(
+    request: Request,
+    base: str = Query(..., description="result_id of the older run"),
+    head: str = Query(..., description="result_id of the newer run"),
+    lines: bool = Query(True, description="Include line-level unified diffs"),
+    context: int = Query(3, ge=0, le=20),
+):
+    """
+    Changes between two stored runs: files added / removed / changed
+    (from their manifests) and, unless lines=false, a unified diff per
+    changed file. Unchanged files are never loaded. Both runs must be the
+    caller's own.
+    """
+    await _require_result_access(request, base, head)
+    diff = await artifact_store.diff(base, head, lines=lines, context=context)
+    if diff is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+    return diff
+
+
+# ---------------------- Async jobs ---------------------- #
+
+def _job_links(job_id: str) -> Dict[str, str]:
+    return {
+        "status_url": f"/api/generate/jobs/{job_id}",
+        "events_url": f"/api/generate/jobs/{job_id}/events",
+    }
+
+
+async def _submit_generate_job(payload: GenerateRequest, subject: str) -> JSONResponse:
+    try:
+        job = await job_queue.submit("generate", {**payload.model_dump(), "subject": subject})
+    except QueueFullError as e:
+        logger.warning(f"Rejected async generation: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": "5"},
         )
 
-    return RefineResponse(updated_content=updated)
+    logger.info(
+        "Generation job queued",
+        extra={"job_id": job["job_id"], "mode": payload.mode},
+    )
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job["job_id"],
+            "status": job["status"],
+            **_job_links(job["job_id"]),
+        },
+    )
+
+
+async def _submit_upgrade(payload: GenerateRequest, subject: str) -> Dict[str, Any]:
+    """
+    Queues the ai_thick run behind a speculative rule-based response, billed
+    to `subject`. Identical requests from the same caller share one run
+    (keyed by caller and payload) and a finished run is reused for
+    UPGRADE_REUSE_SECONDS; other callers never share (or pay for) it.
+    """
+    spec = {**payload.model_dump(), "mode": "ai_thick"}
+    key = hashlib.sha256(f"{subject}\n{spec_key(spec)}".encode("utf-8")).hexdigest()
+    spec["subject"] = subject
+    try:
+        job = await job_queue.submit(
+            "generate", spec, dedupe_key=key, reuse_seconds=UPGRADE_REUSE_SECONDS
+        )
+    except QueueFullError as e:
+        # The rule-based bundle is still a complete answer
+        metrics.incr("generate.upgrade.rejected")
+        logger.warning(f"AI upgrade not queued: {e}")
+        return {"token": None, "status": "unavailable", "reason": str(e)}
+
+    metrics.incr(
+        "generate.upgrade.deduplicated" if job["deduplicated"] else "generate.upgrade.queued"
+    )
+    return {
+        "token": job["job_id"],
+        "status": job["status"],
+        "deduplicated": job["deduplicated"],
+        **_job_links(job["job_id"]),
+    }
+
+
+@router.get("/jobs/{job_id}")
+async def get_generate_job(request: Request, job_id: str):
+    """
+    Poll a generation job. `result` is a GenerateResponse once status is "succeeded".
+    """
+    job = await job_queue.get(job_id, client_key(request))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_generate_job(request: Request, job_id: str):
+    """
+    Server-Sent Events for a generation job: status, progress, then
+    completed (with the GenerateResponse) or failed.
+    """
+    if await job_queue.get(job_id, client_key(request)) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return StreamingResponse(
+        pump_events(job_queue.subscribe(job_id)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+# ---------------------- Stored results ---------------------- #
+# Registered last: "/{result_id}" would otherwise shadow the fixed GET routes above.
+
+@router.get("/{result_id}", response_model=GenerateResponse)
+async def get_generate_result(request: Request, result_id: str):
+    """
+    A previously generated result, rebuilt from the artifact store.
+    """
+    await _require_result_access(request, result_id)
+    result = await artifact_store.load(result_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+    return GenerateResponse(**result, result_id=result_id)
+
+
+@router.get("/{result_id}/zip")
+async def download_generate_result(request: Request, result_id: str):
+    """
+    The ZIP bundle of a stored result, rebuilt from its blobs.
+    """
+    await _require_result_access(request, result_id)
+    result = await artifact_store.load(result_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+
+    zip_buffer = await _result_zip(result, result_id)
+    return StreamingResponse(
+        zip_buffer,
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="infrascribe-{result_id[:12]}.zip"',
+            "X-Result-Id": result_id,
+        },
+    )
@@ -1,13 +1,88 @@
 # backend/services/ai_generation_service.py
 
 import json
-from typing import Any, Dict, Optional
+import time
+from typing import Any, Dict, Optional, Tuple
 
-from openai import OpenAI
+from services.model_router import model_router
+from services.usage_ledger import usage_ledger
+from utils.json_repair import salvage_json
+from utils.llm import get_async_client
 from utils.logger import get_logger
+from utils.metrics import metrics
+from utils.prompt_cache import record_prompt_cache
+from utils.token_budget import count_tokens
 
 logger = get_logger(__name__)
-client = OpenAI()
+
+# Top-level keys of the AI output contract (see GENERATE_PROMPT_PREFIX)
+AI_ARTIFACT_KEYS = (
+    "dockerfile", "cicd", "k8s", "helm", "argocd", "monitoring", "terraform", "readme_md",
+)
+
+# Static part of the generation prompt: rules, JSON schema and output contract.
+# Must stay byte-identical between requests (no request values in here).
+GENERATE_PROMPT_PREFIX = """
+You are a backend API.
+
+You MUST return ONLY valid JSON.
+NO markdown.
+NO explanations.
+NO comments.
+NO trailing text.
+NO backticks.
+
+If the output is not strict JSON, it will be rejected.
+
+Return EXACTLY this structure:
+
+{
+  "dockerfile": "string",
+
+  "cicd": "string | null",
+
+  "k8s": {
+    "deployment.yaml": "string",
+    "service.yaml": "string"
+  } | null,
+
+  "helm": {
+    "Chart.yaml": "string",
+    "values.yaml": "string",
+    "templates": {
+      "deployment.yaml": "string",
+      "service.yaml": "string"
+    }
+  } | null,
+
+  "argocd": {
+    "app.yaml": "string"
+  } | null,
+
+  "monitoring": {
+    "prometheus.yaml": "string",
+    "grafana.json": "string"
+  } | null,
+
+  "terraform": {
+    "stack_name": {
+      "provider.tf": "string",
+      "main.tf": "string",
+      "variables.tf": "string",
+      "outputs.tf": "string"
+    }
+  } | null,
+
+  "readme_md": "string"
+}
+"""
+
+
+def _is_json_object(text: str) -> bool:
+    try:
+        return isinstance(json.loads(text), dict)
+    except (TypeError, ValueError):
+        return False
 
 
 class AIGenerationService:
@@ -23,31 +98,75 @@ class AIGenerationService:
     async def generate_bundle(self, payload) -> Optional[Dict[str, Any]]:
         prompt = self._build_prompt(payload)
 
-        try:
-            response = client.responses.create(
-                model="gpt-4.1",
+        async def call(model: str) -> str:
+            started = time.perf_counter()
+            response = await get_async_client().responses.create(
+                model=model,
                 input=prompt,
             )
+            usage_ledger.record(
+                "generate", model, getattr(response, "usage", None), time.perf_counter() - started
+            )
+            record_prompt_cache(
+                "generate", getattr(response, "usage", None), GENERATE_PROMPT_PREFIX
+            )
+            return response.output_text
+
+        try:
+            # Cheapest model first; invalid JSON escalates before we salvage
+            text, model, escalations = await model_router.run(
+                "generate", call, count_tokens(prompt), validate=_is_json_object
+            )
         except Exception:
             logger.exception("AI request failed")
             return None
 
-        text = response.output_text
-
+        salvage = None
         try:
             ai_json = json.loads(text)
         except json.JSONDecodeError:
-            logger.error("AI returned non-JSON output")
-            logger.debug(text)
-            return None
+            ai_json, salvage = self._salvage(text)
+            if ai_json is None:
+                logger.error("AI returned non-JSON output")
+                logger.debug(text)
+                return None
 
         try:
             normalized = self._normalize_output(ai_json)
-            return normalized
         except Exception:
             logger.exception("Failed to normalize AI output")
             return None
 
+        normalized["raw"].update({"model": model, "escalations": escalations})
+        if salvage is not None:
+            normalized["raw"]["salvage"] = salvage
+        return normalized
+
+    def _salvage(self, text: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Recovers the well-formed top-level artefacts of malformed/truncated
+        output. Returns (ai_json, salvage_info) or (None, None) when nothing
+        usable is left. Artefacts cut off mid-way are reported as missing so
+        they can be generated rule-based instead of half-written.
+        """
+        result = salvage_json(text)
+        recovered = [key for key in AI_ARTIFACT_KEYS if key in result["complete"]]
+        missing = [key for key in AI_ARTIFACT_KEYS if key not in recovered]
+
+        metrics.incr("ai.salvage.attempts")
+        metrics.observe("ai.salvage.rate", len(recovered) / len(AI_ARTIFACT_KEYS))
+        if not recovered:
+            metrics.incr("ai.salvage.failed")
+            return None, None
+
+        metrics.incr("ai.salvage.recovered")
+        logger.warning(
+            f"Salvaged {len(recovered)}/{len(AI_ARTIFACT_KEYS)} artefacts from malformed AI output",
+            extra={"recovered": recovered, "missing": missing},
+        )
+        ai_json = {key: result["data"][key] for key in recovered}
+        return ai_json, {"recovered": recovered, "missing": missing, "partial": result["partial"]}
+
     # -------------------------------------------------
     # PROMPT BUILDER
     # -------------------------------------------------
@@ -56,61 +175,11 @@ class AIGenerationService:
         """
         Hard-restricted system prompt.
         Forces JSON-only output matching rule-based response.
-        """
-        return f"""
-You are a backend API.
-
-You MUST return ONLY valid JSON.
-NO markdown.
-NO explanations.
-NO comments.
-NO trailing text.
-NO backticks.
-
-If the output is not strict JSON, it will be rejected.
-
-Return EXACTLY this structure:
-
-{{
-  "dockerfile": "string",
-
-  "cicd": "string | null",
-
-  "k8s": {{
-    "deployment.yaml": "string",
-    "service.yaml": "string"
-  }} | null,
-
-  "helm": {{
-    "Chart.yaml": "string",
-    "values.yaml": "string",
-    "templates": {{
-      "deployment.yaml": "string",
-      "service.yaml": "string"
-    }}
-  }} | null,
-
-  "argocd": {{
-    "app.yaml": "string"
-  }} | null,
-
-  "monitoring": {{
-    "prometheus.yaml": "string",
-    "grafana.json": "string"
-  }} | null,
-
-  "terraform": {{
-    "stack_name": {{
-      "provider.tf": "string",
-      "main.tf": "string",
-      "variables.tf": "string",
-      "outputs.tf": "string"
-    }}
-  }} | null,
-
-  "readme_md": "string"
-}}
 
+        GENERATE_PROMPT_PREFIX is static and comes first so provider-side
+        prompt caching can reuse it; only the request values follow it.
+        """
+        return GENERATE_PROMPT_PREFIX + f"""
 Generate a DevOps bundle for:
 
 Language: {payload.language}
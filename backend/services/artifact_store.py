@@ -0,0 +1,544 @@
+# backend/services/artifact_store.py
+
+import asyncio
+import copy
+import difflib
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from utils.logger import get_logger
+from utils.metrics import metrics
+from utils.storage import connect_sqlite, data_path
+from utils.zip_builder import iter_bundle_files, set_bundle_file
+
+logger = get_logger(__name__)
+
+ARTIFACTS_DB = os.getenv("INFRASCRIBE_ARTIFACTS_DB") or None
+# Results not generated again for this long are dropped, then blobs no result
+# references any more; 0 keeps everything
+ARTIFACT_RETENTION_DAYS = int(os.getenv("INFRASCRIBE_ARTIFACT_RETENTION_DAYS", "30"))
+# Per-user history entries older than this are dropped (their results may
+# then be pruned too); 0 keeps history forever
+HISTORY_RETENTION_DAYS = int(os.getenv("INFRASCRIBE_HISTORY_RETENTION_DAYS", "180"))
+HISTORY_PAGE_MAX = 100
+# Line-level diffs longer than this (per file) are cut off
+DIFF_MAX_LINES = int(os.getenv("INFRASCRIBE_DIFF_MAX_LINES", "2000"))
+# Decompressed blobs kept in memory (shared Terraform/ArgoCD files are hot)
+ARTIFACT_BLOB_CACHE_SIZE = int(os.getenv("INFRASCRIBE_ARTIFACT_BLOB_CACHE_SIZE", "2048"))
+
+RESULT_ID = re.compile(r"^[0-9a-f]{32}$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash         TEXT PRIMARY KEY,
+    size         INTEGER NOT NULL,
+    stored_size  INTEGER NOT NULL,
+    body         BLOB NOT NULL,
+    created_at   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    result_id     TEXT PRIMARY KEY,
+    skeleton      TEXT NOT NULL,
+    manifest      TEXT NOT NULL,
+    size          INTEGER NOT NULL,
+    created_at    REAL NOT NULL,
+    last_seen_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_last_seen ON results(last_seen_at);
+CREATE TABLE IF NOT EXISTS history (
+    id          INTEGER PRIMARY KEY,
+    subject     TEXT NOT NULL,
+    result_id   TEXT NOT NULL,
+    created_at  REAL NOT NULL,
+    meta        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_subject ON history(subject, id);
+CREATE INDEX IF NOT EXISTS idx_history_created ON history(created_at);
+CREATE TABLE IF NOT EXISTS access (
+    subject     TEXT NOT NULL,
+    result_id   TEXT NOT NULL,
+    granted_at  REAL NOT NULL,
+    PRIMARY KEY (subject, result_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_access_granted ON access(granted_at);
+"""
+_INSERT_BLOB = (
+    "INSERT OR IGNORE INTO blobs (hash, size, stored_size, body, created_at) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+_UPSERT_RESULT = (
+    "INSERT INTO results (result_id, skeleton, manifest, size, created_at, last_seen_at) "
+    "VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(result_id) DO UPDATE SET last_seen_at = excluded.last_seen_at"
+)
+_SELECT_RESULT = "SELECT skeleton, manifest, created_at FROM results WHERE result_id = ?"
+_PRUNE_RESULTS = (
+    "DELETE FROM results WHERE last_seen_at < ? "
+    "AND result_id NOT IN (SELECT result_id FROM history)"
+)
+_PRUNE_HISTORY = "DELETE FROM history WHERE created_at < ?"
+_UPSERT_ACCESS = (
+    "INSERT INTO access (subject, result_id, granted_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(subject, result_id) DO UPDATE SET granted_at = excluded.granted_at"
+)
+_PRUNE_ACCESS = "DELETE FROM access WHERE granted_at < ?"
+_INSERT_HISTORY = (
+    "INSERT INTO history (subject, result_id, created_at, meta) VALUES (?, ?, ?, ?)"
+)
+# Keyset pagination: newest first, "before" is the last id of the previous page
+_SELECT_HISTORY = (
+    "SELECT id, result_id, created_at, meta FROM history "
+    "WHERE subject = ? AND id < ? ORDER BY id DESC LIMIT ?"
+)
+_PRUNE_BLOBS = """
+DELETE FROM blobs WHERE hash NOT IN (
+    SELECT DISTINCT files.value FROM results, json_each(results.manifest) AS files
+)
+"""
+
+
+def blob_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def split_result(result: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str], Dict[str, str]]:
+    """
+    (skeleton, manifest, blobs) for a generation result: the skeleton is the
+    result with every file body blanked, the manifest maps archive path
+    (iter_bundle_files layout) -> content hash, blobs maps hash -> body.
+    """
+    skeleton = copy.deepcopy(result)
+    manifest: Dict[str, str] = {}
+    blobs: Dict[str, str] = {}
+    for path, content in iter_bundle_files(result):
+        digest = blob_hash(content)
+        manifest[path] = digest
+        blobs[digest] = content
+        set_bundle_file(skeleton, path, "")
+    return skeleton, manifest, blobs
+
+
+def join_result(
+    skeleton: Dict[str, Any], manifest: Dict[str, str], blobs: Dict[str, str]
+) -> Dict[str, Any]:
+    """
+    Inverse of split_result.
+    """
+    result = copy.deepcopy(skeleton)
+    for path, digest in manifest.items():
+        set_bundle_file(result, path, blobs[digest])
+    return result
+
+
+def diff_manifests(base: Dict[str, str], head: Dict[str, str]) -> Dict[str, List[str]]:
+    """
+    File-level changes between two manifests, from the hashes alone.
+    """
+    return {
+        "added": sorted(path for path in head if path not in base),
+        "removed": sorted(path for path in base if path not in head),
+        "changed": sorted(path for path in head if path in base and base[path] != head[path]),
+        "unchanged": sorted(path for path in head if base.get(path) == head[path]),
+    }
+
+
+def line_diff(path: str, before: str, after: str, context: int = 3) -> Dict[str, Any]:
+    """
+    Unified diff of one file plus added/removed line counts.
+    """
+    lines = list(
+        difflib.unified_diff(
+            before.splitlines(keepends=True),
+            after.splitlines(keepends=True),
+            fromfile=f"a/{path}",
+            tofile=f"b/{path}",
+            n=context,
+        )
+    )
+    additions = sum(1 for l in lines if l.startswith("+") and not l.startswith("+++"))
+    deletions = sum(1 for l in lines if l.startswith("-") and not l.startswith("---"))
+    truncated = len(lines) > DIFF_MAX_LINES
+    return {
+        "additions": additions,
+        "deletions": deletions,
+        "diff": "".join(lines[:DIFF_MAX_LINES]),
+        "truncated": truncated,
+    }
+
+
+def result_id_for(skeleton: Dict[str, Any], manifest: Dict[str, str]) -> str:
+    # Content-addressed too: an identical generation maps to the same result
+    canonical = json.dumps(
+        {"skeleton": skeleton, "manifest": manifest}, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for generation results. Every file body is
+    kept once, zlib-compressed, under its SHA-256 ("blobs"); a result is a
+    small manifest of path -> hash plus the non-file fields ("results").
+    Files shared across users and requests (Terraform providers, ArgoCD
+    apps, Helm helpers, whole rule-based bundles) cost one row, so storage
+    grows with distinct content rather than with requests.
+    """
+
+    def __init__(self, db_path: Optional[str] = ARTIFACTS_DB):
+        self.db_path = db_path or str(data_path("artifacts.sqlite3"))
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._blob_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._last_prune_day: Optional[str] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect_sqlite(self.db_path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---------------------- Caches ---------------------- #
+
+    def _cache_blob(self, digest: str, content: str) -> None:
+        if ARTIFACT_BLOB_CACHE_SIZE <= 0:
+            return
+        with self._lock:
+            self._blob_cache[digest] = content
+            self._blob_cache.move_to_end(digest)
+            while len(self._blob_cache) > ARTIFACT_BLOB_CACHE_SIZE:
+                self._blob_cache.popitem(last=False)
+
+    def _cached_blob(self, digest: str) -> Optional[str]:
+        with self._lock:
+            content = self._blob_cache.get(digest)
+            if content is not None:
+                self._blob_cache.move_to_end(digest)
+            return content
+
+    # ---------------------- Writes ---------------------- #
+
+    def _missing(self, conn: sqlite3.Connection, hashes: List[str]) -> List[str]:
+        # Checked inside the write transaction: another worker may have pruned
+        # or written blobs since, so no process-local "known" set is trusted
+        placeholders = ",".join("?" * len(hashes))
+        stored = {
+            row["hash"]
+            for row in conn.execute(
+                f"SELECT hash FROM blobs WHERE hash IN ({placeholders})", hashes
+            )
+        }
+        return [h for h in hashes if h not in stored]
+
+    def _save(self, result: Dict[str, Any], subject: Optional[str]) -> str:
+        skeleton, manifest, blobs = split_result(result)
+        result_id = result_id_for(skeleton, manifest)
+        now = time.time()
+
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                missing = self._missing(conn, list(blobs)) if blobs else []
+                # Only new content is compressed and written
+                rows = []
+                for digest in missing:
+                    body = zlib.compress(blobs[digest].encode("utf-8"), 6)
+                    rows.append((digest, len(blobs[digest].encode("utf-8")), len(body), body, now))
+                conn.executemany(_INSERT_BLOB, rows)
+                conn.execute(
+                    _UPSERT_RESULT,
+                    (
+                        result_id,
+                        json.dumps(skeleton, separators=(",", ":")),
+                        json.dumps(manifest, separators=(",", ":")),
+                        sum(len(blobs[digest].encode("utf-8")) for digest in manifest.values()),
+                        now,
+                        now,
+                    ),
+                )
+                if subject is not None:
+                    conn.execute(_UPSERT_ACCESS, (subject, result_id, now))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        metrics.incr("artifacts.saved")
+        metrics.incr("artifacts.blobs_written", len(missing))
+        metrics.incr("artifacts.blobs_deduplicated", len(blobs) - len(missing))
+        self._maybe_prune()
+        return result_id
+
+    async def save(self, result: Dict[str, Any], subject: Optional[str] = None) -> Optional[str]:
+        """
+        Stores a generation result (GenerateResponse fields) and returns its
+        result_id, or None if storing failed; generation never fails on it.
+        `subject` (the caller who generated it) may read it back later.
+        """
+        started = time.perf_counter()
+        try:
+            return await asyncio.to_thread(self._save, result, subject)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            metrics.incr("artifacts.save_errors")
+            logger.warning(f"Could not store generation result: {e}")
+            return None
+        finally:
+            metrics.observe("artifacts.save_seconds", time.perf_counter() - started)
+
+    # ---------------------- Reads ---------------------- #
+
+    def _load_blobs(self, hashes: Iterable[str]) -> Dict[str, str]:
+        found: Dict[str, str] = {}
+        wanted = []
+        for digest in set(hashes):
+            content = self._cached_blob(digest)
+            if content is None:
+                wanted.append(digest)
+            else:
+                found[digest] = content
+        if wanted:
+            placeholders = ",".join("?" * len(wanted))
+            with self._db_lock:
+                rows = self._connection().execute(
+                    f"SELECT hash, body FROM blobs WHERE hash IN ({placeholders})", wanted
+                ).fetchall()
+            for row in rows:
+                content = zlib.decompress(row["body"]).decode("utf-8")
+                found[row["hash"]] = content
+                self._cache_blob(row["hash"], content)
+        return found
+
+    def _load(self, result_id: str) -> Optional[Dict[str, Any]]:
+        with self._db_lock:
+            row = self._connection().execute(_SELECT_RESULT, (result_id,)).fetchone()
+        if row is None:
+            return None
+        manifest = json.loads(row["manifest"])
+        blobs = self._load_blobs(manifest.values())
+        missing = set(manifest.values()) - set(blobs)
+        if missing:
+            logger.error(f"Result {result_id} references {len(missing)} missing blob(s)")
+            return None
+        return join_result(json.loads(row["skeleton"]), manifest, blobs)
+
+    async def load(self, result_id: str) -> Optional[Dict[str, Any]]:
+        """
+        The stored result rebuilt from its manifest and blobs, or None.
+        """
+        if not RESULT_ID.match(result_id or ""):
+            return None
+        started = time.perf_counter()
+        try:
+            return await asyncio.to_thread(self._load, result_id)
+        finally:
+            metrics.observe("artifacts.load_seconds", time.perf_counter() - started)
+
+    def _readable(self, subject: str, result_ids: List[str]) -> set:
+        placeholders = ",".join("?" * len(result_ids))
+        with self._db_lock:
+            rows = self._connection().execute(
+                f"SELECT result_id FROM access "
+                f"WHERE subject = ? AND result_id IN ({placeholders}) "
+                f"UNION SELECT result_id FROM history "
+                f"WHERE subject = ? AND result_id IN ({placeholders})",
+                (subject, *result_ids, subject, *result_ids),
+            ).fetchall()
+        return {row["result_id"] for row in rows}
+
+    async def can_read(self, subject: str, result_ids: Iterable[str]) -> bool:
+        """
+        True if `subject` generated every one of `result_ids` or has it in
+        its history. Result ids are content hashes, so knowing one is not
+        proof of having produced it.
+        """
+        wanted = list(dict.fromkeys(result_ids))
+        if not wanted or not all(RESULT_ID.match(rid or "") for rid in wanted):
+            return False
+        try:
+            readable = await asyncio.to_thread(self._readable, subject, wanted)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not check result access: {e}")
+            return False
+        return readable.issuperset(wanted)
+
+    def manifest(self, result_id: str) -> Optional[Dict[str, str]]:
+        with self._db_lock:
+            row = self._connection().execute(
+                "SELECT manifest FROM results WHERE result_id = ?", (result_id,)
+            ).fetchone()
+        return json.loads(row["manifest"]) if row else None
+
+    # ---------------------- History ---------------------- #
+
+    def _record_history(self, subject: str, result_id: str, meta: Dict[str, Any]) -> int:
+        with self._db_lock:
+            cursor = self._connection().execute(
+                _INSERT_HISTORY, (subject, result_id, time.time(), json.dumps(meta))
+            )
+        return cursor.lastrowid
+
+    async def record_history(
+        self, subject: str, result_id: str, meta: Dict[str, Any]
+    ) -> Optional[int]:
+        """
+        Adds a stored result to `subject`'s history; `meta` is a small
+        summary (language, framework, mode, ...). Returns the entry id.
+        """
+        try:
+            return await asyncio.to_thread(self._record_history, subject, result_id, meta)
+        except sqlite3.Error as e:
+            metrics.incr("artifacts.history_errors")
+            logger.warning(f"Could not record generation history: {e}")
+            return None
+
+    def _history(self, subject: str, limit: int, before: Optional[int]) -> List[Dict[str, Any]]:
+        with self._db_lock:
+            rows = self._connection().execute(
+                _SELECT_HISTORY, (subject, before if before is not None else 2**63 - 1, limit)
+            ).fetchall()
+        return [
+            {
+                "id": row["id"],
+                "result_id": row["result_id"],
+                "created_at": row["created_at"],
+                **json.loads(row["meta"]),
+            }
+            for row in rows
+        ]
+
+    async def history(
+        self, subject: str, limit: int = 20, before: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        One page of `subject`'s history, newest first, and the cursor for
+        the next page (None on the last one). Keyset pagination on the
+        (subject, id) index: every page costs the same however deep it is.
+        """
+        limit = max(1, min(limit, HISTORY_PAGE_MAX))
+        # One extra row tells whether there is a next page without a COUNT
+        rows = await asyncio.to_thread(self._history, subject, limit + 1, before)
+        if len(rows) > limit:
+            return rows[:limit], rows[limit - 1]["id"]
+        return rows, None
+
+    def _diff(
+        self, base_id: str, head_id: str, lines: bool, context: int
+    ) -> Optional[Dict[str, Any]]:
+        base, head = self.manifest(base_id), self.manifest(head_id)
+        if base is None or head is None:
+            return None
+        changes = diff_manifests(base, head)
+        files = []
+        if lines:
+            # Only the blobs of files that differ are read, never whole bundles
+            touched = (
+                [head[p] for p in changes["added"] + changes["changed"]]
+                + [base[p] for p in changes["removed"] + changes["changed"]]
+            )
+            blobs = self._load_blobs(touched)
+        for status in ("added", "removed", "changed"):
+            for path in changes[status]:
+                entry: Dict[str, Any] = {"path": path, "status": status}
+                if lines:
+                    before = blobs.get(base[path], "") if path in base else ""
+                    after = blobs.get(head[path], "") if path in head else ""
+                    entry.update(line_diff(path, before, after, context))
+                files.append(entry)
+        return {
+            "base": base_id,
+            "head": head_id,
+            "summary": {status: len(paths) for status, paths in changes.items()},
+            "files": files,
+        }
+
+    async def diff(
+        self, base_id: str, head_id: str, lines: bool = True, context: int = 3
+    ) -> Optional[Dict[str, Any]]:
+        """
+        File-level (added / removed / changed, from the manifests) and,
+        with `lines`, line-level unified diffs between two stored results.
+        None if either result is unknown.
+        """
+        if not RESULT_ID.match(base_id or "") or not RESULT_ID.match(head_id or ""):
+            return None
+        started = time.perf_counter()
+        try:
+            return await asyncio.to_thread(self._diff, base_id, head_id, lines, context)
+        finally:
+            metrics.observe("artifacts.diff_seconds", time.perf_counter() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Logical bytes of all stored results vs. bytes actually on disk.
+        """
+        with self._db_lock:
+            conn = self._connection()
+            results = conn.execute("SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS bytes FROM results").fetchone()
+            blobs = conn.execute(
+                "SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS bytes, "
+                "COALESCE(SUM(stored_size), 0) AS stored FROM blobs"
+            ).fetchone()
+        return {
+            "results": results["n"],
+            "logical_bytes": results["bytes"],
+            "blobs": blobs["n"],
+            "unique_bytes": blobs["bytes"],
+            "stored_bytes": blobs["stored"],
+        }
+
+    # ---------------------- Retention ---------------------- #
+
+    def prune(self, retention_days: int = ARTIFACT_RETENTION_DAYS) -> Tuple[int, int]:
+        """
+        Drops history past HISTORY_RETENTION_DAYS, access grants and results
+        unseen for `retention_days` (results only when no history entry
+        references them), then unreferenced blobs. Returns (results
+        removed, blobs removed).
+        """
+        if retention_days <= 0:
+            return 0, 0
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if HISTORY_RETENTION_DAYS > 0:
+                    conn.execute(_PRUNE_HISTORY, (time.time() - HISTORY_RETENTION_DAYS * 86400,))
+                cutoff = time.time() - retention_days * 86400
+                conn.execute(_PRUNE_ACCESS, (cutoff,))
+                results = conn.execute(_PRUNE_RESULTS, (cutoff,)).rowcount
+                blobs = conn.execute(_PRUNE_BLOBS).rowcount if results else 0
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if results:
+            logger.info(f"Pruned {results} stored result(s) and {blobs} blob(s)")
+        return results, blobs
+
+    def _maybe_prune(self) -> None:
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        if self._last_prune_day == today:
+            return
+        self._last_prune_day = today
+        try:
+            self.prune()
+        except sqlite3.Error as e:
+            logger.warning(f"Artifact prune failed: {e}")
+
+
+artifact_store = ArtifactStore()
@@ -0,0 +1,431 @@
+# backend/services/artifact_validator.py
+
+import asyncio
+import json
+import os
+import re
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import yaml
+except ImportError:  # optional: YAML files are then only checked for obvious breakage
+    yaml = None
+
+from utils.logger import get_logger
+from utils.metrics import metrics
+from utils.zip_builder import iter_bundle_files
+
+logger = get_logger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent  # backend/
+SCHEMA_FILE = BASE_DIR / "templates" / "schemas" / "kubernetes.json"
+
+# Errors reported per file; the rest are summarised as "... and N more"
+MAX_ERRORS = 10
+
+DOCKERFILE_INSTRUCTIONS = frozenset((
+    "ADD", "ARG", "CMD", "COPY", "ENTRYPOINT", "ENV", "EXPOSE", "FROM", "HEALTHCHECK",
+    "LABEL", "MAINTAINER", "ONBUILD", "RUN", "SHELL", "STOPSIGNAL", "USER", "VOLUME",
+    "WORKDIR",
+))
+
+_HEREDOC = re.compile(r"<<-?\s*[\"']?([A-Za-z_][A-Za-z0-9_]*)[\"']?")
+_TEMPLATE_ACTION = re.compile(r"\{\{-?.*?-?\}\}", re.S)
+# An attribute (name = ...) or a block header (type "label" ... {)
+_HCL_STATEMENT = re.compile(
+    r"^\s*[A-Za-z_][\w-]*\s*(=|(\s+(\"[^\"]*\"|[A-Za-z_][\w-]*))*\s*\{)", re.M
+)
+_GROOVY_START = ("pipeline {", "pipeline{", "node {", "node{", "node(", "@Library", "def ", "//")
+
+
+# ---------------------- File kinds ---------------------- #
+
+def artifact_kind(path: str, content: str = "") -> str:
+    """
+    dockerfile | yaml | json | hcl | groovy | text, from the file name (and,
+    for AI pipelines always named pipeline.yaml, a sniff of the content).
+    """
+    base = os.path.basename(path)
+    lower = base.lower()
+    if base == "Dockerfile" or base.startswith("Dockerfile.") or lower.endswith(".dockerfile"):
+        return "dockerfile"
+    if base == "Jenkinsfile" or lower.endswith((".groovy", ".jenkinsfile")):
+        return "groovy"
+    if lower.endswith((".yaml", ".yml")):
+        if content.lstrip().startswith(_GROOVY_START):
+            return "groovy"
+        return "yaml"
+    if lower.endswith(".json"):
+        return "json"
+    if lower.endswith((".tf", ".tfvars", ".hcl")):
+        return "hcl"
+    return "text"
+
+
+# ---------------------- Schemas ---------------------- #
+
+def _compile_path(dotted: str) -> Tuple[str, ...]:
+    # "spec.containers[].image" -> ("spec", "containers", "[]", "image")
+    segments: List[str] = []
+    for part in dotted.split("."):
+        while part.endswith("[]"):
+            part = part[:-2]
+            segments.extend((part, "[]") if part else ("[]",))
+            part = ""
+        if part:
+            segments.append(part)
+    return tuple(segments)
+
+
+def _compile_schema(spec: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "apiVersions": tuple(spec.get("apiVersions", ())),
+        "required": [(p, _compile_path(p)) for p in spec.get("required", ())],
+        "types": [(p, _compile_path(p), t) for p, t in spec.get("types", {}).items()],
+        "itemRequired": [
+            (p, _compile_path(p), tuple(fields))
+            for p, fields in spec.get("itemRequired", {}).items()
+        ],
+    }
+
+
+@lru_cache(maxsize=1)
+def load_schemas() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Loads the bundled Kubernetes/ArgoCD schemas once and precompiles every
+    dotted path, so validating a manifest is a few dict lookups.
+    Returns {"kinds": {kind: schema}, "files": {file name: schema}}.
+    """
+    try:
+        raw = json.loads(SCHEMA_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        logger.warning(f"Manifest schemas not available at {SCHEMA_FILE}")
+        return {"kinds": {}, "files": {}}
+
+    return {
+        section: {name: _compile_schema(spec) for name, spec in raw.get(section, {}).items()}
+        for section in ("kinds", "files")
+    }
+
+
+def _resolve(node: Any, segments: Tuple[str, ...]) -> Iterator[Any]:
+    # Every value at the path; "[]" fans out over list items
+    if not segments:
+        yield node
+        return
+    head, rest = segments[0], segments[1:]
+    if head == "[]":
+        if isinstance(node, list):
+            for item in node:
+                yield from _resolve(item, rest)
+    elif isinstance(node, dict) and node.get(head) is not None:
+        yield from _resolve(node[head], rest)
+
+
+_TYPES = {
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "boolean": lambda v: isinstance(v, bool),
+}
+
+
+def _check_schema(doc: Dict[str, Any], schema: Dict[str, Any], label: str) -> List[str]:
+    errors = []
+    if schema["apiVersions"] and doc["apiVersion"] not in schema["apiVersions"]:
+        errors.append(
+            f"{label}: apiVersion {doc['apiVersion']!r} is not one of "
+            f"{', '.join(schema['apiVersions'])}"
+        )
+    for dotted, segments in schema["required"]:
+        if next(_resolve(doc, segments), None) is None:
+            errors.append(f"{label}: missing {dotted}")
+    for dotted, segments, expected in schema["types"]:
+        check = _TYPES.get(expected)
+        if check and any(not check(value) for value in _resolve(doc, segments)):
+            errors.append(f"{label}: {dotted} must be {expected}")
+    for dotted, segments, fields in schema["itemRequired"]:
+        for index, item in enumerate(_resolve(doc, segments)):
+            if not isinstance(item, dict):
+                errors.append(f"{label}: {dotted} item {index} must be an object")
+                continue
+            for field in fields:
+                if item.get(field) in (None, ""):
+                    errors.append(f"{label}: {dotted} item {index} is missing {field}")
+    return errors
+
+
+def _check_document(doc: Dict[str, Any], name: str, where: str) -> List[str]:
+    file_schema = load_schemas()["files"].get(name)
+    if file_schema is not None:
+        return _check_schema(doc, file_schema, f"{where} ({name})")
+
+    if "apiVersion" not in doc and "kind" not in doc:
+        return []  # not a Kubernetes object (values.yaml, prometheus.yaml, ...)
+    if not doc.get("apiVersion") or not doc.get("kind"):
+        return [f"{where}: Kubernetes object needs both apiVersion and kind"]
+
+    schema = load_schemas()["kinds"].get(str(doc["kind"]))
+    if schema is None:
+        return []
+    return _check_schema(doc, schema, f"{where} ({doc['kind']})")
+
+
+# ---------------------- Parsers ---------------------- #
+
+def _untemplate(content: str) -> str:
+    """
+    Makes a Helm template parseable as YAML: lines that are only template
+    actions ({{- if }}, {{- toYaml ... | nindent }}) are dropped, inline
+    actions become a placeholder scalar.
+    """
+    lines = []
+    for line in content.split("\n"):
+        stripped = _TEMPLATE_ACTION.sub("", line).strip()
+        if not stripped and "{{" in line:
+            continue
+        lines.append(_TEMPLATE_ACTION.sub("TEMPLATE", line))
+    return "\n".join(lines)
+
+
+def _validate_yaml(content: str, name: str = "") -> List[str]:
+    templated = "{{" in content
+    text = _untemplate(content) if templated else content
+
+    if yaml is None:
+        return ["tab character used for indentation"] if re.search(r"^ *\t", text, re.M) else []
+
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    try:
+        docs = [doc for doc in yaml.load_all(text, Loader=loader) if doc is not None]
+    except yaml.YAMLError as e:
+        mark = getattr(e, "problem_mark", None)
+        problem = getattr(e, "problem", None) or str(e).split("\n")[0]
+        prefix = f"line {mark.line + 1}: " if mark is not None else ""
+        return [f"{prefix}{problem}"]
+
+    errors: List[str] = []
+    for index, doc in enumerate(docs):
+        if not isinstance(doc, (dict, list)):
+            # A config file is never a bare scalar; usually prose instead of YAML
+            errors.append(f"document {index + 1}: expected a mapping or list")
+        elif isinstance(doc, dict) and not templated:
+            # Templated values are placeholders, schema checks would be noise
+            errors.extend(_check_document(doc, name, f"document {index + 1}"))
+    return errors
+
+
+def _validate_json(content: str, name: str = "") -> List[str]:
+    try:
+        json.loads(content)
+    except ValueError as e:
+        return [str(e)]
+    return []
+
+
+def _validate_dockerfile(content: str, name: str = "") -> List[str]:
+    errors: List[str] = []
+    seen_from = False
+    heredoc: Optional[str] = None
+    continued = False
+
+    for number, line in enumerate(content.split("\n"), start=1):
+        stripped = line.strip()
+        if heredoc is not None:
+            if stripped == heredoc:
+                heredoc = None
+            continue
+        if continued:
+            continued = stripped.endswith("\\")
+            continue
+        if not stripped or stripped.startswith("#"):
+            continue
+
+        instruction = stripped.split(None, 1)[0].upper()
+        if instruction not in DOCKERFILE_INSTRUCTIONS:
+            errors.append(f"line {number}: unknown instruction {stripped.split(None, 1)[0]!r}")
+        elif instruction == "FROM":
+            seen_from = True
+        elif not seen_from and instruction != "ARG":
+            errors.append(f"line {number}: {instruction} before the first FROM")
+
+        heredoc_match = _HEREDOC.search(stripped) if instruction in ("RUN", "COPY") else None
+        if heredoc_match:
+            heredoc = heredoc_match.group(1)
+        continued = stripped.endswith("\\")
+
+    if not seen_from:
+        errors.append("no FROM instruction")
+    if heredoc is not None:
+        errors.append(f"unterminated heredoc {heredoc!r}")
+    return errors
+
+
+def _check_balance(content: str, name: str = "", groovy: bool = False) -> List[str]:
+    """
+    Bracket and string balance for HCL and Groovy (Jenkinsfile): comments,
+    heredocs, escapes and ${...} interpolation are understood; nothing else.
+    """
+    pairs = {")": "(", "]": "[", "}": "{"}
+    stack: List[Tuple[str, int]] = []  # (opener, line); "${" is interpolation
+    quotes = ("'''", '"""', '"', "'") if groovy else ('"',)
+    i, line, n = 0, 1, len(content)
+
+    while i < n:
+        ch = content[i]
+        top = stack[-1][0] if stack else None
+
+        if top in quotes:
+            if ch == "\\":
+                i += 2
+                continue
+            if content.startswith(top, i):
+                stack.pop()
+                i += len(top)
+                continue
+            if content.startswith("${", i) and top != "'" and top != "'''":
+                stack.append(("${", line))
+                i += 2
+                continue
+            if ch == "\n":
+                if len(top) == 1 and groovy:
+                    return [f"line {line}: unterminated string"]
+                line += 1
+            i += 1
+            continue
+
+        if ch == "\n":
+            line += 1
+        elif ch == "#" and not groovy or content.startswith("//", i):
+            end = content.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        elif content.startswith("/*", i):
+            end = content.find("*/", i + 2)
+            if end == -1:
+                return [f"line {line}: unterminated block comment"]
+            line += content.count("\n", i, end)
+            i = end + 2
+            continue
+        elif not groovy and content.startswith("<<", i):
+            match = _HEREDOC.match(content, i)
+            if match:
+                terminator = re.compile(rf"^\s*{match.group(1)}\s*$", re.M)
+                end = terminator.search(content, match.end())
+                if end is None:
+                    return [f"line {line}: unterminated heredoc {match.group(1)!r}"]
+                line += content.count("\n", i, end.end())
+                i = end.end()
+                continue
+        elif any(content.startswith(q, i) for q in quotes):
+            quote = next(q for q in quotes if content.startswith(q, i))
+            stack.append((quote, line))
+            i += len(quote)
+            continue
+        elif ch in "([{":
+            stack.append((ch, line))
+        elif ch in ")]}":
+            if top == "${" and ch == "}":
+                stack.pop()
+            elif top != pairs[ch]:
+                return [f"line {line}: unexpected {ch!r}"]
+            else:
+                stack.pop()
+        i += 1
+
+    if stack:
+        opener, opened = stack[-1]
+        what = "string" if opener in quotes else f"{opener!r}"
+        return [f"line {opened}: unclosed {what}"]
+    return []
+
+
+def _validate_hcl(content: str, name: str = "") -> List[str]:
+    errors = _check_balance(content, name)
+    code = [
+        line for line in content.split("\n")
+        if line.strip() and not line.lstrip().startswith(("#", "//"))
+    ]
+    if not errors and code and not _HCL_STATEMENT.search("\n".join(code)):
+        errors.append("no blocks or attributes found")  # e.g. prose instead of HCL
+    return errors
+
+
+_VALIDATORS = {
+    "yaml": _validate_yaml,
+    "json": _validate_json,
+    "dockerfile": _validate_dockerfile,
+    "hcl": _validate_hcl,
+    "groovy": lambda content, name: _check_balance(content, name, groovy=True),
+}
+
+
+@lru_cache(maxsize=512)
+def _errors(kind: str, name: str, content: str) -> Tuple[str, ...]:
+    # Cached by content: retries and repeated bundles re-check for free
+    validator = _VALIDATORS.get(kind)
+    if validator is None:
+        return ()
+    if not content.strip():
+        return ("file is empty",)
+    errors = validator(content, name)
+    if len(errors) > MAX_ERRORS:
+        errors = errors[:MAX_ERRORS] + [f"... and {len(errors) - MAX_ERRORS} more"]
+    return tuple(errors)
+
+
+# ---------------------- Public API ---------------------- #
+
+def validate_artifact(path: str, content: Optional[str]) -> Dict[str, Any]:
+    """
+    Syntax (and, for manifests, schema) check of one file. Returns
+    {"kind", "errors": [...], "ms"}; an empty error list means valid.
+    """
+    started = time.perf_counter()
+    content = content or ""
+    kind = artifact_kind(path, content)
+    errors = list(_errors(kind, os.path.basename(path), content))
+    elapsed = time.perf_counter() - started
+
+    metrics.observe(f"validation.seconds.{kind}", elapsed)
+    if errors:
+        metrics.incr(f"validation.failures.{kind}")
+    return {"kind": kind, "errors": errors, "ms": round(elapsed * 1000, 3)}
+
+
+async def validate_bundle(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validates every file of a generation result in parallel. Returns
+    {"valid", "files": {path: {"kind", "errors", "ms"}}, "invalid": [...],
+    "elapsed_ms"}.
+    """
+    started = time.perf_counter()
+    files = list(iter_bundle_files(result))
+    reports = await asyncio.gather(
+        *(asyncio.to_thread(validate_artifact, path, content) for path, content in files)
+    )
+    by_path = {path: report for (path, _), report in zip(files, reports)}
+    invalid = [path for path, report in by_path.items() if report["errors"]]
+
+    metrics.observe("validation.bundle_seconds", time.perf_counter() - started)
+    return {
+        "valid": not invalid,
+        "files": by_path,
+        "invalid": invalid,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+def repair_instructions(errors: List[str]) -> str:
+    """
+    Instructions for a targeted retry of one file that failed validation.
+    """
+    listed = "\n".join(f"- {error}" for error in errors)
+    return (
+        "This file failed validation with the errors below. Fix ONLY these "
+        "errors and keep everything else exactly as it is.\n" + listed
+    )
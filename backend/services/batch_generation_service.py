@@ -0,0 +1,222 @@
+# backend/services/batch_generation_service.py
+
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.generation_service import GenerationService
+from utils.logger import get_logger
+from utils.zip_builder import MONOREPO_ROOT_DIRS
+
+logger = get_logger(__name__)
+
+BATCH_MAX_SERVICES = int(os.getenv("INFRASCRIBE_BATCH_MAX_SERVICES", "100"))
+BATCH_PROCESS_WORKERS = int(
+    os.getenv("INFRASCRIBE_BATCH_PROCESS_WORKERS", str(os.cpu_count() or 2))
+)
+BATCH_AI_CONCURRENCY = int(os.getenv("INFRASCRIBE_BATCH_AI_CONCURRENCY", "4"))
+
+# Modes that call the model. A batch returns one ZIP and has no upgrade
+# channel, so ai_speculative services run (and are billed) as ai_thick.
+AI_MODES = ("ai_thick", "ai_speculative")
+
+# Below this many unique rule-based specs, pickling to a worker process
+# costs more than just rendering the templates inline.
+PROCESS_POOL_MIN_SPECS = 4
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_worker_service: Optional[GenerationService] = None
+
+
+def is_ai_mode(mode: Optional[str]) -> bool:
+    return (mode or "rule_based").lower() in AI_MODES
+
+
+# ---------------------- Process pool ---------------------- #
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # spawn: never fork a process that already runs an event loop + threadpool
+        _process_pool = ProcessPoolExecutor(
+            max_workers=max(1, BATCH_PROCESS_WORKERS),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def _generate_rule_based(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Process-pool entry point. Must stay module-level so it can be pickled.
+    """
+    global _worker_service
+    if _worker_service is None:
+        _worker_service = GenerationService()
+    return _worker_service.generate_sync(SimpleNamespace(**spec))
+
+
+def service_folder(raw_name: str) -> str:
+    """
+    Normalizes a service name into a relative folder path; rejects escapes
+    and names that would land inside the monorepo's shared root folders.
+    """
+    parts = [p for p in str(raw_name).replace("\\", "/").split("/") if p not in ("", ".")]
+    if not parts or ".." in parts:
+        raise ValueError(f"Invalid service name: {raw_name!r}")
+    if parts[0].lower() in MONOREPO_ROOT_DIRS:
+        raise ValueError(
+            f"Invalid service name: {raw_name!r} "
+            f"(reserved folders: {', '.join(MONOREPO_ROOT_DIRS)})"
+        )
+    return "/".join(parts)
+
+
+def expand_services(
+    defaults: Dict[str, Any],
+    entries: List[Dict[str, Any]],
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Merges monorepo defaults into each service entry.
+    Returns [(folder name, raw spec dict), ...]; the spec is not validated here.
+    """
+    services = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise ValueError(f"Service #{index + 1} must be an object")
+        merged = {**defaults, **entry}
+        raw_name = merged.pop("name", None) or merged.pop("path", None)
+        merged.pop("path", None)
+        if not raw_name:
+            raw_name = f"service-{index + 1}"
+        services.append((service_folder(raw_name), merged))
+    return services
+
+
+def parse_manifest(data: Any) -> Tuple[str, List[Tuple[str, Dict[str, Any]]]]:
+    """
+    Accepts either a plain list of specs or a monorepo manifest
+    ({"name", "defaults", "services"}) and returns (archive name, services).
+    """
+    if isinstance(data, list):
+        return "infrascribe", expand_services({}, data)
+    if isinstance(data, dict) and isinstance(data.get("services"), list):
+        name = service_folder(data.get("name") or "monorepo").replace("/", "-")
+        return name, expand_services(data.get("defaults") or {}, data["services"])
+    raise ValueError("Expected a list of specs or a manifest with a 'services' list")
+
+
+def spec_key(spec: Dict[str, Any]) -> str:
+    """
+    Canonical key for a generation spec. Identical sub-requests share one run.
+    """
+    return json.dumps(spec, sort_keys=True, default=str)
+
+
+class BatchGenerationService:
+    """
+    Generates many GenerateRequest-like specs in one go:
+      - identical specs are generated once
+      - rule-based specs run concurrently on a process pool
+      - AI specs (ai_thick, ai_speculative) run with bounded async concurrency
+    """
+
+    def __init__(
+        self,
+        generation_service: Optional[GenerationService] = None,
+        ai_concurrency: int = BATCH_AI_CONCURRENCY,
+    ):
+        self.generation_service = generation_service or GenerationService()
+        self.ai_concurrency = max(1, ai_concurrency)
+
+    async def generate_many(
+        self,
+        services: List[Tuple[str, Dict[str, Any]]],
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        services: ordered list of (service name, spec dict).
+        Returns {service name: result dict} in the same order.
+        """
+        if not services:
+            raise ValueError("Batch must contain at least one service")
+        if len(services) > BATCH_MAX_SERVICES:
+            raise ValueError(
+                f"Batch has {len(services)} services; the limit is {BATCH_MAX_SERVICES}"
+            )
+
+        names = [name for name, _ in services]
+        if len(set(names)) != len(names):
+            raise ValueError("Service names in a batch must be unique")
+
+        unique: Dict[str, Dict[str, Any]] = {}
+        for _, spec in services:
+            unique.setdefault(spec_key(spec), spec)
+
+        logger.info(
+            "Batch generation started",
+            extra={"services": len(services), "unique_specs": len(unique)},
+        )
+
+        rule_based = {
+            key: spec for key, spec in unique.items() if not is_ai_mode(spec.get("mode"))
+        }
+        ai_specs = {key: spec for key, spec in unique.items() if key not in rule_based}
+
+        rule_task = self._run_rule_based(rule_based)
+        ai_task = self._run_ai(ai_specs)
+        rule_results, ai_results = await asyncio.gather(rule_task, ai_task)
+
+        by_key = {**rule_results, **ai_results}
+        return {name: by_key[spec_key(spec)] for name, spec in services}
+
+    # ---------------------- Rule-based ---------------------- #
+
+    async def _run_rule_based(
+        self, specs: Dict[str, Dict[str, Any]]
+    ) -> Dict[str, Dict[str, Any]]:
+        if not specs:
+            return {}
+
+        if len(specs) < PROCESS_POOL_MIN_SPECS or BATCH_PROCESS_WORKERS <= 1:
+            return {
+                key: self.generation_service.generate_sync(SimpleNamespace(**spec))
+                for key, spec in specs.items()
+            }
+
+        loop = asyncio.get_running_loop()
+        pool = _get_process_pool()
+        keys = list(specs)
+        results = await asyncio.gather(
+            *(loop.run_in_executor(pool, _generate_rule_based, specs[key]) for key in keys)
+        )
+        return dict(zip(keys, results))
+
+    # ---------------------- AI ---------------------- #
+
+    async def _run_ai(
+        self, specs: Dict[str, Dict[str, Any]]
+    ) -> Dict[str, Dict[str, Any]]:
+        if not specs:
+            return {}
+
+        semaphore = asyncio.Semaphore(self.ai_concurrency)
+
+        async def run_one(spec: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.generation_service.generate_ai_thick(
+                    SimpleNamespace(**spec)
+                )
+
+        keys = list(specs)
+        results = await asyncio.gather(*(run_one(specs[key]) for key in keys))
+        return dict(zip(keys, results))
@@ -0,0 +1,143 @@
+# backend/services/explain_index.py
+
+import hashlib
+import itertools
+import json
+import os
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from utils.logger import get_logger
+from utils.zip_builder import iter_bundle_files
+
+logger = get_logger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent  # backend/
+INDEX_PATH = Path(
+    os.getenv(
+        "INFRASCRIBE_EXPLAIN_INDEX",
+        str(BASE_DIR / "templates" / "explanations" / "index.json"),
+    )
+)
+INDEX_VERSION = 1
+
+# Every option the rule-based generator branches on. Values outside these
+# lists fall through to the same defaults, so they add no new artefacts.
+RULE_BASED_OPTIONS = {
+    "language": ["python", "node", "java"],
+    "framework": [None, "fastapi", "flask"],
+    "cicd_tool": ["github_actions", "jenkins", "gitlab_ci", "other"],
+    "deploy_target": ["kubernetes", "helm", "none"],
+    "cloud_provider": ["aws", "gcp"],
+    "include_gitops": [True, False],
+    "include_monitoring": [True, False],
+    "infra_preset": ["all", "eks", "ec2-k3s", "ecs-fargate", "none"],
+}
+
+
+def content_key(content: str) -> str:
+    """
+    Hash used to look up explanations. Line endings and surrounding
+    whitespace are normalised so copies from the UI still hit.
+    """
+    normalized = content.replace("\r\n", "\n").strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+# The README is stitched together per option combination (thousands of
+# variants) and is prose already; it is left to the model on demand.
+SKIPPED_ARTIFACTS = {"README.md"}
+
+
+def iter_rule_based_artifacts() -> Iterator[Tuple[str, str]]:
+    """
+    Yields (archive path, content) for every distinct config file the
+    rule-based generator can emit, each content exactly once.
+    """
+    from services.generation_service import GenerationService
+
+    service = GenerationService()
+    seen = set()
+    keys = list(RULE_BASED_OPTIONS)
+
+    for values in itertools.product(*(RULE_BASED_OPTIONS[k] for k in keys)):
+        result = service.generate_sync(SimpleNamespace(**dict(zip(keys, values))))
+        for arcname, content in iter_bundle_files(result):
+            if arcname in SKIPPED_ARTIFACTS or not content or not content.strip():
+                continue
+            key = content_key(content)
+            if key in seen:
+                continue
+            seen.add(key)
+            yield arcname, content
+
+
+class ExplanationIndex:
+    """
+    Precomputed explanations for deterministic rule-based artefacts, keyed
+    by content hash. Built offline (`python cli.py build-explain-index`);
+    a missing index file simply means every lookup misses.
+    """
+
+    def __init__(self, path: Path = INDEX_PATH):
+        self.path = path
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._meta: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is not None:
+            return self._entries
+
+        with self._lock:
+            if self._entries is not None:
+                return self._entries
+            entries: Dict[str, Dict[str, Any]] = {}
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                if data.get("version") == INDEX_VERSION:
+                    entries = data.get("entries") or {}
+                    self._meta = {k: v for k, v in data.items() if k != "entries"}
+                else:
+                    logger.warning("Explanation index version mismatch, ignoring")
+            except FileNotFoundError:
+                logger.info("No explanation index found", extra={"path": str(self.path)})
+            except (OSError, ValueError):
+                logger.exception("Failed to load explanation index")
+            self._entries = entries
+            return entries
+
+    def lookup(self, content: str) -> Optional[str]:
+        entry = self._load().get(content_key(content))
+        return entry["explanation"] if entry else None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._load()
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def add(self, content: str, filename: str, explanation: str) -> None:
+        self._load()[content_key(content)] = {
+            "filename": filename,
+            "explanation": explanation,
+        }
+
+    def save(self, model: str) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(
+            json.dumps(
+                {"version": INDEX_VERSION, "model": model, "entries": self._load()},
+                indent=1,
+                sort_keys=True,
+                ensure_ascii=False,
+            ),
+            encoding="utf-8",
+        )
+        tmp.replace(self.path)
+
+
+explanation_index = ExplanationIndex()
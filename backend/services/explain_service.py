@@ -0,0 +1,398 @@
+# backend/services/explain_service.py
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from services.explain_index import content_key, explanation_index
+from services.model_router import model_router
+from services.usage_ledger import usage_ledger
+from utils.llm import get_async_client, stream_chat_completion
+from utils.logger import get_logger
+from utils.metrics import metrics
+from utils.prompt_cache import record_prompt_cache
+from utils.shared_cache import shared_cache
+from utils.token_budget import count_tokens, fit_for_explain, usage_from_completion
+
+logger = get_logger(__name__)
+
+# Default/cheapest explain model; the router picks per call (services/model_router.py)
+EXPLAIN_MODEL = "gpt-4o-mini"
+EXPLAIN_CACHE_TTL_SECONDS = int(os.getenv("INFRASCRIBE_EXPLAIN_CACHE_TTL_SECONDS", str(30 * 86400)))
+EXPLAIN_BATCH_CONCURRENCY = int(os.getenv("INFRASCRIBE_EXPLAIN_BATCH_CONCURRENCY", "4"))
+EXPLAIN_BATCH_MAX_FILES = 100
+
+EMPTY_FILE_EXPLANATION = "This file is empty, so there is nothing to explain yet."
+
+EXPLAIN_SYSTEM_PROMPT = "You are a DevOps expert who explains config files in simple language."
+
+
+# Prompts are a byte-identical static prefix (rules + output contract)
+# followed by the request-specific suffix, so provider-side prompt caching
+# can reuse the prefix across requests. Keep variable values out of prefixes.
+
+EXPLAIN_STRUCTURE = """
+Explain in this structure:
+1. Purpose – 2–4 sentences describing what this file does.
+2. Key settings – bullet points for the most important fields and what they control.
+3. Safe edits – bullet points for things the user can safely tweak (like replicas, image tag, resource limits, regions, ports).
+4. Cautions – bullet points for things they should be careful about before changing.
+
+Use Markdown-style bullets and short paragraphs.
+"""
+
+EXPLAIN_PROMPT_PREFIX = """
+You are InfraScribe, a DevOps assistant. Explain the file given at the end of this
+message to a developer in clear, concise language.
+""" + EXPLAIN_STRUCTURE
+
+CHUNK_PROMPT_PREFIX = """
+You are InfraScribe, a DevOps assistant. The file given at the end of this message
+is too large to explain in one pass, so you are seeing only one part of it.
+
+Write compact notes on this part only: what it configures, the important fields
+and their values, and anything risky to change. Do not write an introduction.
+"""
+
+REDUCE_PROMPT_PREFIX = """
+You are InfraScribe, a DevOps assistant. At the end of this message are notes on
+consecutive parts of one large file. Combine them into a single explanation for
+a developer.
+""" + EXPLAIN_STRUCTURE
+
+PROMPT_PREFIXES = {
+    "explain": EXPLAIN_PROMPT_PREFIX,
+    "explain_map": CHUNK_PROMPT_PREFIX,
+    "explain_reduce": REDUCE_PROMPT_PREFIX,
+}
+
+
+def _file_section(filename: str, label: Optional[str], heading: str, body: str) -> str:
+    return f"""
+File name: {filename}
+Label: {label or ""}
+
+{heading}:
+----------------
+{body}
+----------------
+"""
+
+
+def build_explain_prompt(filename: str, label: Optional[str], content: str) -> str:
+    return EXPLAIN_PROMPT_PREFIX + _file_section(filename, label, "File content", content)
+
+
+def build_chunk_prompt(
+    filename: str, label: Optional[str], chunk: str, part: int, parts: int
+) -> str:
+    return CHUNK_PROMPT_PREFIX + _file_section(
+        filename, label, f"File content (part {part} of {parts})", chunk
+    )
+
+
+def build_reduce_prompt(filename: str, label: Optional[str], notes: List[str]) -> str:
+    joined = "\n\n".join(f"Part {i}:\n{note}" for i, note in enumerate(notes, start=1))
+    return REDUCE_PROMPT_PREFIX + _file_section(filename, label, "Notes", joined)
+
+
+def _static_prefix(operation: str) -> str:
+    return EXPLAIN_SYSTEM_PROMPT + PROMPT_PREFIXES[operation]
+
+
+def _messages(user_prompt: str, usage: Dict[str, Any]) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Returns (messages, estimated prompt tokens) and adds the estimate to usage.
+    """
+    prompt_tokens = count_tokens(EXPLAIN_SYSTEM_PROMPT + user_prompt, EXPLAIN_MODEL)
+    usage["estimated_prompt_tokens"] = usage.get("estimated_prompt_tokens", 0) + prompt_tokens
+    messages = [
+        {"role": "system", "content": EXPLAIN_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+    return messages, prompt_tokens
+
+
+def _note_model(usage: Dict[str, Any], model: str, escalations: int = 0) -> None:
+    usage["model"] = model
+    usage["escalations"] = usage.get("escalations", 0) + escalations
+
+
+async def _complete(
+    user_prompt: str,
+    usage: Dict[str, Any],
+    operation: str = "explain",
+    artifact: Optional[str] = None,
+) -> str:
+    messages, prompt_tokens = _messages(user_prompt, usage)
+
+    async def call(model: str) -> str:
+        usage["calls"] = usage.get("calls", 0) + 1
+        started = time.perf_counter()
+        completion = await get_async_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.3,
+        )
+        usage_ledger.record(
+            operation, model, getattr(completion, "usage", None), time.perf_counter() - started
+        )
+        usage_from_completion(completion, usage)
+        record_prompt_cache(
+            operation, getattr(completion, "usage", None), _static_prefix(operation)
+        )
+        return (completion.choices[0].message.content or "").strip()
+
+    # An empty answer is the one failure we can detect cheaply: escalate on it
+    text, model, escalations = await model_router.run(
+        "explain", call, prompt_tokens, validate=bool, artifact=artifact
+    )
+    _note_model(usage, model, escalations)
+    return text
+
+
+async def _prepare_final_prompt(
+    filename: str, label: Optional[str], content: str
+) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Budgets the content and returns (prompt, operation, usage) for the final
+    (user-visible) completion. For oversized files this runs the map pass
+    over all chunks first and returns the reduce prompt.
+    """
+    fitted = fit_for_explain(filename, content, model=EXPLAIN_MODEL)
+    chunks = fitted["chunks"]
+    usage: Dict[str, Any] = {
+        "content_tokens": fitted["content_tokens"],
+        "compacted_tokens": fitted["compacted_tokens"],
+        "chunks": len(chunks),
+    }
+
+    if len(chunks) == 1:
+        return build_explain_prompt(filename, label, chunks[0]), "explain", usage
+
+    metrics.incr("explain.map_reduce")
+    semaphore = asyncio.Semaphore(max(1, EXPLAIN_BATCH_CONCURRENCY))
+
+    async def map_one(part: int, chunk: str) -> str:
+        async with semaphore:
+            return await _complete(
+                build_chunk_prompt(filename, label, chunk, part, len(chunks)),
+                usage,
+                "explain_map",
+                filename,
+            )
+
+    notes = await asyncio.gather(
+        *(map_one(i, chunk) for i, chunk in enumerate(chunks, start=1))
+    )
+    return build_reduce_prompt(filename, label, [n for n in notes if n]), "explain_reduce", usage
+
+
+def _record_usage(usage: Dict[str, Any]) -> None:
+    metrics.observe(
+        "explain.prompt_tokens", usage.get("prompt_tokens", usage["estimated_prompt_tokens"])
+    )
+
+
+async def explain_with_model(
+    filename: str, label: Optional[str], content: str
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Ask the model for an explanation. Returns (text, usage); text is "" if the
+    model answered with nothing. Content is compacted first, and files over
+    the per-call budget are explained part by part, then summarised
+    (raises TokenBudgetExceeded beyond the hard limits).
+    Shared by /explain and the offline index builder so both use the same prompt.
+    """
+    prompt, operation, usage = await _prepare_final_prompt(filename, label, content)
+    text = await _complete(prompt, usage, operation, filename)
+    _record_usage(usage)
+    return text, usage
+
+
+# ---------------------- Cache ---------------------- #
+
+class ExplanationCache:
+    """
+    Model explanations keyed by content hash, in the shared cache tier
+    (utils/shared_cache.py), so a file explained once is not paid for again
+    by this worker or, with a shared backend, by any other.
+    """
+
+    namespace = "explain"
+
+    def __init__(self, ttl: int = EXPLAIN_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await shared_cache.get(self.namespace, key)
+        return value if isinstance(value, str) else None
+
+    async def put(self, key: str, value: str) -> None:
+        await shared_cache.set(self.namespace, key, value, ttl=self.ttl)
+
+
+explanation_cache = ExplanationCache()
+
+
+async def lookup_explanation(content: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Returns (explanation, source) without calling the model;
+    source is "index" or "cache", or (None, None) on a miss.
+    """
+    indexed = explanation_index.lookup(content)
+    if indexed:
+        metrics.incr("explain.index_hits")
+        return indexed, "index"
+
+    cached = await explanation_cache.get(content_key(content))
+    if cached:
+        metrics.incr("explain.cache_hits")
+        return cached, "cache"
+
+    metrics.incr("explain.misses")
+    return None, None
+
+
+async def resolve_explanation(
+    filename: str, label: Optional[str], content: str
+) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+    """
+    Index → cache → model. Returns (explanation, source, usage);
+    usage is None when no model call was made.
+    """
+    text, source = await lookup_explanation(content)
+    if text:
+        return text, source, None
+
+    text, usage = await explain_with_model(filename, label, content)
+    if text:
+        await explanation_cache.put(content_key(content), text)
+    return text, "model", usage
+
+
+async def stream_explanation(
+    filename: str, label: Optional[str], content: str
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming variant of resolve_explanation. Yields {"event", "data"} dicts:
+    "progress" once oversized files have been mapped, "delta" per model token
+    chunk, then one "done" with {"explanation", "source", "cached", "usage"}.
+    Indexed/cached explanations go straight to "done".
+    """
+    text, source = await lookup_explanation(content)
+    if text:
+        yield {
+            "event": "done",
+            "data": {"explanation": text, "source": source, "cached": True, "usage": None},
+        }
+        return
+
+    prompt, operation, usage = await _prepare_final_prompt(filename, label, content)
+    if usage["chunks"] > 1:
+        yield {"event": "progress", "data": {"stage": "summarising", "chunks": usage["chunks"]}}
+
+    # Tokens are forwarded as they arrive, so there is no escalation here
+    messages, prompt_tokens = _messages(prompt, usage)
+    model = model_router.choose("explain", prompt_tokens, artifact=filename)
+    _note_model(usage, model)
+    usage["calls"] = usage.get("calls", 0) + 1
+
+    parts: List[str] = []
+    started = time.perf_counter()
+    async with model_router.track(model):
+        async for delta in stream_chat_completion(
+            model,
+            messages,
+            temperature=0.3,
+            usage=usage,
+            operation=operation,
+            prefix=_static_prefix(operation),
+            on_usage=lambda u: usage_ledger.record(
+                operation, model, u, time.perf_counter() - started
+            ),
+        ):
+            parts.append(delta)
+            yield {"event": "delta", "data": {"text": delta}}
+
+    text = "".join(parts).strip()
+    _record_usage(usage)
+    if text:
+        await explanation_cache.put(content_key(content), text)
+    yield {
+        "event": "done",
+        "data": {"explanation": text, "source": "model", "cached": False, "usage": usage},
+    }
+
+
+# ---------------------- Batch ---------------------- #
+
+async def explain_many(
+    files: List[Tuple[str, str]],
+    concurrency: int = EXPLAIN_BATCH_CONCURRENCY,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Explains a whole bundle. Identical files are explained once; indexed and
+    cached files are answered immediately, the rest run with bounded
+    concurrency. Yields one result per path, in completion order.
+    """
+    groups: "OrderedDict[str, List[Tuple[str, str]]]" = OrderedDict()
+    for path, content in files:
+        if not (content or "").strip():
+            yield {"path": path, "explanation": EMPTY_FILE_EXPLANATION, "source": "empty"}
+            continue
+        groups.setdefault(content_key(content), []).append((path, content))
+
+    pending = []
+    # One round trip per group would serialise on a remote cache: look up together
+    found = await asyncio.gather(
+        *(lookup_explanation(members[0][1]) for members in groups.values())
+    )
+    for (key, members), (text, source) in zip(groups.items(), found):
+        if text:
+            for member_path, _ in members:
+                yield {"path": member_path, "explanation": text, "source": source}
+        else:
+            pending.append(key)
+
+    if not pending:
+        return
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(key: str) -> Tuple[str, Optional[str], Optional[str], Optional[Dict]]:
+        path, content = groups[key][0]
+        async with semaphore:
+            try:
+                text, usage = await explain_with_model(os.path.basename(path), None, content)
+            except Exception as e:
+                logger.exception("Batch explain error", extra={"path": path})
+                return key, None, f"{type(e).__name__}: {e}", None
+        if text:
+            await explanation_cache.put(key, text)
+        return key, text, None, usage
+
+    tasks = [asyncio.create_task(run_one(key)) for key in pending]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            key, text, error, usage = await next_done
+            for index, (member_path, _) in enumerate(groups[key]):
+                if error or not text:
+                    yield {
+                        "path": member_path,
+                        "explanation": None,
+                        "source": "error",
+                        "error": error or "empty response from model",
+                    }
+                else:
+                    item = {"path": member_path, "explanation": text, "source": "model"}
+                    if index == 0 and usage:
+                        # Duplicates share the one call; report its tokens once
+                        item["usage"] = usage
+                    yield item
+    finally:
+        # Client went away mid-stream: stop paying for the remaining files
+        for task in tasks:
+            task.cancel()
@@ -1,10 +1,63 @@
-from typing import Any, Dict, Optional
+import asyncio
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional
 from services.ai_generation_service import AIGenerationService
+from services.artifact_validator import repair_instructions, validate_artifact, validate_bundle
+from services.refine_service import refine
+from services.repo_analyzer import RepoAnalyzer
 from utils.logger import get_logger
+from utils.metrics import metrics
+from utils.shared_cache import shared_cache
+from utils.zip_builder import iter_bundle_files, set_bundle_file
 from datetime import datetime
 from typing import Optional
 logger = get_logger(__name__)
 
+# Bundle path prefix -> AI output key, to regenerate a whole artefact rule-based
+PATH_ARTIFACT_KEYS = (
+    ("README.md", "readme_md"),
+    ("Dockerfile", "dockerfile"),
+    ("ci-cd/", "cicd"),
+    ("k8s/", "k8s"),
+    ("helm/", "helm"),
+    ("gitops/", "argocd"),
+    ("monitoring/", "monitoring"),
+    ("infra/terraform/", "terraform"),
+)
+
+
+# Characters that give a start command shell meaning (so it cannot be exec form)
+SHELL_SYNTAX = re.compile(r"""[|&;<>()$`\\"'*?\[\]{}~#!\n]""")
+ENV_ASSIGNMENT = re.compile(r"^\s*[A-Za-z_][A-Za-z0-9_]*=")
+
+# Rule-based bundles in the shared cache tier. Short by default: a cached
+# README keeps the "Generated on" stamp of its first generation.
+GENERATE_CACHE_TTL_SECONDS = int(os.getenv("INFRASCRIBE_GENERATE_CACHE_TTL_SECONDS", "600"))
+# Payload fields the rule-based generator reads (without a repo_url)
+RULE_BASED_FIELDS = (
+    "language",
+    "framework",
+    "cicd_tool",
+    "deploy_target",
+    "cloud_provider",
+    "include_gitops",
+    "include_monitoring",
+    "infra_preset",
+)
+# Keys include the generator's own source, so workers running different
+# releases against one shared cache never serve each other's bundles
+_RULES_VERSION = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()[:12]
+
+
+def rule_based_cache_key(payload: Any) -> str:
+    spec = {field: getattr(payload, field, None) for field in RULE_BASED_FIELDS}
+    canonical = json.dumps(spec, sort_keys=True, separators=(",", ":"))
+    return f"{_RULES_VERSION}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]}"
+
 
 class GenerationService:
     """
@@ -14,11 +67,37 @@ class GenerationService:
 
     def __init__(self):
         self.ai_service = AIGenerationService()
+        self.repo_analyzer = RepoAnalyzer()
 
     # ==========================================================
     # RULE-BASED GENERATION (ALWAYS RETURNS A DICT)
     # ==========================================================
     async def generate(self, payload: Any) -> Dict[str, Any]:
+        if getattr(payload, "repo_url", None):
+            # Directory walk + manifest reads are blocking I/O
+            repo_analysis = await asyncio.to_thread(
+                self.repo_analyzer.analyze, payload.repo_url
+            )
+            return self.generate_sync(payload, repo_analysis=repo_analysis)
+
+        # Same spec, same bundle: shared across workers via the cache tier
+        key = rule_based_cache_key(payload)
+        cached = await shared_cache.get("generate", key)
+        if cached is not None:
+            return cached
+        result = self.generate_sync(payload)
+        await shared_cache.set("generate", key, result, ttl=GENERATE_CACHE_TTL_SECONDS)
+        return result
+
+    def generate_sync(
+        self,
+        payload: Any,
+        repo_analysis: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Synchronous core of the rule-based generator.
+        Pure CPU work with no event loop, so it can run in worker processes.
+        """
         language = getattr(payload, "language", "python")
         framework = getattr(payload, "framework", None)
         cicd_tool = getattr(payload, "cicd_tool", "github_actions")
@@ -28,6 +107,21 @@ class GenerationService:
         include_monitoring = getattr(payload, "include_monitoring", False)
         infra_preset = getattr(payload, "infra_preset", "all")
 
+        # Local repo_url: fill in whatever the request left open
+        repo_url = getattr(payload, "repo_url", None)
+        if repo_analysis is None and repo_url:
+            repo_analysis = self.repo_analyzer.analyze(repo_url)
+
+        app_port = None
+        start_command = None
+        if repo_analysis:
+            if (language or "auto").lower() == "auto" and repo_analysis.get("language"):
+                language = repo_analysis["language"]
+            if not framework:
+                framework = repo_analysis.get("framework")
+            app_port = repo_analysis.get("port")
+            start_command = repo_analysis.get("start_command")
+
         logger.info("Starting infra generation", extra={
             "language": language,
             "framework": framework,
@@ -37,7 +131,9 @@ class GenerationService:
         })
 
         # Dockerfile
-        dockerfile = self._generate_dockerfile(language, framework)
+        dockerfile = self._generate_dockerfile(
+            language, framework, app_port=app_port, start_command=start_command
+        )
 
         # CI/CD
         cicd_meta = self._generate_cicd(cicd_tool, language, framework)
@@ -45,13 +141,13 @@ class GenerationService:
 
         # Kubernetes / Helm
         k8s_manifests = (
-            self._generate_k8s_manifests(language, framework)
+            self._generate_k8s_manifests(language, framework, app_port=app_port)
             if deploy_target in ("kubernetes", "helm")
             else None
         )
 
         helm_chart = (
-            self._generate_helm_chart(language, framework)
+            self._generate_helm_chart(language, framework, app_port=app_port)
             if deploy_target == "helm"
             else None
         )
@@ -85,6 +181,12 @@ class GenerationService:
                 "infra_preset": infra_preset,
             }
         }
+        if repo_analysis:
+            raw["repo_analysis"] = {
+                key: repo_analysis.get(key)
+                for key in ("language", "framework", "port", "start_command",
+                            "manifests", "version", "cached", "truncated")
+            }
 
         readme_md = self._generate_readme(
             language=language,
@@ -115,6 +217,105 @@ class GenerationService:
             "readme_md": readme_md,
         }
 
+    def _fill_missing_artifacts(
+        self, payload: Any, result: Dict[str, Any], missing: List[str]
+    ) -> None:
+        """
+        Generates the artefacts listed in `missing` (AI output keys) with the
+        rule-based helpers and writes them into `result` in place.
+        """
+        language = getattr(payload, "language", "python")
+        framework = getattr(payload, "framework", None)
+        cicd_tool = getattr(payload, "cicd_tool", "github_actions")
+        deploy_target = getattr(payload, "deploy_target", "kubernetes")
+        cloud_provider = getattr(payload, "cloud_provider", "aws")
+        infra_preset = getattr(payload, "infra_preset", "all")
+
+        if "dockerfile" in missing:
+            result["dockerfile"] = self._generate_dockerfile(language, framework)
+        if "cicd" in missing:
+            cicd_meta = self._generate_cicd(cicd_tool, language, framework)
+            result["cicd_config"] = cicd_meta.get("content", "")
+            result["cicd_meta"] = cicd_meta
+        if "k8s" in missing and deploy_target in ("kubernetes", "helm"):
+            result["k8s_manifests"] = self._generate_k8s_manifests(language, framework)
+        if "helm" in missing and deploy_target == "helm":
+            result["helm_chart"] = self._generate_helm_chart(language, framework)
+        if "argocd" in missing and getattr(payload, "include_gitops", True):
+            result["argocd_app"] = self._generate_argocd_app(cloud_provider)
+        if "monitoring" in missing and getattr(payload, "include_monitoring", False):
+            result["monitoring_configs"] = self._generate_monitoring_configs()
+        if "terraform" in missing:
+            result["terraform_configs"] = self._generate_terraform_configs(
+                cloud_provider, infra_preset
+            )
+        if "readme_md" in missing:
+            result["readme_md"] = self._generate_readme(
+                language=language,
+                framework=framework,
+                cicd_tool=cicd_tool,
+                deploy_target=deploy_target,
+                cloud_provider=cloud_provider,
+                infra_preset=infra_preset,
+                has_dockerfile=bool(result.get("dockerfile")),
+                has_cicd=bool(result.get("cicd_config")),
+                has_k8s=bool(result.get("k8s_manifests")),
+                has_helm=bool(result.get("helm_chart")),
+                has_argocd=bool(result.get("argocd_app")),
+                has_monitoring=bool(result.get("monitoring_configs")),
+                has_terraform=bool(result.get("terraform_configs")),
+            )
+
+    async def _validate_ai_output(self, payload: Any, result: Dict[str, Any]) -> None:
+        """
+        Validates every AI file in parallel. Each invalid file gets one
+        targeted retry (the model fixes the reported errors only); artefacts
+        still invalid after that are regenerated rule-based. The report is
+        stored in result["raw"]["validation"].
+        """
+        report = await validate_bundle(result)
+        report.update({"repaired": [], "replaced": []})
+        if report["invalid"]:
+            contents = dict(iter_bundle_files(result))
+
+            async def retry(path: str) -> Optional[str]:
+                metrics.incr("validation.retries")
+                errors = report["files"][path]["errors"]
+                try:
+                    refined = await refine(
+                        path, None, contents[path], repair_instructions(errors), mode="full"
+                    )
+                except Exception:
+                    logger.exception(f"Validation retry failed for {path}")
+                    return None
+                updated = refined["updated_content"]
+                return None if validate_artifact(path, updated)["errors"] else updated
+
+            fixed = await asyncio.gather(*(retry(path) for path in report["invalid"]))
+
+            still_invalid = []
+            for path, updated in zip(report["invalid"], fixed):
+                if updated is not None and set_bundle_file(result, path, updated):
+                    report["repaired"].append(path)
+                else:
+                    still_invalid.append(path)
+            metrics.incr("validation.repaired", len(report["repaired"]))
+
+            replaced = sorted({
+                key for path in still_invalid
+                for prefix, key in PATH_ARTIFACT_KEYS if path.startswith(prefix)
+            })
+            if replaced:
+                self._fill_missing_artifacts(payload, result, replaced)
+                metrics.incr("validation.replaced", len(replaced))
+                logger.warning(
+                    "AI Thick Mode: invalid artefacts replaced rule-based",
+                    extra={"invalid": still_invalid, "replaced": replaced},
+                )
+            report["replaced"] = replaced
+
+        result.setdefault("raw", {})["validation"] = report
+
     # ==========================================================
     # AI THICK MODE
     # ==========================================================
@@ -125,6 +326,16 @@ class GenerationService:
             ai_output = await self.ai_service.generate_bundle(payload)
 
             if isinstance(ai_output, dict):
+                salvage = ai_output.get("raw", {}).get("salvage")
+                if salvage and salvage["missing"]:
+                    # Malformed AI output: keep what survived, fill only the gaps
+                    self._fill_missing_artifacts(payload, ai_output, salvage["missing"])
+                    logger.info(
+                        "AI Thick Mode: partial AI result completed rule-based",
+                        extra={"missing": salvage["missing"]},
+                    )
+
+                await self._validate_ai_output(payload, ai_output)
                 logger.info("AI Thick Mode: generation successful")
                 return ai_output
 
@@ -230,14 +441,20 @@ class GenerationService:
 
     # ---------------------- Dockerfile ---------------------- #
 
-    def _generate_dockerfile(self, language: str, framework: Optional[str]) -> str:
+    def _generate_dockerfile(
+        self,
+        language: str,
+        framework: Optional[str],
+        app_port: Optional[int] = None,
+        start_command: Optional[str] = None,
+    ) -> str:
         language = (language or "").lower()
         framework = (framework or "").lower()
 
         if language == "python":
-            return self._dockerfile_python(framework)
+            return self._dockerfile_python(framework, app_port, start_command)
         if language in ("node", "nodejs", "javascript", "js"):
-            return self._dockerfile_node(framework)
+            return self._dockerfile_node(framework, app_port, start_command)
 
         # Default fallback
         return (
@@ -249,13 +466,20 @@ class GenerationService:
             "CMD [\"sh\"]\n"
         )
 
-    def _dockerfile_python(self, framework: Optional[str]) -> str:
+    def _dockerfile_python(
+        self,
+        framework: Optional[str],
+        app_port: Optional[int] = None,
+        start_command: Optional[str] = None,
+    ) -> str:
         """ 
         Python Dockerfile with non-root user (K8s-friendly).
         """
         app_cmd = "python app.py"
         if framework in ("fastapi",):
            app_cmd = "uvicorn main:app --host 0.0.0.0 --port 8000"
+        if start_command:
+            app_cmd = start_command
 
         return (
            "# Python Dockerfile generated by InfraScribe\n"
@@ -276,15 +500,28 @@ class GenerationService:
         "# Switch to non-root user\n"
         "USER app\n\n"
         "# Expose application port\n"
-        "EXPOSE 5000\n\n"
+        f"EXPOSE {app_port or 5000}\n\n"
         "# Start the application\n"
-        f'CMD ["bash", "-c", "{app_cmd}"]\n'
+        f"CMD {json.dumps(['bash', '-c', app_cmd])}\n"
     )
 
-    def _dockerfile_node(self, framework: Optional[str]) -> str:
+    def _dockerfile_node(
+        self,
+        framework: Optional[str],
+        app_port: Optional[int] = None,
+        start_command: Optional[str] = None,
+    ) -> str:
         """
         Node.js Dockerfile with separate dependency layer.
         """
+        cmd = '["npm", "start"]'
+        if start_command:
+            # Exec form only for plain argument lists; anything using shell
+            # syntax (&&, quotes, $VARS, redirects, …) must run through sh
+            if SHELL_SYNTAX.search(start_command) or ENV_ASSIGNMENT.match(start_command):
+                cmd = json.dumps(["sh", "-c", start_command])
+            else:
+                cmd = json.dumps(start_command.split())
         return (
             "# Node.js Dockerfile generated by InfraScribe\n"
             "FROM node:20-alpine\n\n"
@@ -293,9 +530,9 @@ class GenerationService:
             "RUN npm install --production\n\n"
             "COPY . .\n\n"
             "# Expose application port\n"
-            "EXPOSE 3000\n\n"
+            f"EXPOSE {app_port or 3000}\n\n"
             "# Start the application\n"
-            'CMD ["npm", "start"]\n'
+            f"CMD {cmd}\n"
         )
 
     # ---------------------- CI/CD ---------------------- #
@@ -427,7 +664,9 @@ class GenerationService:
         self,
         language: str,
         framework: Optional[str],
+        app_port: Optional[int] = None,
     ) -> Dict[str, str]:
+        port = app_port or 5000
         deployment_yaml = (
             "apiVersion: apps/v1\n"
             "kind: Deployment\n"
@@ -449,7 +688,7 @@ class GenerationService:
             "        - name: app\n"
             "          image: your-dockerhub-user/your-image:latest\n"
             "          ports:\n"
-            "            - containerPort: 5000\n"
+            f"            - containerPort: {port}\n"
             "          env:\n"
             "            - name: ENVIRONMENT\n"
             '              value: "production"\n'
@@ -468,7 +707,7 @@ class GenerationService:
             "    app: app\n"
             "  ports:\n"
             "    - port: 80\n"
-            "      targetPort: 5000\n"
+            f"      targetPort: {port}\n"
         )
 
         return {
@@ -482,6 +721,7 @@ class GenerationService:
         self,
         language: str,
         framework: Optional[str],
+        app_port: Optional[int] = None,
     ) -> Dict[str, str]:
         """
         Simple Helm chart with values + deployment + service.
@@ -507,6 +747,8 @@ service:
 
 containerPort: 5000
 """
+        if app_port:
+            values_yaml = values_yaml.replace("containerPort: 5000", f"containerPort: {app_port}")
 
         deployment_tpl = """apiVersion: apps/v1
 kind: Deployment
@@ -0,0 +1,438 @@
+# backend/services/job_queue.py
+
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from utils.logger import get_logger
+from utils.storage import connect_sqlite, data_path
+
+logger = get_logger(__name__)
+
+JOB_WORKERS = int(os.getenv("INFRASCRIBE_JOB_WORKERS", "2"))
+JOB_MAX_PENDING = int(os.getenv("INFRASCRIBE_JOB_MAX_PENDING", "100"))
+JOB_TTL_SECONDS = int(os.getenv("INFRASCRIBE_JOB_TTL_SECONDS", str(24 * 3600)))
+# Each queue refreshes its heartbeat and sweeps for orphaned jobs this often
+JOB_HEARTBEAT_SECONDS = float(os.getenv("INFRASCRIBE_JOB_HEARTBEAT_SECONDS", "10"))
+# A queue whose heartbeat is older than this is dead; its jobs are adopted
+JOB_OWNER_TIMEOUT_SECONDS = float(os.getenv("INFRASCRIBE_JOB_OWNER_TIMEOUT_SECONDS", "30"))
+JOBS_DB = os.getenv("INFRASCRIBE_JOBS_DB") or None
+
+TERMINAL_STATES = ("succeeded", "failed")
+
+ProgressFn = Callable[[str, Optional[Dict[str, Any]]], None]
+JobRunner = Callable[[Dict[str, Any], ProgressFn], Awaitable[Dict[str, Any]]]
+
+
+class QueueFullError(Exception):
+    """
+    Raised when the queue already holds JOB_MAX_PENDING unfinished jobs.
+    """
+
+
+class JobQueue:
+    """
+    Bounded in-process job queue with SQLite persistence.
+
+    - submit() persists the job, then hands it to one of N asyncio workers
+    - every job row names the queue holding it (owner); queues heartbeat,
+      and a periodic sweep adopts queued/running jobs of dead queues, so
+      crashes and restarts never strand a job
+    - get() reads from SQLite, so any uvicorn worker can answer polls
+    - subscribe() streams progress events until the job is finished
+    """
+
+    def __init__(
+        self,
+        runners: Dict[str, JobRunner],
+        db_path: Optional[str] = JOBS_DB,
+        workers: int = JOB_WORKERS,
+        max_pending: int = JOB_MAX_PENDING,
+    ):
+        self.runners = runners
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._maintainer: Optional[asyncio.Task] = None
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._owner = uuid.uuid4().hex
+
+    # ---------------------- Storage ---------------------- #
+
+    def _db(self):
+        if self._conn is None:
+            path = self.db_path or data_path("jobs.sqlite3")
+            self._conn = connect_sqlite(path)
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id          TEXT PRIMARY KEY,
+                    kind        TEXT NOT NULL,
+                    status      TEXT NOT NULL,
+                    payload     TEXT NOT NULL,
+                    result      TEXT,
+                    error       TEXT,
+                    progress    TEXT,
+                    owner       TEXT,
+                    created_at  REAL NOT NULL,
+                    updated_at  REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+                CREATE TABLE IF NOT EXISTS job_owners (
+                    owner         TEXT PRIMARY KEY,
+                    heartbeat_at  REAL NOT NULL
+                );
+                """
+            )
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "dedupe_key" not in columns:
+                # Databases created before job deduplication
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN dedupe_key TEXT")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs(kind, dedupe_key, created_at)"
+            )
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        with self._db_lock:
+            return self._db().execute(sql, params).rowcount
+
+    def _fetchall(self, sql: str, params: tuple = ()) -> List[Any]:
+        with self._db_lock:
+            return self._db().execute(sql, params).fetchall()
+
+    @staticmethod
+    def _row_to_job(row) -> Dict[str, Any]:
+        return {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "progress": json.loads(row["progress"]) if row["progress"] else None,
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    # ---------------------- Lifecycle ---------------------- #
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+
+        self._queue = asyncio.Queue()
+        await self._recover()
+        self._tasks = [
+            asyncio.create_task(self._worker(i)) for i in range(self.workers)
+        ]
+        self._maintainer = asyncio.create_task(self._maintain())
+
+    async def stop(self) -> None:
+        tasks = self._tasks + ([self._maintainer] if self._maintainer else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._maintainer = None
+        await asyncio.to_thread(self._release)
+
+    def _sweep(self, now: float) -> List[str]:
+        """
+        Refreshes this queue's heartbeat and adopts every unfinished job whose
+        owner is missing or no longer heartbeating: running ones (their worker
+        died mid-run) go back to queued. Returns the adopted job ids, oldest first.
+        """
+        with self._db_lock:
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO job_owners (owner, heartbeat_at) VALUES (?, ?) "
+                    "ON CONFLICT(owner) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+                    (self._owner, now),
+                )
+                rows = conn.execute(
+                    "UPDATE jobs SET status = 'queued', owner = ?, updated_at = ? "
+                    "WHERE status IN ('queued', 'running') AND (owner IS NULL OR owner NOT IN "
+                    "(SELECT owner FROM job_owners WHERE heartbeat_at >= ?)) "
+                    "RETURNING id, created_at",
+                    (self._owner, now, now - JOB_OWNER_TIMEOUT_SECONDS),
+                ).fetchall()
+                conn.execute(
+                    "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?",
+                    (now - JOB_TTL_SECONDS,),
+                )
+                conn.execute(
+                    "DELETE FROM job_owners WHERE heartbeat_at < ?", (now - JOB_TTL_SECONDS,)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return [row["id"] for row in sorted(rows, key=lambda row: row["created_at"])]
+
+    def _release(self) -> None:
+        """
+        Clean shutdown: this queue's unfinished jobs become adoptable right away.
+        """
+        with self._db_lock:
+            conn = self._db()
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL "
+                "WHERE status IN ('queued', 'running') AND owner = ?",
+                (self._owner,),
+            )
+            conn.execute("DELETE FROM job_owners WHERE owner = ?", (self._owner,))
+
+    async def _recover(self) -> None:
+        job_ids = await asyncio.to_thread(self._sweep, time.time())
+        for job_id in job_ids:
+            self._queue.put_nowait(job_id)
+        if job_ids:
+            logger.info("Adopted orphaned jobs", extra={"jobs": len(job_ids)})
+
+    async def _maintain(self) -> None:
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                await self._recover()
+            except Exception:
+                logger.exception("Job queue sweep failed")
+
+    def _find_or_insert(
+        self,
+        kind: str,
+        payload: str,
+        dedupe_key: Optional[str],
+        reuse_seconds: float,
+        allow_insert: bool,
+    ) -> Optional[Dict[str, Any]]:
+        # Lookup and insert under one lock so concurrent submits share a job
+        with self._db_lock:
+            now = time.time()
+            if dedupe_key is not None:
+                row = self._db().execute(
+                    "SELECT id, status, created_at FROM jobs "
+                    "WHERE kind = ? AND dedupe_key = ? AND ("
+                    "  status IN ('queued', 'running')"
+                    "  OR (status = 'succeeded' AND updated_at >= ?)"
+                    ") ORDER BY created_at DESC LIMIT 1",
+                    (kind, dedupe_key, now - reuse_seconds),
+                ).fetchone()
+                if row is not None:
+                    return {
+                        "job_id": row["id"],
+                        "kind": kind,
+                        "status": row["status"],
+                        "created_at": row["created_at"],
+                        "deduplicated": True,
+                    }
+
+            if not allow_insert:
+                return None
+            job_id = uuid.uuid4().hex
+            self._db().execute(
+                "INSERT INTO jobs (id, kind, status, payload, dedupe_key, owner, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, kind, payload, dedupe_key, self._owner, now, now),
+            )
+            return {
+                "job_id": job_id,
+                "kind": kind,
+                "status": "queued",
+                "created_at": now,
+                "deduplicated": False,
+            }
+
+    # ---------------------- Public API ---------------------- #
+
+    async def submit(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        dedupe_key: Optional[str] = None,
+        reuse_seconds: float = 0,
+    ) -> Dict[str, Any]:
+        """
+        Queues a job. With a dedupe_key, an unfinished job with the same key
+        (or one that succeeded within reuse_seconds) is returned instead of
+        starting another run; "deduplicated" tells which happened.
+        """
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self._queue is None:
+            await self.start()
+
+        # A full queue still hands out existing jobs for a known key
+        job = await asyncio.to_thread(
+            self._find_or_insert,
+            kind,
+            json.dumps(payload, default=str),
+            dedupe_key,
+            reuse_seconds,
+            self._queue.qsize() < self.max_pending,
+        )
+        if job is None:
+            raise QueueFullError(f"Job queue is full ({self.max_pending} pending)")
+
+        if not job["deduplicated"]:
+            self._queue.put_nowait(job["job_id"])
+        return job
+
+    async def get(self, job_id: str, subject: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        The job, or None. With `subject`, only a job whose payload names that
+        caller (payload["subject"]) is returned.
+        """
+        if subject is None:
+            sql, params = "SELECT * FROM jobs WHERE id = ?", (job_id,)
+        else:
+            sql = "SELECT * FROM jobs WHERE id = ? AND json_extract(payload, '$.subject') = ?"
+            params = (job_id, subject)
+        rows = await asyncio.to_thread(self._fetchall, sql, params)
+        return self._row_to_job(rows[0]) if rows else None
+
+    async def subscribe(
+        self, job_id: str, poll_seconds: float = 1.0
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yields {"event", "data"} dicts: the current state first, then progress
+        events, ending with "completed" or "failed". Falls back to polling
+        SQLite when the job runs in another worker process.
+        """
+        job = await self.get(job_id)
+        if job is None:
+            return
+
+        local: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(local)
+        try:
+            yield {"event": "status", "data": _public_state(job)}
+            last_update = job["updated_at"]
+
+            while job["status"] not in TERMINAL_STATES:
+                try:
+                    event = await asyncio.wait_for(local.get(), timeout=poll_seconds)
+                    yield event
+                    if event["event"] in ("completed", "failed"):
+                        return
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+
+                job = await self.get(job_id)
+                if job is None:
+                    return
+                if job["updated_at"] != last_update and job["status"] not in TERMINAL_STATES:
+                    last_update = job["updated_at"]
+                    yield {"event": "progress", "data": _public_state(job)}
+
+            yield _terminal_event(job)
+        finally:
+            subscribers = self._subscribers.get(job_id, [])
+            if local in subscribers:
+                subscribers.remove(local)
+            if not subscribers:
+                self._subscribers.pop(job_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": len(self._tasks),
+            "pending": self._queue.qsize() if self._queue else 0,
+            "max_pending": self.max_pending,
+        }
+
+    # ---------------------- Worker ---------------------- #
+
+    def _publish(self, job_id: str, event: Dict[str, Any]) -> None:
+        for subscriber in self._subscribers.get(job_id, []):
+            subscriber.put_nowait(event)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job worker crashed", extra={"job_id": job_id})
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str) -> None:
+        claimed = await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = 'running', updated_at = ? "
+            "WHERE id = ? AND status = 'queued' AND owner = ?",
+            (time.time(), job_id, self._owner),
+        )
+        if not claimed:
+            return  # finished, or adopted by another queue
+
+        rows = await asyncio.to_thread(
+            self._fetchall, "SELECT kind, payload FROM jobs WHERE id = ?", (job_id,)
+        )
+        kind, payload = rows[0]["kind"], json.loads(rows[0]["payload"])
+        self._publish(job_id, {"event": "status", "data": {"job_id": job_id, "status": "running"}})
+
+        loop = asyncio.get_running_loop()
+
+        def progress(stage: str, detail: Optional[Dict[str, Any]] = None) -> None:
+            state = {"stage": stage, **(detail or {})}
+            # Fire-and-forget: progress must never stall the job itself
+            loop.run_in_executor(
+                None,
+                self._execute,
+                "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(state, default=str), time.time(), job_id),
+            )
+            self._publish(
+                job_id,
+                {"event": "progress", "data": {"job_id": job_id, "status": "running", "progress": state}},
+            )
+
+        try:
+            result = await self.runners[kind](payload, progress)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Job failed", extra={"job_id": job_id, "kind": kind})
+            await asyncio.to_thread(
+                self._execute,
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                (f"{type(e).__name__}: {e}", time.time(), job_id),
+            )
+        else:
+            await asyncio.to_thread(
+                self._execute,
+                "UPDATE jobs SET status = 'succeeded', result = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(result, default=str), time.time(), job_id),
+            )
+
+        job = await self.get(job_id)
+        if job:
+            self._publish(job_id, _terminal_event(job))
+
+
+def _public_state(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "progress": job["progress"],
+    }
+
+
+def _terminal_event(job: Dict[str, Any]) -> Dict[str, Any]:
+    if job["status"] == "succeeded":
+        return {"event": "completed", "data": {**_public_state(job), "result": job["result"]}}
+    return {"event": "failed", "data": {**_public_state(job), "error": job["error"]}}
@@ -0,0 +1,247 @@
+# backend/services/model_router.py
+
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import (
+    Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple,
+)
+
+from utils.logger import get_logger
+from utils.metrics import metrics
+
+logger = get_logger(__name__)
+
+# Prices in USD per 1M tokens; context in tokens. Override with
+# INFRASCRIBE_MODEL_CATALOG='{"model": {"input_cost": .., "output_cost": .., "context": ..}}'
+DEFAULT_CATALOG: Dict[str, Dict[str, float]] = {
+    "gpt-4o-mini": {"input_cost": 0.15, "output_cost": 0.60, "context": 128_000},
+    "gpt-4.1-mini": {"input_cost": 0.40, "output_cost": 1.60, "context": 1_000_000},
+    "gpt-4.1": {"input_cost": 2.00, "output_cost": 8.00, "context": 1_000_000},
+}
+
+# Candidates per operation, cheapest first; escalation walks down the list.
+# Override with INFRASCRIBE_MODEL_ROUTES='{"explain": ["model", ...]}'
+DEFAULT_ROUTES: Dict[str, List[str]] = {
+    "explain": ["gpt-4o-mini", "gpt-4.1-mini", "gpt-4.1"],
+    "refine": ["gpt-4o-mini", "gpt-4.1-mini", "gpt-4.1"],
+    "generate": ["gpt-4.1-mini", "gpt-4.1"],
+}
+
+# Typical completion size per operation, for cost estimates
+EXPECTED_OUTPUT_TOKENS = {"explain": 700, "refine": 1_500, "generate": 4_000}
+
+# Artefacts that are easy to get subtly wrong start one tier higher
+# (matched against the artefact name / file path)
+COMPLEX_ARTIFACTS = ("terraform", ".tf", ".tfvars", "helm", "chart.yaml", "templates/")
+
+MODEL_BUDGET_USD = float(os.getenv("INFRASCRIBE_MODEL_BUDGET_USD", "0.10"))
+LARGE_INPUT_TOKENS = int(os.getenv("INFRASCRIBE_MODEL_LARGE_INPUT_TOKENS", "8000"))
+LATENCY_SLO_SECONDS = float(os.getenv("INFRASCRIBE_MODEL_LATENCY_SLO_SECONDS", "20"))
+MAX_ERROR_RATE = float(os.getenv("INFRASCRIBE_MODEL_MAX_ERROR_RATE", "0.5"))
+HEALTH_WINDOW = 50
+MIN_HEALTH_SAMPLES = 5
+
+
+def _load_json_env(name: str, default: Dict[str, Any]) -> Dict[str, Any]:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        return {**default, **json.loads(raw)}
+    except (ValueError, TypeError):
+        logger.warning(f"Ignoring invalid {name}")
+        return default
+
+
+class ModelRouter:
+    """
+    Picks a model per call from input size, artefact type, recent latency and
+    error rate, and the per-call cost budget. The cheapest acceptable model
+    goes first; run() escalates to a stronger one only when the caller's
+    validation of the output fails (or the call errors).
+    """
+
+    def __init__(
+        self,
+        catalog: Optional[Dict[str, Dict[str, float]]] = None,
+        routes: Optional[Dict[str, List[str]]] = None,
+        budget_usd: float = MODEL_BUDGET_USD,
+    ):
+        self.catalog = catalog or _load_json_env("INFRASCRIBE_MODEL_CATALOG", DEFAULT_CATALOG)
+        self.routes = routes or _load_json_env("INFRASCRIBE_MODEL_ROUTES", DEFAULT_ROUTES)
+        self.budget_usd = budget_usd
+        self._lock = threading.Lock()
+        self._health: Dict[str, Deque[Tuple[bool, float]]] = {}
+
+    # ---------------------- Health ---------------------- #
+
+    def record(self, model: str, latency: float, ok: bool) -> None:
+        with self._lock:
+            window = self._health.setdefault(model, deque(maxlen=HEALTH_WINDOW))
+            window.append((ok, latency))
+        metrics.observe(f"router.latency.{model}", latency)
+        if not ok:
+            metrics.incr(f"router.errors.{model}")
+
+    def health(self, model: str) -> Dict[str, Any]:
+        with self._lock:
+            window = list(self._health.get(model, ()))
+        if not window:
+            return {"samples": 0, "error_rate": 0.0, "avg_latency": None}
+        latencies = [latency for ok, latency in window if ok]
+        return {
+            "samples": len(window),
+            "error_rate": sum(1 for ok, _ in window if not ok) / len(window),
+            "avg_latency": sum(latencies) / len(latencies) if latencies else None,
+        }
+
+    def _healthy(self, model: str) -> bool:
+        stats = self.health(model)
+        if stats["samples"] < MIN_HEALTH_SAMPLES:
+            return True
+        if stats["error_rate"] > MAX_ERROR_RATE:
+            return False
+        return stats["avg_latency"] is None or stats["avg_latency"] <= LATENCY_SLO_SECONDS
+
+    # ---------------------- Selection ---------------------- #
+
+    def estimate_cost(self, model: str, input_tokens: int, output_tokens: int) -> float:
+        spec = self.catalog.get(model, {})
+        return (
+            input_tokens * spec.get("input_cost", 0.0)
+            + output_tokens * spec.get("output_cost", 0.0)
+        ) / 1_000_000
+
+    def _route(self, operation: str) -> List[str]:
+        return self.routes.get(operation) or DEFAULT_ROUTES["explain"]
+
+    def candidates(
+        self,
+        operation: str,
+        input_tokens: int,
+        artifact: Optional[str] = None,
+        output_tokens: Optional[int] = None,
+    ) -> List[str]:
+        """
+        Ordered models to try for this call. Models whose context is too
+        small are dropped; over-budget or unhealthy ones move to the back
+        so there is always something to call.
+        """
+        route = self._route(operation)
+        output_tokens = output_tokens or EXPECTED_OUTPUT_TOKENS.get(operation, 1_000)
+
+        start = 0
+        if input_tokens >= LARGE_INPUT_TOKENS:
+            start += 1
+        if artifact and any(pattern in artifact.lower() for pattern in COMPLEX_ARTIFACTS):
+            start += 1
+        start = min(start, len(route) - 1)
+
+        fitting = [
+            model for model in route
+            if self.catalog.get(model, {}).get("context", float("inf"))
+            >= input_tokens + output_tokens
+        ] or route[-1:]
+        ordered = [m for m in fitting if route.index(m) >= start] or fitting[-1:]
+
+        preferred, deferred = [], []
+        for model in ordered:
+            cost = self.estimate_cost(model, input_tokens, output_tokens)
+            within_budget = cost <= self.budget_usd
+            (preferred if within_budget and self._healthy(model) else deferred).append(model)
+        return preferred + deferred
+
+    def choose(
+        self,
+        operation: str,
+        input_tokens: int,
+        artifact: Optional[str] = None,
+        output_tokens: Optional[int] = None,
+    ) -> str:
+        model = self.candidates(operation, input_tokens, artifact, output_tokens)[0]
+        metrics.incr(f"router.{operation}.{model}")
+        return model
+
+    # ---------------------- Execution ---------------------- #
+
+    async def run(
+        self,
+        operation: str,
+        call: Callable[[str], Awaitable[Any]],
+        input_tokens: int,
+        validate: Optional[Callable[[Any], bool]] = None,
+        artifact: Optional[str] = None,
+        output_tokens: Optional[int] = None,
+    ) -> Tuple[Any, str, int]:
+        """
+        Calls `call(model)` with the cheapest acceptable model. If the call
+        raises or `validate(result)` is false, escalates to the next stronger
+        candidate. Returns (result, model, escalations); after the last
+        candidate the final result is returned even if it failed validation,
+        and the final exception is re-raised.
+        """
+        output_tokens = output_tokens or EXPECTED_OUTPUT_TOKENS.get(operation, 1_000)
+        candidates = self.candidates(operation, input_tokens, artifact, output_tokens)
+        route = self._route(operation)
+        first = candidates[0]
+        # Escalation only ever goes to stronger (later) models within budget
+        models = [first] + [
+            model for model in candidates[1:]
+            if route.index(model) > route.index(first)
+            and self.estimate_cost(model, input_tokens, output_tokens) <= self.budget_usd
+        ]
+
+        for index, model in enumerate(models):
+            metrics.incr(f"router.{operation}.{model}")
+            started = time.perf_counter()
+            last = index == len(models) - 1
+            try:
+                result = await call(model)
+            except Exception:
+                self.record(model, time.perf_counter() - started, ok=False)
+                if last:
+                    raise
+                logger.warning(f"{operation} call failed on {model}, escalating")
+                metrics.incr(f"router.{operation}.escalations")
+                continue
+
+            self.record(model, time.perf_counter() - started, ok=True)
+            if validate is None or validate(result) or last:
+                return result, model, index
+
+            logger.info(f"{operation} output from {model} failed validation, escalating")
+            metrics.incr(f"router.{operation}.escalations")
+            metrics.incr(f"router.validation_failures.{model}")
+
+        raise RuntimeError(f"No model available for {operation}")  # unreachable
+
+    @contextlib.asynccontextmanager
+    async def track(self, model: str) -> AsyncIterator[None]:
+        """
+        Records latency/outcome of a call made outside run() (e.g. a stream).
+        Cancellation (client left) is not counted against the model.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except (asyncio.CancelledError, GeneratorExit):
+            raise
+        except Exception:
+            self.record(model, time.perf_counter() - started, ok=False)
+            raise
+        self.record(model, time.perf_counter() - started, ok=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "budget_usd": self.budget_usd,
+            "routes": self.routes,
+            "health": {model: self.health(model) for model in self.catalog},
+        }
+
+
+model_router = ModelRouter()
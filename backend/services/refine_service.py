@@ -0,0 +1,403 @@
+# backend/services/refine_service.py
+
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from services.artifact_validator import repair_instructions, validate_artifact
+from services.model_router import model_router
+from services.usage_ledger import usage_ledger
+from utils.llm import get_async_client, stream_chat_completion
+from utils.logger import get_logger
+from utils.metrics import metrics
+from utils.patching import PatchError, apply_unified_diff
+from utils.prompt_cache import record_prompt_cache
+from utils.token_budget import (
+    REFINE_MAX_INPUT_TOKENS,
+    TokenBudgetExceeded,
+    count_tokens,
+    usage_from_completion,
+)
+
+logger = get_logger(__name__)
+
+# Default/cheapest refine model; the router picks per call (services/model_router.py)
+REFINE_MODEL = "gpt-4o-mini"
+REFINE_MODES = ("full", "diff", "auto")
+# In "auto" mode, files at least this long are refined via a diff
+AUTO_DIFF_MIN_LINES = 40
+
+REFINE_SYSTEM_PROMPT = (
+    "You are a precise DevOps assistant. "
+    "You ONLY output valid config files, no explanations."
+)
+DIFF_SYSTEM_PROMPT = (
+    "You are a precise DevOps assistant. "
+    "You ONLY output unified diffs, no explanations."
+)
+
+
+# Static prefix first, request-specific suffix last: the prefix stays
+# byte-identical across requests so provider-side prompt caching applies.
+
+REFINE_PROMPT_PREFIX = """
+You are InfraScribe, a DevOps assistant.
+
+At the end of this message the user gives you:
+- An existing configuration file (Dockerfile, YAML, Terraform, CI pipeline, etc.)
+- Some instructions on how they want it changed.
+
+You MUST:
+- Return ONLY the updated file content.
+- Preserve the original format and structure (same language, same file type).
+- Do NOT add explanations, comments about what you changed, or markdown fences.
+- If something is unclear, make a safe reasonable assumption.
+"""
+
+DIFF_PROMPT_PREFIX = """
+You are InfraScribe, a DevOps assistant.
+
+At the end of this message the user gives you:
+- An existing configuration file (Dockerfile, YAML, Terraform, CI pipeline, etc.)
+- Some instructions on how they want it changed.
+
+You MUST:
+- Return ONLY a unified diff against the current file content.
+- Use hunks of the form "@@ -old_start,old_len +new_start,new_len @@".
+- Include 2 unchanged context lines around every change, copied exactly.
+- Prefix unchanged lines with a space, removed lines with "-", added lines with "+".
+- Do NOT repeat unchanged parts of the file outside the hunks.
+- Do NOT add explanations or markdown fences.
+- If something is unclear, make a safe reasonable assumption.
+"""
+
+# operation -> (system prompt, static user-prompt prefix)
+PROMPTS = {
+    "refine": (REFINE_SYSTEM_PROMPT, REFINE_PROMPT_PREFIX),
+    "refine_diff": (DIFF_SYSTEM_PROMPT, DIFF_PROMPT_PREFIX),
+}
+
+
+def _request_section(
+    filename: str, label: Optional[str], content: str, instructions: str
+) -> str:
+    return f"""
+File name: {filename}
+Label: {label or ""}
+
+Current file content:
+----------------
+{content}
+----------------
+
+User instructions:
+----------------
+{instructions}
+----------------
+"""
+
+
+def build_refine_prompt(
+    filename: str, label: Optional[str], content: str, instructions: str
+) -> str:
+    return REFINE_PROMPT_PREFIX + _request_section(filename, label, content, instructions)
+
+
+def build_diff_prompt(
+    filename: str, label: Optional[str], content: str, instructions: str
+) -> str:
+    return DIFF_PROMPT_PREFIX + _request_section(filename, label, content, instructions)
+
+
+def _messages(
+    operation: str, user_prompt: str, usage: Dict[str, Any]
+) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Returns (messages, estimated prompt tokens) and adds the estimate to usage.
+    """
+    system_prompt = PROMPTS[operation][0]
+    prompt_tokens = count_tokens(system_prompt + user_prompt, REFINE_MODEL)
+    usage["estimated_prompt_tokens"] = usage.get("estimated_prompt_tokens", 0) + prompt_tokens
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+    return messages, prompt_tokens
+
+
+def _static_prefix(operation: str) -> str:
+    system_prompt, prefix = PROMPTS[operation]
+    return system_prompt + prefix
+
+
+def _note_model(usage: Dict[str, Any], model: str, escalations: int = 0) -> None:
+    usage["model"] = model
+    usage["escalations"] = usage.get("escalations", 0) + escalations
+
+
+def _looks_like_file(text: str) -> bool:
+    # Empty output or a fenced/chatty answer means the model ignored the contract
+    return bool(text) and not text.lstrip().startswith("```")
+
+
+async def _complete(
+    operation: str,
+    user_prompt: str,
+    usage: Dict[str, Any],
+    validate: Callable[[str], bool] = _looks_like_file,
+    artifact: Optional[str] = None,
+) -> str:
+    messages, prompt_tokens = _messages(operation, user_prompt, usage)
+
+    async def call(model: str) -> str:
+        usage["calls"] = usage.get("calls", 0) + 1
+        started = time.perf_counter()
+        completion = await get_async_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.2,
+        )
+        usage_ledger.record(
+            operation, model, getattr(completion, "usage", None), time.perf_counter() - started
+        )
+        usage_from_completion(completion, usage)
+        record_prompt_cache(
+            operation, getattr(completion, "usage", None), _static_prefix(operation)
+        )
+        return (completion.choices[0].message.content or "").strip()
+
+    text, model, escalations = await model_router.run(
+        "refine", call, prompt_tokens, validate=validate, artifact=artifact
+    )
+    _note_model(usage, model, escalations)
+    return text
+
+
+def _use_diff(mode: str, content: str) -> bool:
+    if mode == "diff":
+        return True
+    if mode == "auto":
+        return content.count("\n") + 1 >= AUTO_DIFF_MIN_LINES
+    return False
+
+
+def check_refine_request(mode: str, content: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Validates mode and size up front; returns (normalised mode, initial usage).
+    """
+    mode = (mode or "full").lower()
+    if mode not in REFINE_MODES:
+        raise ValueError(f"Unknown refine mode: {mode}. Use one of {', '.join(REFINE_MODES)}")
+
+    content_tokens = count_tokens(content, REFINE_MODEL)
+    if content_tokens > REFINE_MAX_INPUT_TOKENS:
+        raise TokenBudgetExceeded(
+            f"File is ~{content_tokens} tokens; refine accepts up to {REFINE_MAX_INPUT_TOKENS}"
+        )
+    return mode, {"content_tokens": content_tokens}
+
+
+def _result(
+    updated: str,
+    patch: Optional[str],
+    applied_mode: str,
+    usage: Dict[str, Any],
+    validation: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    metrics.observe(
+        "refine.prompt_tokens", usage.get("prompt_tokens", usage["estimated_prompt_tokens"])
+    )
+    return {
+        "updated_content": updated,
+        "patch": patch,
+        "applied_mode": applied_mode,
+        "usage": usage,
+        "validation": validation,
+    }
+
+
+def _validate(filename: str, content: str, updated: str) -> Dict[str, Any]:
+    """
+    Validation report for the refined file. A file that was already invalid
+    before refining is not held against the model ("baseline_invalid").
+    """
+    report = validate_artifact(filename, updated)
+    report["baseline_invalid"] = bool(
+        report["errors"] and validate_artifact(filename, content)["errors"]
+    )
+    report["retried"] = False
+    return report
+
+
+async def _validated(
+    filename: str,
+    label: Optional[str],
+    content: str,
+    updated: str,
+    patch: Optional[str],
+    applied_mode: str,
+    usage: Dict[str, Any],
+) -> Dict[str, Any]:
+    # One targeted retry: the model fixes the reported errors in its own output
+    report = _validate(filename, content, updated)
+    if not updated or not report["errors"] or report["baseline_invalid"]:
+        return _result(updated, patch, applied_mode, usage, report)
+
+    metrics.incr("refine.validation_retries")
+    retried = await _complete(
+        "refine",
+        build_refine_prompt(filename, label, updated, repair_instructions(report["errors"])),
+        usage,
+        artifact=filename,
+    )
+    retry_report = _validate(filename, content, retried)
+    retry_report["retried"] = True
+    if retry_report["errors"]:
+        metrics.incr("refine.validation_failed")
+        logger.warning(f"Refined {filename} still invalid after retry")
+        return _result(updated, patch, applied_mode, usage, {**report, "retried": True})
+
+    metrics.incr("refine.validation_fixed")
+    fixed_mode = "full" if applied_mode == "full" else "full_fallback"
+    return _result(retried, None, fixed_mode, usage, retry_report)
+
+
+def _patch_applies(content: str, patch: str) -> bool:
+    try:
+        apply_unified_diff(content, patch)
+    except PatchError:
+        return False
+    return True
+
+
+def _try_patch(content: str, patch: str) -> Optional[str]:
+    try:
+        updated = apply_unified_diff(content, patch)
+    except PatchError as e:
+        metrics.incr("refine.patch_failed")
+        logger.warning(f"Refine patch did not apply, falling back to full rewrite: {e}")
+        return None
+    metrics.incr("refine.patch_applied")
+    return updated
+
+
+async def refine(
+    filename: str,
+    label: Optional[str],
+    content: str,
+    instructions: str,
+    mode: str = "full",
+) -> Dict[str, Any]:
+    """
+    Refines one file. In diff mode the model only emits the changed hunks,
+    which are applied to `content` locally; if the patch does not apply,
+    the file is rewritten in full instead.
+
+    Returns {"updated_content", "patch", "applied_mode", "usage", "validation"}
+    where applied_mode is "full", "diff" or "full_fallback". The result is
+    syntax-checked; if it is invalid (and the input was not), the model gets
+    one retry to fix the reported errors. The file is sent
+    verbatim (the user gets it back), so it is measured but never compacted;
+    files over REFINE_MAX_INPUT_TOKENS raise TokenBudgetExceeded.
+    """
+    mode, usage = check_refine_request(mode, content)
+
+    if _use_diff(mode, content):
+        # A patch that does not apply escalates to a stronger model first,
+        # and only then falls back to a full rewrite
+        patch = await _complete(
+            "refine_diff",
+            build_diff_prompt(filename, label, content, instructions),
+            usage,
+            validate=lambda candidate: _patch_applies(content, candidate),
+            artifact=filename,
+        )
+        updated = _try_patch(content, patch)
+        if updated is not None:
+            return await _validated(filename, label, content, updated, patch, "diff", usage)
+
+        updated = await _complete(
+            "refine",
+            build_refine_prompt(filename, label, content, instructions),
+            usage,
+            artifact=filename,
+        )
+        return await _validated(filename, label, content, updated, None, "full_fallback", usage)
+
+    updated = await _complete(
+        "refine",
+        build_refine_prompt(filename, label, content, instructions),
+        usage,
+        artifact=filename,
+    )
+    return await _validated(filename, label, content, updated, None, "full", usage)
+
+
+async def stream_refine(
+    filename: str,
+    label: Optional[str],
+    content: str,
+    instructions: str,
+    mode: str = "full",
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming variant of refine(). Yields {"event", "data"} dicts:
+      - "delta": {"text", "kind"}; kind is "content", or "patch" in diff mode
+      - "reset": the streamed patch did not apply, a full rewrite follows
+      - "done": the same fields as refine() plus "cached": False; the
+        validation report is included but there is no retry (already streamed)
+    Raises ValueError/TokenBudgetExceeded before the first event.
+    """
+    mode, usage = check_refine_request(mode, content)
+
+    async def stream(
+        operation: str, user_prompt: str, kind: str, parts: List[str]
+    ) -> AsyncIterator[Dict]:
+        # Tokens are forwarded as they arrive, so there is no escalation here
+        messages, prompt_tokens = _messages(operation, user_prompt, usage)
+        model = model_router.choose("refine", prompt_tokens, artifact=filename)
+        _note_model(usage, model)
+        usage["calls"] = usage.get("calls", 0) + 1
+
+        started = time.perf_counter()
+        async with model_router.track(model):
+            async for delta in stream_chat_completion(
+                model,
+                messages,
+                0.2,
+                usage,
+                operation=operation,
+                prefix=_static_prefix(operation),
+                on_usage=lambda u: usage_ledger.record(
+                    operation, model, u, time.perf_counter() - started
+                ),
+            ):
+                parts.append(delta)
+                yield {"event": "delta", "data": {"text": delta, "kind": kind}}
+
+    applied_mode = "full"
+    if _use_diff(mode, content):
+        patch_parts: List[str] = []
+        diff_prompt = build_diff_prompt(filename, label, content, instructions)
+        async for event in stream("refine_diff", diff_prompt, "patch", patch_parts):
+            yield event
+
+        patch = "".join(patch_parts).strip()
+        updated = _try_patch(content, patch)
+        if updated is not None:
+            report = _validate(filename, content, updated)
+            result = _result(updated, patch, "diff", usage, report)
+            yield {"event": "done", "data": {**result, "cached": False}}
+            return
+
+        applied_mode = "full_fallback"
+        yield {"event": "reset", "data": {"reason": "patch did not apply"}}
+
+    parts: List[str] = []
+    refine_prompt = build_refine_prompt(filename, label, content, instructions)
+    async for event in stream("refine", refine_prompt, "content", parts):
+        yield event
+
+    updated = "".join(parts).strip()
+    report = _validate(filename, content, updated)
+    result = _result(updated, None, applied_mode, usage, report)
+    yield {"event": "done", "data": {**result, "cached": False}}
@@ -0,0 +1,451 @@
+# backend/services/repo_analyzer.py
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import shlex
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Roots that repo_url may point into (os.pathsep-separated). Unset means
+# local analysis is disabled: API callers must never be able to have the
+# server's own tree, or anything else on the host, read into a bundle.
+REPO_ROOTS = [
+    Path(p).resolve()
+    for p in os.getenv("INFRASCRIBE_REPO_ROOTS", "").split(os.pathsep)
+    if p
+]
+MAX_SCAN_BYTES = int(os.getenv("INFRASCRIBE_REPO_MAX_SCAN_BYTES", str(4 * 1024 * 1024)))
+MAX_MANIFEST_BYTES = 256 * 1024
+MAX_DEPTH = 6
+MAX_ENTRIES = 50_000
+SCAN_THREADS = 8
+CACHE_SIZE = 128
+
+# Files above this size are mapped instead of read into a fresh buffer
+MMAP_THRESHOLD = 64 * 1024
+
+SKIP_DIRS = {
+    ".git", ".hg", ".svn", "node_modules", "vendor", "third_party",
+    "venv", ".venv", "env", "__pycache__", ".tox", ".nox", ".mypy_cache",
+    ".pytest_cache", "dist", "build", "target", ".gradle", ".idea",
+    ".next", "coverage", "site-packages", "bower_components",
+}
+
+MANIFESTS = {
+    "requirements.txt", "pyproject.toml", "Pipfile", "setup.py",
+    "package.json", "pom.xml", "build.gradle", "build.gradle.kts",
+    "go.mod", "Dockerfile", "Procfile",
+}
+
+
+# ---------------------- Path resolution ---------------------- #
+
+def resolve_local_repo(repo_url: Optional[str]) -> Optional[Path]:
+    """
+    Returns the local directory for a repo_url, or None if it is remote,
+    missing, or outside REPO_ROOTS (always None while REPO_ROOTS is empty).
+    """
+    if not repo_url:
+        return None
+    if not REPO_ROOTS:
+        logger.info("Local repo analysis disabled (INFRASCRIBE_REPO_ROOTS unset), ignoring repo_url")
+        return None
+
+    parsed = urlparse(repo_url)
+    if parsed.scheme == "file":
+        candidate = parsed.path
+    elif parsed.scheme in ("", ) or re.match(r"^[A-Za-z]:[\\/]", repo_url):
+        candidate = repo_url
+    else:
+        return None  # http(s), ssh, git@ … – remote repos are not fetched
+
+    path = Path(candidate).expanduser().resolve()
+    if not path.is_dir():
+        return None
+
+    if not any(path == root or root in path.parents for root in REPO_ROOTS):
+        logger.warning("repo_url outside allowed roots, ignoring", extra={"path": str(path)})
+        return None
+
+    return path
+
+
+# ---------------------- Cache keys ---------------------- #
+
+def _git_head_sha(root: Path) -> Optional[str]:
+    """
+    Reads HEAD without spawning git. Handles worktrees (.git file) and packed refs.
+    """
+    git_dir = root / ".git"
+    try:
+        if git_dir.is_file():
+            pointer = git_dir.read_text(encoding="utf-8").strip()
+            if not pointer.startswith("gitdir:"):
+                return None
+            git_dir = (root / pointer.split(":", 1)[1].strip()).resolve()
+        if not git_dir.is_dir():
+            return None
+
+        head = (git_dir / "HEAD").read_text(encoding="utf-8").strip()
+        if not head.startswith("ref:"):
+            return head  # detached HEAD
+
+        ref = head.split(":", 1)[1].strip()
+        bases = [git_dir]
+        commondir = git_dir / "commondir"
+        if commondir.is_file():
+            bases.append((git_dir / commondir.read_text(encoding="utf-8").strip()).resolve())
+
+        for base in bases:
+            ref_file = base / ref
+            if ref_file.is_file():
+                return ref_file.read_text(encoding="utf-8").strip()
+
+        for base in bases:
+            packed = base / "packed-refs"
+            if not packed.is_file():
+                continue
+            for line in packed.read_text(encoding="utf-8").splitlines():
+                if line.endswith(" " + ref):
+                    return line.split(" ", 1)[0]
+    except OSError:
+        return None
+    return None
+
+
+def _stat_signature(root: Path, rel_paths: List[str]) -> Dict[str, Tuple[int, int]]:
+    signature = {}
+    for rel in rel_paths:
+        try:
+            st = (root / rel).stat()
+            signature[rel] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            signature[rel] = (-1, -1)
+    return signature
+
+
+def _root_signature(root: Path) -> Tuple[int, ...]:
+    """
+    Cheap fingerprint of the top level, so new manifests in the root
+    invalidate non-git cache entries.
+    """
+    try:
+        st = root.stat()
+        return (st.st_mtime_ns, st.st_ino)
+    except OSError:
+        return ()
+
+
+# ---------------------- Scanning ---------------------- #
+
+class _ScanBudget:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.entries = 0
+        self.truncated = False
+        self._lock = threading.Lock()
+
+    def take_bytes(self, wanted: int) -> int:
+        with self._lock:
+            granted = max(0, min(wanted, self.limit - self.used))
+            self.used += granted
+            if granted < wanted:
+                self.truncated = True
+            return granted
+
+    def take_entry(self) -> bool:
+        with self._lock:
+            self.entries += 1
+            if self.entries > MAX_ENTRIES:
+                self.truncated = True
+                return False
+            return True
+
+
+def _read_capped(path: Path, budget: _ScanBudget) -> str:
+    try:
+        size = path.stat().st_size
+    except OSError:
+        return ""
+
+    allowed = budget.take_bytes(min(size, MAX_MANIFEST_BYTES))
+    if allowed <= 0:
+        return ""
+
+    try:
+        with open(path, "rb") as fh:
+            if size >= MMAP_THRESHOLD:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    data = mm[:allowed]
+            else:
+                data = fh.read(allowed)
+    except (OSError, ValueError):
+        return ""
+
+    return data.decode("utf-8", errors="ignore")
+
+
+def _walk(start: Path, root: Path, depth: int, budget: _ScanBudget) -> List[Tuple[int, str]]:
+    """
+    Iterative scandir walk that prunes vendored dirs before descending.
+    Returns [(depth, relative manifest path), ...].
+    """
+    found: List[Tuple[int, str]] = []
+    stack = [(start, depth)]
+
+    while stack:
+        current, level = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if not budget.take_entry():
+                        return found
+                    name = entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if name in SKIP_DIRS or name.startswith(".") or level >= MAX_DEPTH:
+                            continue
+                        stack.append((Path(entry.path), level + 1))
+                    elif name in MANIFESTS:
+                        found.append((level, os.path.relpath(entry.path, root)))
+        except OSError:
+            continue
+
+    return found
+
+
+def _find_manifests(root: Path, budget: _ScanBudget) -> List[str]:
+    top_level: List[Tuple[int, str]] = []
+    subdirs: List[Path] = []
+
+    try:
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIP_DIRS and not entry.name.startswith("."):
+                        subdirs.append(Path(entry.path))
+                elif entry.name in MANIFESTS:
+                    top_level.append((0, entry.name))
+    except OSError:
+        return []
+
+    found = list(top_level)
+    if subdirs:
+        with ThreadPoolExecutor(max_workers=min(SCAN_THREADS, len(subdirs))) as pool:
+            for chunk in pool.map(lambda d: _walk(d, root, 1, budget), subdirs):
+                found.extend(chunk)
+
+    # Shallowest first, so the root manifest wins over nested examples
+    found.sort(key=lambda item: (item[0], item[1]))
+    return [rel for _, rel in found]
+
+
+# ---------------------- Inference ---------------------- #
+
+PYTHON_FRAMEWORKS = [("fastapi", "fastapi"), ("django", "django"), ("flask", "flask")]
+NODE_FRAMEWORKS = [
+    ("@nestjs/core", "nestjs"), ("next", "nextjs"), ("fastify", "fastify"),
+    ("express", "express"), ("koa", "koa"),
+]
+GO_FRAMEWORKS = [
+    ("github.com/gin-gonic/gin", "gin"), ("github.com/labstack/echo", "echo"),
+    ("github.com/gofiber/fiber", "fiber"),
+]
+DEFAULT_PORTS = {
+    "fastapi": 8000, "django": 8000, "flask": 5000,
+    "express": 3000, "nestjs": 3000, "nextjs": 3000, "fastify": 3000, "koa": 3000,
+    "spring": 8080, "gin": 8080, "echo": 8080, "fiber": 8080,
+}
+# Exec-form CMD ["sh", "-c", "<command>"] wraps a shell command
+SHELLS = ("sh", "/bin/sh", "bash", "/bin/bash")
+
+
+def _infer_python(text: str, info: Dict[str, Any]) -> None:
+    lowered = text.lower()
+    info.setdefault("language", "python")
+    for token, framework in PYTHON_FRAMEWORKS:
+        if re.search(rf"(^|[\s\"'\[,]){re.escape(token)}\b", lowered, re.MULTILINE):
+            info.setdefault("framework", framework)
+            break
+
+
+def _infer_node(text: str, info: Dict[str, Any]) -> None:
+    info.setdefault("language", "node")
+    try:
+        pkg = json.loads(text)
+    except (json.JSONDecodeError, ValueError):
+        return
+
+    deps = {}
+    for section in ("dependencies", "devDependencies"):
+        if isinstance(pkg.get(section), dict):
+            deps.update(pkg[section])
+    for dep, framework in NODE_FRAMEWORKS:
+        if dep in deps:
+            info.setdefault("framework", framework)
+            break
+
+    scripts = pkg.get("scripts") if isinstance(pkg.get("scripts"), dict) else {}
+    if "start" in scripts:
+        info.setdefault("start_command", "npm start")
+        match = re.search(r"(?:PORT=|--port[ =]|-p )(\d{2,5})", str(scripts["start"]))
+        if match:
+            info.setdefault("port", int(match.group(1)))
+
+
+def _infer_java(text: str, info: Dict[str, Any]) -> None:
+    info.setdefault("language", "java")
+    if "spring-boot" in text:
+        info.setdefault("framework", "spring")
+    info.setdefault("start_command", "java -jar app.jar")
+
+
+def _infer_go(text: str, info: Dict[str, Any]) -> None:
+    info.setdefault("language", "go")
+    for module, framework in GO_FRAMEWORKS:
+        if module in text:
+            info.setdefault("framework", framework)
+            break
+
+
+def _infer_dockerfile(text: str, info: Dict[str, Any]) -> None:
+    expose = re.search(r"^\s*EXPOSE\s+(\d{2,5})", text, re.MULTILINE | re.IGNORECASE)
+    if expose:
+        info.setdefault("port", int(expose.group(1)))
+
+    cmd = re.search(r"^\s*CMD\s+(.+)$", text, re.MULTILINE | re.IGNORECASE)
+    if cmd:
+        raw = cmd.group(1).strip()
+        try:
+            parts = json.loads(raw)
+            if isinstance(parts, list):
+                parts = [str(p) for p in parts]
+                if len(parts) == 3 and parts[0] in SHELLS and parts[1] == "-c":
+                    # Already a shell command; the generated CMD adds its own shell
+                    raw = parts[2]
+                else:
+                    # Quoted, so the generated CMD runs the same argument list
+                    raw = shlex.join(parts)
+        except (json.JSONDecodeError, ValueError):
+            pass
+        info.setdefault("start_command", raw)
+
+
+def _infer_procfile(text: str, info: Dict[str, Any]) -> None:
+    match = re.search(r"^web:\s*(.+)$", text, re.MULTILINE)
+    if match:
+        info.setdefault("start_command", match.group(1).strip())
+
+
+INFERRERS = {
+    "requirements.txt": _infer_python,
+    "pyproject.toml": _infer_python,
+    "Pipfile": _infer_python,
+    "setup.py": _infer_python,
+    "package.json": _infer_node,
+    "pom.xml": _infer_java,
+    "build.gradle": _infer_java,
+    "build.gradle.kts": _infer_java,
+    "go.mod": _infer_go,
+    "Dockerfile": _infer_dockerfile,
+    "Procfile": _infer_procfile,
+}
+
+
+class RepoAnalyzer:
+    """
+    Infers language, framework, port and start command from a local checkout.
+
+    Results are cached per repository. A cached entry stays valid while the
+    git HEAD (or, outside git, the root directory) and the stat signature of
+    the manifests it was built from are unchanged, so re-analysis of an
+    unchanged repo only costs a handful of stat calls.
+    """
+
+    def __init__(self, max_scan_bytes: int = MAX_SCAN_BYTES, cache_size: int = CACHE_SIZE):
+        self.max_scan_bytes = max_scan_bytes
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def analyze(self, repo_url: Optional[str]) -> Optional[Dict[str, Any]]:
+        root = resolve_local_repo(repo_url)
+        if root is None:
+            return None
+
+        head = _git_head_sha(root)
+        version = f"git:{head}" if head else f"tree:{_root_signature(root)}"
+
+        with self._lock:
+            cached = self._cache.get(str(root))
+            if cached and cached["version"] == version:
+                if _stat_signature(root, cached["result"]["manifests"]) == cached["stats"]:
+                    self._cache.move_to_end(str(root))
+                    return {**cached["result"], "cached": True}
+
+        result = self._scan(root, version)
+
+        with self._lock:
+            self._cache[str(root)] = {
+                "version": version,
+                "stats": _stat_signature(root, result["manifests"]),
+                "result": result,
+            }
+            self._cache.move_to_end(str(root))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return {**result, "cached": False}
+
+    def _scan(self, root: Path, version: str) -> Dict[str, Any]:
+        budget = _ScanBudget(self.max_scan_bytes)
+        manifests = _find_manifests(root, budget)
+
+        info: Dict[str, Any] = {}
+        used: List[str] = []
+        for rel in manifests:
+            name = os.path.basename(rel)
+            # Nested Dockerfiles/Procfiles describe sub-apps; only trust the root ones
+            if name in ("Dockerfile", "Procfile") and os.path.dirname(rel):
+                continue
+            text = _read_capped(root / rel, budget)
+            if not text:
+                continue
+            INFERRERS[name](text, info)
+            used.append(rel)
+
+        framework = info.get("framework")
+        if "port" not in info and framework in DEFAULT_PORTS:
+            info["port"] = DEFAULT_PORTS[framework]
+
+        signature = json.dumps(_stat_signature(root, used), sort_keys=True)
+        result = {
+            "root": str(root),
+            "version": version,
+            "tree_hash": hashlib.sha256(signature.encode("utf-8")).hexdigest()[:16],
+            "language": info.get("language"),
+            "framework": framework,
+            "port": info.get("port"),
+            "start_command": info.get("start_command"),
+            "manifests": used,
+            "bytes_scanned": budget.used,
+            "entries_seen": budget.entries,
+            "truncated": budget.truncated,
+        }
+
+        logger.info(
+            "Repository analyzed",
+            extra={"root": str(root), "language": result["language"], "framework": framework},
+        )
+        return result
@@ -0,0 +1,397 @@
+# backend/services/usage_ledger.py
+
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from services.model_router import model_router
+from utils.logger import get_logger
+from utils.metrics import metrics
+from utils.prompt_cache import cached_tokens
+from utils.rate_limit import client_key
+from utils.storage import connect_sqlite, data_path
+
+logger = get_logger(__name__)
+
+USAGE_LEDGER_ENABLED = os.getenv("INFRASCRIBE_USAGE_LEDGER", "1").lower() not in ("0", "false", "no", "off")
+USAGE_DB = os.getenv("INFRASCRIBE_USAGE_DB") or None
+# Buffered calls are written when this many are pending or every FLUSH_SECONDS
+USAGE_FLUSH_BATCH = int(os.getenv("INFRASCRIBE_USAGE_FLUSH_BATCH", "200"))
+USAGE_FLUSH_SECONDS = float(os.getenv("INFRASCRIBE_USAGE_FLUSH_SECONDS", "2"))
+# Per-call rows older than this are pruned; daily aggregates are kept
+USAGE_RETENTION_DAYS = int(os.getenv("INFRASCRIBE_USAGE_RETENTION_DAYS", "90"))
+# Per-caller daily quotas (UTC days); 0 = unlimited
+DAILY_TOKEN_QUOTA = int(os.getenv("INFRASCRIBE_USAGE_DAILY_TOKENS", "0"))
+DAILY_COST_QUOTA_USD = float(os.getenv("INFRASCRIBE_USAGE_DAILY_USD", "0"))
+# How stale another worker's usage may be in quota checks
+QUOTA_REFRESH_SECONDS = float(os.getenv("INFRASCRIBE_USAGE_QUOTA_REFRESH_SECONDS", "5"))
+
+# Who the model calls of the current request are billed to (set per request)
+UNATTRIBUTED = "system"
+_subject: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "infrascribe_usage_subject", default=UNATTRIBUTED
+)
+
+_TOTAL_FIELDS = (
+    "calls", "prompt_tokens", "completion_tokens", "cached_tokens", "cost_usd", "latency_ms",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage_events (
+    id                 INTEGER PRIMARY KEY,
+    ts                 REAL NOT NULL,
+    day                TEXT NOT NULL,
+    subject            TEXT NOT NULL,
+    operation          TEXT NOT NULL,
+    model              TEXT NOT NULL,
+    prompt_tokens      INTEGER NOT NULL,
+    completion_tokens  INTEGER NOT NULL,
+    cached_tokens      INTEGER NOT NULL,
+    cost_usd           REAL NOT NULL,
+    latency_ms         REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_usage_events_ts ON usage_events(ts);
+CREATE TABLE IF NOT EXISTS usage_daily (
+    subject            TEXT NOT NULL,
+    day                TEXT NOT NULL,
+    calls              INTEGER NOT NULL,
+    prompt_tokens      INTEGER NOT NULL,
+    completion_tokens  INTEGER NOT NULL,
+    cached_tokens      INTEGER NOT NULL,
+    cost_usd           REAL NOT NULL,
+    latency_ms         REAL NOT NULL,
+    PRIMARY KEY (subject, day)
+) WITHOUT ROWID;
+"""
+_INSERT_EVENT = (
+    "INSERT INTO usage_events (ts, day, subject, operation, model, prompt_tokens, "
+    "completion_tokens, cached_tokens, cost_usd, latency_ms) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_UPSERT_DAILY = """
+INSERT INTO usage_daily (subject, day, calls, prompt_tokens, completion_tokens,
+                         cached_tokens, cost_usd, latency_ms)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(subject, day) DO UPDATE SET
+    calls = calls + excluded.calls,
+    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+    completion_tokens = completion_tokens + excluded.completion_tokens,
+    cached_tokens = cached_tokens + excluded.cached_tokens,
+    cost_usd = cost_usd + excluded.cost_usd,
+    latency_ms = latency_ms + excluded.latency_ms
+"""
+_SELECT_DAILY = (
+    "SELECT calls, prompt_tokens, completion_tokens, cached_tokens, cost_usd, latency_ms "
+    "FROM usage_daily WHERE subject = ? AND day = ?"
+)
+_PRUNE_EVENTS = "DELETE FROM usage_events WHERE ts < ?"
+
+
+def utc_day(ts: Optional[float] = None) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(time.time() if ts is None else ts))
+
+
+def _empty_totals() -> Dict[str, float]:
+    return {field: 0 for field in _TOTAL_FIELDS}
+
+
+def _add(totals: Dict[str, float], event: Dict[str, Any]) -> None:
+    totals["calls"] += 1
+    for field in _TOTAL_FIELDS[1:]:
+        totals[field] += event[field]
+
+
+def set_usage_subject(subject: str) -> None:
+    """
+    Bills model calls made by the current request (and tasks it spawns) to
+    `subject`.
+    """
+    _subject.set(subject)
+
+
+def usage_subject() -> str:
+    return _subject.get()
+
+
+class UsageLedger:
+    """
+    Per-call record of model usage (prompt/completion/cached tokens, cost,
+    latency) by caller and operation, plus per-caller daily aggregates.
+
+    record() only appends to an in-memory buffer; a background task writes
+    the buffer in one transaction every USAGE_FLUSH_SECONDS (or once
+    USAGE_FLUSH_BATCH calls are pending). today() serves quota checks from
+    memory: the caller's persisted daily row, re-read at most every
+    QUOTA_REFRESH_SECONDS, plus this process' calls not yet flushed.
+    """
+
+    def __init__(self, db_path: Optional[str] = USAGE_DB):
+        self.db_path = db_path or str(data_path("usage.sqlite3"))
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+        self._buffer: List[Dict[str, Any]] = []
+        # (subject, day) -> totals buffered but not yet flushed
+        self._pending: Dict[Tuple[str, str], Dict[str, float]] = {}
+        # (subject, day) -> (loaded_at, persisted totals at that time)
+        self._persisted: Dict[Tuple[str, str], Tuple[float, Dict[str, float]]] = {}
+        self._lock = threading.Lock()
+
+        self._task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_prune_day: Optional[str] = None
+
+    # ---------------------- Recording ---------------------- #
+
+    def record(
+        self,
+        operation: str,
+        model: str,
+        usage: Any,
+        latency_seconds: float,
+        subject: Optional[str] = None,
+    ) -> None:
+        """
+        Buffers one model call. `usage` is the provider usage object of a
+        chat completion or Responses API call (None if not reported).
+        """
+        if not USAGE_LEDGER_ENABLED:
+            return
+
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        if prompt_tokens is None:
+            prompt_tokens = getattr(usage, "input_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        if completion_tokens is None:
+            completion_tokens = getattr(usage, "output_tokens", None)
+        prompt_tokens, completion_tokens = prompt_tokens or 0, completion_tokens or 0
+
+        now = time.time()
+        event = {
+            "ts": now,
+            "day": utc_day(now),
+            "subject": subject or usage_subject(),
+            "operation": operation,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": (cached_tokens(usage) or 0) if usage is not None else 0,
+            "cost_usd": model_router.estimate_cost(model, prompt_tokens, completion_tokens),
+            "latency_ms": latency_seconds * 1000.0,
+        }
+        with self._lock:
+            self._buffer.append(event)
+            _add(self._pending.setdefault((event["subject"], event["day"]), _empty_totals()), event)
+            full = len(self._buffer) >= USAGE_FLUSH_BATCH
+
+        metrics.incr(f"usage.{operation}.calls")
+        metrics.incr(f"usage.{operation}.prompt_tokens", prompt_tokens)
+        metrics.incr(f"usage.{operation}.completion_tokens", completion_tokens)
+        metrics.incr(f"usage.{operation}.cached_tokens", event["cached_tokens"])
+        if full:
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # no loop (CLI): the next flush() call writes it
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self.flush())
+
+    # ---------------------- Flushing ---------------------- #
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect_sqlite(self.db_path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _write(self, events: List[Dict[str, Any]], daily: Dict[Tuple[str, str], Dict[str, float]]) -> None:
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    _INSERT_EVENT,
+                    [
+                        (
+                            e["ts"], e["day"], e["subject"], e["operation"], e["model"],
+                            e["prompt_tokens"], e["completion_tokens"], e["cached_tokens"],
+                            e["cost_usd"], e["latency_ms"],
+                        )
+                        for e in events
+                    ],
+                )
+                conn.executemany(
+                    _UPSERT_DAILY,
+                    [
+                        (subject, day, *(totals[field] for field in _TOTAL_FIELDS))
+                        for (subject, day), totals in daily.items()
+                    ],
+                )
+                today = utc_day()
+                if USAGE_RETENTION_DAYS > 0 and self._last_prune_day != today:
+                    conn.execute(_PRUNE_EVENTS, (time.time() - USAGE_RETENTION_DAYS * 86400,))
+                    self._last_prune_day = today
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    async def flush(self) -> int:
+        """
+        Writes everything buffered so far; returns the number of calls written.
+        """
+        with self._lock:
+            events, self._buffer = self._buffer, []
+            daily, self._pending = self._pending, {}
+        if not events:
+            return 0
+
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write, events, daily)
+        except sqlite3.Error as e:
+            # Keep the calls for the next attempt rather than lose them
+            with self._lock:
+                self._buffer = events + self._buffer
+                for key, totals in daily.items():
+                    pending = self._pending.setdefault(key, _empty_totals())
+                    for field in _TOTAL_FIELDS:
+                        pending[field] += totals[field]
+            metrics.incr("usage.flush_errors")
+            logger.warning(f"Usage ledger flush failed, {len(events)} call(s) kept: {e}")
+            return 0
+
+        with self._lock:
+            # Flushed totals now live in the database: re-read those rows on next use
+            for key in daily:
+                self._persisted.pop(key, None)
+        metrics.incr("usage.flushed_calls", len(events))
+        metrics.observe("usage.flush_seconds", time.perf_counter() - started)
+        return len(events)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(USAGE_FLUSH_SECONDS)
+            await self.flush()
+
+    def start(self) -> None:
+        if USAGE_LEDGER_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---------------------- Queries ---------------------- #
+
+    def _select_daily(self, subject: str, day: str) -> Dict[str, float]:
+        with self._db_lock:
+            row = self._connection().execute(_SELECT_DAILY, (subject, day)).fetchone()
+        return dict(row) if row else _empty_totals()
+
+    async def today(self, subject: str) -> Dict[str, float]:
+        """
+        The caller's usage for the current UTC day. A dict lookup when the
+        persisted row was read in the last QUOTA_REFRESH_SECONDS, otherwise
+        one primary-key read.
+        """
+        key = (subject, utc_day())
+        with self._lock:
+            cached = self._persisted.get(key)
+        if cached is None or time.monotonic() - cached[0] >= QUOTA_REFRESH_SECONDS:
+            persisted = await asyncio.to_thread(self._select_daily, *key)
+            with self._lock:
+                if len(self._persisted) > 10_000:
+                    self._persisted.clear()
+                self._persisted[key] = (time.monotonic(), persisted)
+                cached = self._persisted[key]
+
+        with self._lock:
+            totals = dict(cached[1])
+            pending = self._pending.get(key)
+            if pending is not None:
+                for field in _TOTAL_FIELDS:
+                    totals[field] += pending[field]
+        return totals
+
+    def report(self, days: int = 7, group_by: str = "subject") -> List[Dict[str, Any]]:
+        """
+        Per-call rows of the last `days` days grouped by subject, operation
+        or model (cli.py usage-report). Reads the database only.
+        """
+        if group_by not in ("subject", "operation", "model"):
+            raise ValueError(f"Cannot group usage by {group_by!r}")
+        query = (
+            f"SELECT {group_by} AS name, COUNT(*) AS calls, "
+            "SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens, "
+            "SUM(cached_tokens) AS cached_tokens, SUM(cost_usd) AS cost_usd, "
+            "AVG(latency_ms) AS avg_latency_ms, MAX(latency_ms) AS max_latency_ms "
+            f"FROM usage_events WHERE ts >= ? GROUP BY {group_by} ORDER BY cost_usd DESC"
+        )
+        with self._db_lock:
+            rows = self._connection().execute(query, (time.time() - days * 86400,)).fetchall()
+        return [dict(row) for row in rows]
+
+
+usage_ledger = UsageLedger()
+
+
+def quota_exceeded(totals: Dict[str, float]) -> Optional[str]:
+    """
+    Which daily quota `totals` has used up, or None.
+    """
+    tokens = totals["prompt_tokens"] + totals["completion_tokens"]
+    if DAILY_TOKEN_QUOTA > 0 and tokens >= DAILY_TOKEN_QUOTA:
+        return f"daily token quota ({DAILY_TOKEN_QUOTA})"
+    if DAILY_COST_QUOTA_USD > 0 and totals["cost_usd"] >= DAILY_COST_QUOTA_USD:
+        return f"daily cost quota (${DAILY_COST_QUOTA_USD:.2f})"
+    return None
+
+
+async def enforce_usage_quota(request: Request) -> None:
+    """
+    Route dependency for AI routes: bills the request's model calls to the
+    caller (same key as rate limiting) and refuses with 429 once the
+    caller's daily quota is spent. Calls already in flight may overshoot
+    the quota slightly; it is checked before a request, not per token.
+    """
+    subject = client_key(request)
+    set_usage_subject(subject)
+    if not USAGE_LEDGER_ENABLED or (DAILY_TOKEN_QUOTA <= 0 and DAILY_COST_QUOTA_USD <= 0):
+        return
+
+    started = time.perf_counter()
+    try:
+        totals = await usage_ledger.today(subject)
+    except sqlite3.Error as e:
+        logger.warning(f"Usage quota check failed, allowing request: {e}")
+        return
+    finally:
+        metrics.observe("usage.quota_check_seconds", time.perf_counter() - started)
+
+    exceeded = quota_exceeded(totals)
+    if exceeded is not None:
+        metrics.incr("usage.quota_rejected")
+        now = time.time()
+        retry_after = max(1, int(86400 - now % 86400))  # next UTC midnight
+        raise HTTPException(
+            status_code=429,
+            detail=f"AI usage quota exhausted: {exceeded} reached for today",
+            headers={"Retry-After": str(retry_after)},
+        )
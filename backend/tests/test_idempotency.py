@@ -0,0 +1,43 @@
+# backend/tests/test_idempotency.py
+
+import os
+import tempfile
+
+os.environ.setdefault("INFRASCRIBE_DATA_DIR", tempfile.mkdtemp(prefix="infrascribe-test-"))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from fastapi.testclient import TestClient
+
+from app import app
+from utils.idempotency import REPLAYED_HEADER
+
+SPEC = {"language": "python", "framework": "flask"}
+
+
+def test_retry_on_redirected_generate_path_is_replayed():
+    client = TestClient(app)
+    headers = {"Idempotency-Key": "retry-no-slash"}
+
+    # The frontend posts to /api/generate, which redirects to /api/generate/
+    first = client.post("/api/generate", json=SPEC, headers=headers)
+    assert first.status_code == 200
+    assert first.headers.get(REPLAYED_HEADER) is None
+
+    for _ in range(2):
+        retry = client.post("/api/generate", json=SPEC, headers=headers)
+        assert retry.status_code == 200
+        assert retry.headers.get(REPLAYED_HEADER) == "true"
+        assert retry.content == first.content
+
+    with_slash = client.post("/api/generate/", json=SPEC, headers=headers)
+    assert with_slash.status_code == 200
+    assert with_slash.content == first.content
+
+
+def test_reused_key_with_different_body_is_rejected():
+    client = TestClient(app)
+    headers = {"Idempotency-Key": "reused"}
+
+    assert client.post("/api/generate", json=SPEC, headers=headers).status_code == 200
+    other = client.post("/api/generate", json={**SPEC, "framework": "django"}, headers=headers)
+    assert other.status_code == 422
@@ -0,0 +1,140 @@
+# backend/utils/cache_server.py
+"""
+Stand-in Redis-protocol server for the shared cache tier, so several
+workers or hosts can share one cache without installing Redis:
+
+    python cli.py cache-server --port 6380 --max-mb 256
+    INFRASCRIBE_CACHE_BACKEND=redis INFRASCRIBE_CACHE_URL=redis://127.0.0.1:6380/0
+
+Implements the subset RedisCacheBackend (and redis-cli) use: PING, GET,
+SET [EX|PX], DEL, EXISTS, DBSIZE, FLUSHDB, SELECT, AUTH, QUIT, COMMAND.
+One LRU (MemoryCacheBackend) per database number; no persistence.
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from utils.logger import get_logger
+from utils.shared_cache import CACHE_MAX_BYTES, MemoryCacheBackend
+
+logger = get_logger(__name__)
+
+
+def _encode(reply: Any) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, bool):
+        return b":%d\r\n" % int(reply)
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(_encode(item) for item in reply)
+    if isinstance(reply, Exception):
+        return b"-ERR %s\r\n" % str(reply).encode("utf-8")
+    return b"+%s\r\n" % str(reply).encode("utf-8")
+
+
+async def _read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command (telnet / redis-cli without RESP)
+        return line.strip().split()
+    args = []
+    for _ in range(int(line[1:])):
+        header = await reader.readline()
+        if not header.startswith(b"$"):
+            raise ValueError("Protocol error: expected bulk string")
+        data = await reader.readexactly(int(header[1:]) + 2)
+        args.append(data[:-2])
+    return args
+
+
+class CacheServer:
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, password: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.password = password
+        self._dbs: Dict[int, MemoryCacheBackend] = {}
+
+    def _db(self, index: int) -> MemoryCacheBackend:
+        if index not in self._dbs:
+            self._dbs[index] = MemoryCacheBackend(self.max_bytes)
+        return self._dbs[index]
+
+    def execute(self, args: List[bytes], session: Dict[str, Any]) -> Any:
+        name = args[0].decode("utf-8", "replace").upper()
+        if name == "AUTH":
+            session["authed"] = self.password is None or args[-1].decode("utf-8") == self.password
+            return "OK" if session["authed"] else ValueError("invalid password")
+        if name == "QUIT":
+            session["quit"] = True
+            return "OK"
+        if not session["authed"]:
+            return ValueError("NOAUTH Authentication required.")
+        if name == "PING":
+            return args[1] if len(args) > 1 else "PONG"
+        if name == "COMMAND":
+            return []
+        if name == "SELECT":
+            session["db"] = int(args[1])
+            return "OK"
+
+        db = self._db(session["db"])
+        if name == "GET":
+            return db.get(args[1].decode("utf-8"))
+        if name == "SET":
+            ttl = None
+            options = [arg.upper() for arg in args[3:]]
+            if b"EX" in options:
+                ttl = float(args[3 + options.index(b"EX") + 1])
+            elif b"PX" in options:
+                ttl = float(args[3 + options.index(b"PX") + 1]) / 1000
+            db.set(args[1].decode("utf-8"), args[2], ttl)
+            return "OK"
+        if name == "DEL":
+            return sum(db.delete(key.decode("utf-8")) for key in args[1:])
+        if name == "EXISTS":
+            return sum(db.get(key.decode("utf-8")) is not None for key in args[1:])
+        if name == "DBSIZE":
+            return len(db)
+        if name == "FLUSHDB":
+            db.clear()
+            return "OK"
+        return ValueError(f"unknown command '{name}'")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = {"db": 0, "authed": self.password is None, "quit": False}
+        try:
+            while not session["quit"]:
+                try:
+                    args = await _read_command(reader)
+                except (ValueError, asyncio.IncompleteReadError) as e:
+                    writer.write(_encode(ValueError(str(e))))
+                    break
+                if args is None:
+                    break
+                if not args:
+                    continue
+                try:
+                    reply = self.execute(args, session)
+                except (IndexError, ValueError, UnicodeDecodeError) as e:
+                    reply = ValueError(f"wrong arguments: {e}")
+                writer.write(_encode(reply))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 6380) -> asyncio.AbstractServer:
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info(f"Cache server listening on {host}:{server.sockets[0].getsockname()[1]}")
+        return server
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 6380) -> None:
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,127 @@
+# backend/utils/cancellation.py
+
+import asyncio
+import contextlib
+import os
+import time
+from typing import Awaitable, Optional, TypeVar
+
+from fastapi import HTTPException, Request
+
+from utils.logger import get_logger
+from utils.metrics import metrics
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# Relative budget for the whole request, in milliseconds
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+# Server-side cap applied even when the client sends no deadline (0 = none)
+MAX_REQUEST_SECONDS = float(os.getenv("INFRASCRIBE_MAX_REQUEST_SECONDS", "0"))
+DISCONNECT_POLL_SECONDS = 0.25
+# time.monotonic() at which the request arrived, stamped by RequestStartMiddleware
+STARTED_SCOPE_KEY = "infrascribe.started"
+
+
+class RequestCancelled(Exception):
+    """
+    Raised when in-flight work was abandoned because the client went away
+    ("client_disconnect") or the request deadline passed ("deadline").
+    """
+
+    def __init__(self, reason: str, operation: str):
+        super().__init__(f"{operation} cancelled: {reason}")
+        self.reason = reason
+        self.operation = operation
+
+
+def request_deadline(request: Request) -> Optional[float]:
+    """
+    Absolute time.monotonic() deadline for this request, or None.
+    """
+    budgets = []
+    raw = request.headers.get(DEADLINE_HEADER)
+    if raw:
+        try:
+            budgets.append(max(0.0, float(raw)) / 1000.0)
+        except ValueError:
+            logger.warning(f"Ignoring invalid {DEADLINE_HEADER} header: {raw!r}")
+    if MAX_REQUEST_SECONDS > 0:
+        budgets.append(MAX_REQUEST_SECONDS)
+    if not budgets:
+        return None
+
+    # Without the middleware (e.g. a bare router in tests) the clock starts now
+    started = request.scope.setdefault(STARTED_SCOPE_KEY, time.monotonic())
+    return started + min(budgets)
+
+
+async def run_cancellable(request: Request, work: Awaitable[T], operation: str) -> T:
+    """
+    Awaits `work`, cancelling it as soon as the client disconnects or the
+    request deadline passes. Cancellation aborts in-flight async OpenAI
+    calls, so no further tokens are paid for.
+    """
+    deadline = request_deadline(request)
+    task = asyncio.ensure_future(work)
+    started = time.perf_counter()
+    reason = None
+
+    try:
+        while reason is None:
+            timeout = DISCONNECT_POLL_SECONDS
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    reason = "deadline"
+                    break
+                timeout = min(timeout, remaining)
+
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if done:
+                return task.result()
+
+            if await request.is_disconnected():
+                reason = "client_disconnect"
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError, Exception):
+        await task
+
+    elapsed = time.perf_counter() - started
+    metrics.incr("cancellations.total")
+    metrics.incr(f"cancellations.{reason}")
+    metrics.incr(f"cancellations.{reason}.{operation}")
+    metrics.observe("cancellations.elapsed_seconds", elapsed)
+    logger.info(
+        "Request work cancelled",
+        extra={"operation": operation, "reason": reason, "elapsed": round(elapsed, 3)},
+    )
+    raise RequestCancelled(reason, operation)
+
+
+def cancellation_http_error(exc: RequestCancelled) -> HTTPException:
+    if exc.reason == "deadline":
+        return HTTPException(status_code=504, detail="Request deadline exceeded")
+    # Nobody is listening any more; 499 keeps access logs honest
+    return HTTPException(status_code=499, detail="Client closed request")
+
+
+class RequestStartMiddleware:
+    """
+    ASGI middleware recording when each request arrived, so deadlines
+    cover everything the handler does, not just the cancellable parts.
+    Registered outermost.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope.setdefault(STARTED_SCOPE_KEY, time.monotonic())
+        await self.app(scope, receive, send)
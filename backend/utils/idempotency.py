@@ -0,0 +1,444 @@
+# backend/utils/idempotency.py
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from utils.logger import get_logger
+from utils.metrics import metrics
+from utils.rate_limit import client_key
+from utils.storage import connect_sqlite, data_path
+
+logger = get_logger(__name__)
+
+IDEMPOTENCY_BACKEND = os.getenv("INFRASCRIBE_IDEMPOTENCY_BACKEND", "memory")  # "memory" | "sqlite" | "off"
+IDEMPOTENCY_DB = os.getenv("INFRASCRIBE_IDEMPOTENCY_DB") or None
+# How long a stored response is replayed for retries with the same key
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("INFRASCRIBE_IDEMPOTENCY_TTL_SECONDS", "86400"))
+# Total stored response bytes; the oldest responses are dropped beyond this
+IDEMPOTENCY_MAX_BYTES = int(os.getenv("INFRASCRIBE_IDEMPOTENCY_MAX_BYTES", str(64 * 1024 * 1024)))
+# Larger responses are served but not stored (retries run again)
+IDEMPOTENCY_MAX_RESPONSE_BYTES = int(
+    os.getenv("INFRASCRIBE_IDEMPOTENCY_MAX_RESPONSE_BYTES", str(8 * 1024 * 1024))
+)
+# A claim held longer than this (crashed worker) is given to the next retry
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("INFRASCRIBE_IDEMPOTENCY_LEASE_SECONDS", "600"))
+# How long a duplicate waits for the in-flight request before answering 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("INFRASCRIBE_IDEMPOTENCY_WAIT_SECONDS", "120"))
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+# Cross-worker waiters (SQLite store) poll at this interval
+POLL_SECONDS = 0.1
+# Bookkeeping per stored key, so many tiny responses still hit the byte cap
+ENTRY_OVERHEAD_BYTES = 256
+
+# (status, [(name, value), ...], body) as sent by the app
+StoredResponse = Tuple[int, List[Tuple[bytes, bytes]], bytes]
+
+# begin() outcomes
+CLAIMED = "claimed"
+PENDING = "pending"
+DONE = "done"
+MISMATCH = "mismatch"
+
+
+class MemoryIdempotencyStore:
+    """
+    Per-process store: in-flight claims and finished responses in one
+    OrderedDict, oldest dropped first once over IDEMPOTENCY_MAX_BYTES.
+    A retry that lands on another uvicorn worker is not deduplicated; use
+    the SQLite store to share keys across workers.
+    """
+
+    blocking = False
+
+    def __init__(self, max_bytes: int = IDEMPOTENCY_MAX_BYTES):
+        self.max_bytes = max(1, max_bytes)
+        self._lock = threading.Lock()
+        # key -> {"fingerprint", "expires_at", "response", "size"}
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+
+    def _drop(self, key: str) -> None:
+        self._bytes -= self._entries.pop(key)["size"]
+
+    def begin(self, key: str, fingerprint: str, now: float) -> Tuple[str, Optional[StoredResponse]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= now:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self._entries[key] = {
+                    "fingerprint": fingerprint,
+                    "expires_at": now + IDEMPOTENCY_LEASE_SECONDS,
+                    "response": None,
+                    "size": ENTRY_OVERHEAD_BYTES,
+                }
+                self._bytes += ENTRY_OVERHEAD_BYTES
+                return CLAIMED, None
+            if entry["fingerprint"] != fingerprint:
+                return MISMATCH, None
+            if entry["response"] is None:
+                return PENDING, None
+            return DONE, entry["response"]
+
+    def complete(self, key: str, response: StoredResponse, now: float) -> None:
+        size = ENTRY_OVERHEAD_BYTES + len(response[2]) + sum(len(n) + len(v) for n, v in response[1])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            self._bytes += size - entry["size"]
+            entry.update(response=response, size=size, expires_at=now + IDEMPOTENCY_TTL_SECONDS)
+            self._entries.move_to_end(key)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["response"] is None:
+                self._drop(key)
+
+    def close(self) -> None:
+        pass
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key          TEXT PRIMARY KEY,
+    fingerprint  TEXT NOT NULL,
+    status       INTEGER,          -- NULL while the first request is in flight
+    headers      TEXT,
+    body         BLOB,
+    size         INTEGER NOT NULL,
+    expires_at   REAL NOT NULL     -- lease end while in flight, replay window end once done
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at);
+"""
+_SELECT = "SELECT fingerprint, status, headers, body, expires_at FROM idempotency_keys WHERE key = ?"
+_CLAIM = (
+    "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, status, headers, body, size, expires_at) "
+    "VALUES (?, ?, NULL, NULL, NULL, ?, ?)"
+)
+_COMPLETE = (
+    "UPDATE idempotency_keys SET status = ?, headers = ?, body = ?, size = ?, expires_at = ? "
+    "WHERE key = ? AND status IS NULL"
+)
+_RELEASE = "DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL"
+_PRUNE_EXPIRED = "DELETE FROM idempotency_keys WHERE expires_at < ?"
+_TOTAL_SIZE = "SELECT COALESCE(SUM(size), 0) AS bytes, COUNT(*) AS n FROM idempotency_keys"
+# Finished responses closest to the end of their window go first
+_EVICT_OLDEST = (
+    "DELETE FROM idempotency_keys WHERE key IN (SELECT key FROM idempotency_keys "
+    "WHERE status IS NOT NULL ORDER BY expires_at LIMIT ?)"
+)
+
+
+class SQLiteIdempotencyStore:
+    """
+    Host-wide store shared by all uvicorn workers. Claims are taken inside
+    a BEGIN IMMEDIATE transaction, so of two concurrent first requests on
+    different workers exactly one runs; the other polls until the response
+    is stored. Expired rows are pruned and the byte cap enforced every
+    PRUNE_EVERY stored responses.
+    """
+
+    blocking = True
+    PRUNE_EVERY = 100
+
+    def __init__(self, db_path: Optional[str] = IDEMPOTENCY_DB, max_bytes: int = IDEMPOTENCY_MAX_BYTES):
+        self.db_path = db_path or str(data_path("idempotency.sqlite3"))
+        self.max_bytes = max(1, max_bytes)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._stored = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect_sqlite(self.db_path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def begin(self, key: str, fingerprint: str, now: float) -> Tuple[str, Optional[StoredResponse]]:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(_SELECT, (key,)).fetchone()
+                if row is None or row["expires_at"] <= now:
+                    conn.execute(
+                        _CLAIM, (key, fingerprint, ENTRY_OVERHEAD_BYTES, now + IDEMPOTENCY_LEASE_SECONDS)
+                    )
+                    outcome = CLAIMED, None
+                elif row["fingerprint"] != fingerprint:
+                    outcome = MISMATCH, None
+                elif row["status"] is None:
+                    outcome = PENDING, None
+                else:
+                    headers = [
+                        (name.encode("latin-1"), value.encode("latin-1"))
+                        for name, value in json.loads(row["headers"])
+                    ]
+                    outcome = DONE, (row["status"], headers, bytes(row["body"]))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return outcome
+
+    def complete(self, key: str, response: StoredResponse, now: float) -> None:
+        status, headers, body = response
+        encoded = json.dumps([(n.decode("latin-1"), v.decode("latin-1")) for n, v in headers])
+        size = ENTRY_OVERHEAD_BYTES + len(encoded) + len(body)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(_COMPLETE, (status, encoded, body, size, now + IDEMPOTENCY_TTL_SECONDS, key))
+            self._stored += 1
+            if self._stored % self.PRUNE_EVERY == 0:
+                self._prune(conn, now)
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(_PRUNE_EXPIRED, (now,))
+        row = conn.execute(_TOTAL_SIZE).fetchone()
+        if row["bytes"] > self.max_bytes:
+            # Drop the oldest share of rows proportional to the overshoot (+10%)
+            share = min(1.0, (row["bytes"] - self.max_bytes) / row["bytes"] + 0.1)
+            conn.execute(_EVICT_OLDEST, (max(1, int(row["n"] * share)),))
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._connection().execute(_RELEASE, (key,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _build_store():
+    backend = IDEMPOTENCY_BACKEND.lower()
+    if backend == "off":
+        return None
+    if backend == "sqlite":
+        return SQLiteIdempotencyStore()
+    return MemoryIdempotencyStore()
+
+
+idempotency_store = _build_store()
+
+
+async def _call(method: str, *args: Any) -> Any:
+    fn = getattr(idempotency_store, method)
+    if idempotency_store.blocking:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+def _caller(scope) -> str:
+    """
+    Keys are per caller: the bearer token (the middleware runs before the
+    router's auth dependency) or, for guests, the client address.
+    """
+    request = Request(scope)
+    authorization = request.headers.get("authorization")
+    if authorization:
+        return "auth:" + hashlib.sha256(authorization.encode("utf-8")).hexdigest()[:32]
+    return client_key(request)
+
+
+def _fingerprint(scope, body: bytes) -> str:
+    # Same route with or without the trailing slash: POST /api/generate is
+    # redirected to /api/generate/, and retries arrive on the first form
+    path = scope["path"].rstrip("/") or "/"
+    digest = hashlib.sha256()
+    digest.update(scope["method"].encode("latin-1") + b" " + path.encode("utf-8"))
+    digest.update(b"?" + scope.get("query_string", b"") + b"\n")
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class IdempotencyMiddleware:
+    """
+    ASGI middleware honouring an Idempotency-Key header on selected POST
+    routes. The first request with a key runs normally and, if it returns
+    2xx, its status, headers and body are stored for IDEMPOTENCY_TTL_SECONDS.
+    Retries with the same key and request get that response byte-for-byte
+    (plus "Idempotent-Replayed: true"); a duplicate that arrives while the
+    first is still running waits for it. Reusing a key for a different
+    request is a 422. Non-2xx responses are not stored, so the next retry
+    runs again. Pure ASGI so ZIP and JSON bodies pass through unbuffered.
+    """
+
+    def __init__(self, app, paths: Iterable[str]):
+        self.app = app
+        self.paths = frozenset(paths)
+        # key -> set once its first request finishes (this worker only)
+        self._inflight: Dict[str, asyncio.Event] = {}
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"].rstrip("/") not in self.paths
+            or idempotency_store is None
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        idem_key = Request(scope).headers.get(IDEMPOTENCY_HEADER)
+        if idem_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not 0 < len(idem_key) <= MAX_KEY_LENGTH or not idem_key.isprintable():
+            response = JSONResponse(
+                status_code=400,
+                content={"detail": f"{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} printable characters"},
+            )
+            await response(scope, receive, send)
+            return
+
+        # The body is part of the fingerprint, so read it up front and hand it on
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+        body_sent = False
+
+        async def receive_body():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        key = f"{_caller(scope)}:{idem_key}"
+        fingerprint = _fingerprint(scope, body)
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        waited = False
+
+        while True:
+            try:
+                state, stored = await _call("begin", key, fingerprint, time.time())
+            except sqlite3.Error as e:
+                # Fail open: without the store the request simply runs
+                metrics.incr("idempotency.errors")
+                logger.warning(f"Idempotency store unavailable, running request: {e}")
+                await self.app(scope, receive_body, send)
+                return
+
+            if state == CLAIMED:
+                metrics.incr("idempotency.misses")
+                await self._run(scope, receive_body, send, key)
+                return
+            if state == DONE:
+                metrics.incr("idempotency.hits")
+                await self._replay(send, stored)
+                return
+            if state == MISMATCH:
+                metrics.incr("idempotency.conflicts")
+                response = JSONResponse(
+                    status_code=422,
+                    content={"detail": f"{IDEMPOTENCY_HEADER} was already used for a different request"},
+                )
+                await response(scope, receive, send)
+                return
+
+            # PENDING: the first request with this key is still running
+            if not waited:
+                waited = True
+                metrics.incr("idempotency.waits")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                response = JSONResponse(
+                    status_code=409,
+                    content={"detail": f"A request with this {IDEMPOTENCY_HEADER} is still in progress"},
+                    headers={"Retry-After": "1"},
+                )
+                await response(scope, receive, send)
+                return
+            event = self._inflight.get(key)
+            if event is not None:
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # Running on another worker (SQLite store)
+                await asyncio.sleep(min(POLL_SECONDS, remaining))
+
+    async def _run(self, scope, receive, send, key: str) -> None:
+        event = self._inflight[key] = asyncio.Event()
+        status = None
+        headers: List[Tuple[bytes, bytes]] = []
+        parts: List[bytes] = []
+        size = 0
+        complete = False
+
+        async def capture(message):
+            nonlocal status, headers, size, complete
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body" and size <= IDEMPOTENCY_MAX_RESPONSE_BYTES:
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                parts.append(chunk)
+                complete = not message.get("more_body", False)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            storable = (
+                complete
+                and status is not None
+                and 200 <= status < 300
+                and size <= IDEMPOTENCY_MAX_RESPONSE_BYTES
+            )
+            try:
+                if storable:
+                    await _call("complete", key, (status, headers, b"".join(parts)), time.time())
+                    metrics.incr("idempotency.stored")
+                else:
+                    # Failed, cancelled or too large: let the next retry run it again
+                    await _call("release", key)
+            except sqlite3.Error as e:
+                metrics.incr("idempotency.errors")
+                logger.warning(f"Idempotency store update failed: {e}")
+            finally:
+                self._inflight.pop(key, None)
+                event.set()
+
+    @staticmethod
+    async def _replay(send, stored: StoredResponse) -> None:
+        status, headers, body = stored
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": list(headers) + [(REPLAYED_HEADER.lower().encode("latin-1"), b"true")],
+        })
+        await send({"type": "http.response.body", "body": body, "more_body": False})
+
+
+def close_idempotency_store() -> None:
+    if idempotency_store is not None:
+        idempotency_store.close()
@@ -0,0 +1,177 @@
+# backend/utils/json_repair.py
+
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+_FENCE = re.compile(r"^\s*```[\w-]*\s*\n?|\n?\s*```\s*$")
+_KEY_AT_END = re.compile(r'"(?:[^"\\]|\\.)*"\s*$')
+_BARE_TOKEN_AT_END = re.compile(r"[A-Za-z0-9.+\-]+$")
+
+# strict=False tolerates raw newlines/tabs inside strings, a common model slip
+_decoder = json.JSONDecoder(strict=False)
+
+
+def strip_fences(text: str) -> str:
+    """
+    Removes markdown code fences and any prose around the JSON object.
+    """
+    text = _FENCE.sub("", (text or "").strip())
+    start = text.find("{")
+    if start == -1:
+        return text.strip()
+    try:
+        _, end = _decoder.raw_decode(text, start)
+    except ValueError:
+        # Malformed or truncated: keep everything from the first "{"
+        return text[start:].strip()
+    return text[start:end]
+
+
+def _scan(text: str) -> Tuple[bool, int, List[str]]:
+    """
+    Returns (inside_string, start_of_open_string, open_bracket_stack).
+    """
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    string_start = -1
+
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+            string_start = i
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]" and stack:
+            stack.pop()
+
+    return in_string, string_start, stack
+
+
+def repair_truncated_json(text: str) -> str:
+    """
+    Makes a truncated JSON document parseable. Unfinished strings, dangling
+    keys, commas and half-written literals are dropped (never completed, so
+    no partial value survives), then open brackets are closed.
+    """
+    in_string, string_start, _ = _scan(text)
+    if in_string:
+        text = text[:string_start]
+
+    while True:
+        text = text.rstrip()
+        _, _, stack = _scan(text)
+        if text.endswith(","):
+            text = text[:-1]
+        elif text.endswith(":"):
+            text = _KEY_AT_END.sub("", text[:-1].rstrip())
+        elif stack and stack[-1] == "{" and _KEY_AT_END.search(text):
+            # A string right after "{" or "," inside an object is a key without value
+            before = _KEY_AT_END.sub("", text).rstrip()
+            if before.endswith(("{", ",")):
+                text = before
+            else:
+                break
+        elif text and _BARE_TOKEN_AT_END.search(text) and not text.endswith(("true", "false", "null")):
+            candidate = _BARE_TOKEN_AT_END.sub("", text)
+            try:
+                float(text[len(candidate):])
+                break  # a complete number
+            except ValueError:
+                text = candidate
+        else:
+            break
+
+    _, _, stack = _scan(text)
+    return text + "".join("}" if b == "{" else "]" for b in reversed(stack))
+
+
+def _members(text: str) -> Tuple[Dict[str, Any], Optional[Tuple[str, str]]]:
+    """
+    Decodes top-level object members one by one. Returns the well-formed
+    members and, if decoding stopped early, (key, remaining value text).
+    """
+    members: Dict[str, Any] = {}
+    pos = text.find("{")
+    if pos == -1:
+        return members, None
+    pos += 1
+
+    while True:
+        while pos < len(text) and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(text) or text[pos] == "}":
+            return members, None
+        if text[pos] != '"':
+            return members, None
+
+        try:
+            key, pos = _decoder.raw_decode(text, pos)
+        except ValueError:
+            return members, None
+        while pos < len(text) and text[pos] in " \t\r\n":
+            pos += 1
+        if pos >= len(text) or text[pos] != ":":
+            return members, None
+        pos += 1
+        while pos < len(text) and text[pos] in " \t\r\n":
+            pos += 1
+
+        try:
+            value, pos = _decoder.raw_decode(text, pos)
+        except ValueError:
+            return members, (key, text[pos:])
+        members[key] = value
+
+
+def salvage_json(text: str) -> Dict[str, Any]:
+    """
+    Best-effort parse of a model's JSON object. Returns
+      {"data": {...}, "complete": [...], "partial": [...], "repaired": bool}
+    where "complete" keys decoded intact and "partial" keys are containers
+    recovered from a truncated tail (some of their entries may be missing).
+    "data" is empty when nothing could be recovered.
+    """
+    cleaned = strip_fences(text)
+
+    try:
+        data = _decoder.decode(cleaned)
+    except ValueError:
+        pass
+    else:
+        if isinstance(data, dict):
+            return {
+                "data": data,
+                "complete": list(data),
+                "partial": [],
+                "repaired": cleaned != text,
+            }
+
+    members, tail = _members(cleaned)
+    partial: List[str] = []
+    if tail is not None:
+        key, rest = tail
+        try:
+            value = _decoder.decode(repair_truncated_json(rest))
+        except ValueError:
+            value = None
+        # A cut-off string is useless; a container may still hold whole entries
+        if isinstance(value, (dict, list)) and value:
+            members[key] = value
+            partial.append(key)
+
+    return {
+        "data": members,
+        "complete": [k for k in members if k not in partial],
+        "partial": partial,
+        "repaired": True,
+    }
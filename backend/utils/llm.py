@@ -0,0 +1,72 @@
+# backend/utils/llm.py
+
+import os
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from openai import AsyncOpenAI
+
+from utils.prompt_cache import record_prompt_cache
+from utils.token_budget import usage_from_completion
+
+_async_client: Optional[AsyncOpenAI] = None
+
+
+def get_async_client() -> AsyncOpenAI:
+    """
+    Shared AsyncOpenAI client, created on first use.
+
+    Async calls can be cancelled mid-flight (the HTTP request is aborted),
+    which is what lets a disconnected client stop paying for tokens.
+    INFRASCRIBE_LLM_BACKEND=stub swaps in the offline stub (utils/llm_stub.py).
+    """
+    global _async_client
+    if _async_client is None:
+        if os.getenv("INFRASCRIBE_LLM_BACKEND", "openai").lower() == "stub":
+            from utils.llm_stub import StubAsyncClient
+
+            _async_client = StubAsyncClient()
+        else:
+            _async_client = AsyncOpenAI()
+    return _async_client
+
+
+async def stream_chat_completion(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    usage: Optional[Dict[str, int]] = None,
+    operation: Optional[str] = None,
+    prefix: str = "",
+    on_usage: Optional[Callable[[Any], None]] = None,
+) -> AsyncIterator[str]:
+    """
+    Streams a chat completion, yielding text deltas as they arrive.
+    Provider-reported token usage (sent in the last chunk) is added to `usage`,
+    passed to `on_usage` and, with an `operation`, recorded as prompt-cache
+    stats for `prefix`.
+    """
+    stream = await get_async_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                if usage is not None:
+                    usage_from_completion(chunk, usage)
+                if operation:
+                    record_prompt_cache(operation, chunk.usage, prefix)
+                if on_usage is not None:
+                    on_usage(chunk.usage)
+            if chunk.choices:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+    finally:
+        # Closing early (client left) aborts the HTTP stream, so we stop paying
+        close = getattr(stream, "close", None)
+        if close is not None:
+            await close()
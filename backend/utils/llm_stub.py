@@ -0,0 +1,103 @@
+# backend/utils/llm_stub.py
+"""
+Local stand-in for the OpenAI client (INFRASCRIBE_LLM_BACKEND=stub).
+
+Deterministic, offline and free, so routing, escalation, streaming and
+salvage can be exercised without an API key:
+
+    INFRASCRIBE_STUB_LATENCY_MS=200          # delay per call
+    INFRASCRIBE_STUB_BAD_MODELS=gpt-4o-mini  # these return invalid output
+    INFRASCRIBE_STUB_FAIL_MODELS=gpt-4.1     # these raise
+"""
+
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+
+def _models(name: str) -> List[str]:
+    return [m.strip() for m in os.getenv(name, "").split(",") if m.strip()]
+
+
+def _usage(prompt: str, output: str) -> SimpleNamespace:
+    prompt_tokens = (len(prompt) + 3) // 4
+    completion_tokens = (len(output) + 3) // 4
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+        input_tokens=prompt_tokens,
+        output_tokens=completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+    )
+
+
+async def _before_call(model: str) -> bool:
+    """
+    Applies latency / failure settings; returns True if output should be bad.
+    """
+    latency_ms = float(os.getenv("INFRASCRIBE_STUB_LATENCY_MS", "0"))
+    if latency_ms > 0:
+        await asyncio.sleep(latency_ms / 1000)
+    if model in _models("INFRASCRIBE_STUB_FAIL_MODELS"):
+        raise RuntimeError(f"stub: {model} is configured to fail")
+    return model in _models("INFRASCRIBE_STUB_BAD_MODELS")
+
+
+class _StubStream:
+    def __init__(self, text: str, usage: SimpleNamespace):
+        self.text = text
+        self.usage = usage
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for word in self.text.split(" "):
+            delta = SimpleNamespace(content=word + " ")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        yield SimpleNamespace(choices=[], usage=self.usage)
+
+    async def close(self) -> None:
+        return None
+
+
+class _StubChatCompletions:
+    async def create(
+        self, model: str, messages: List[Dict[str, str]], stream: bool = False, **_: Any
+    ):
+        bad = await _before_call(model)
+        prompt = "\n".join(m.get("content", "") for m in messages)
+        text = "" if bad else f"Stub answer from {model}."
+        usage = _usage(prompt, text)
+        if stream:
+            return _StubStream(text, usage)
+        message = SimpleNamespace(content=text)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+class _StubResponses:
+    async def create(self, model: str, input: str, **_: Any):
+        bad = await _before_call(model)
+        bundle = {
+            "dockerfile": f"# stub bundle from {model}\nFROM scratch\n",
+            "cicd": None,
+            "k8s": None,
+            "helm": None,
+            "argocd": None,
+            "monitoring": None,
+            "terraform": None,
+            "readme_md": f"# Stub bundle\n\nGenerated locally by the {model} stub.\n",
+        }
+        text = json.dumps(bundle, indent=2)
+        if bad:
+            text = "```json\n" + text[: len(text) // 2]  # fenced and truncated
+        return SimpleNamespace(output_text=text, usage=_usage(input, text))
+
+
+class StubAsyncClient:
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=_StubChatCompletions())
+        self.responses = _StubResponses()
@@ -0,0 +1,45 @@
+# backend/utils/metrics.py
+
+import threading
+from typing import Any, Dict
+
+
+class Metrics:
+    """
+    Minimal in-process metrics registry: monotonic counters plus
+    count/sum/max timings. Served as JSON on GET /metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._timings: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            stats = self._timings.get(name)
+            if stats is None:
+                self._timings[name] = {"count": 1, "sum": value, "max": value}
+            else:
+                stats["count"] += 1
+                stats["sum"] += value
+                stats["max"] = max(stats["max"], value)
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            timings = {
+                name: {**stats, "avg": stats["sum"] / stats["count"]}
+                for name, stats in self._timings.items()
+            }
+            return {"counters": dict(sorted(self._counters.items())), "timings": timings}
+
+
+metrics = Metrics()
@@ -0,0 +1,114 @@
+# backend/utils/patching.py
+
+import re
+from typing import List, Optional, Tuple
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+FENCE = re.compile(r"^```[\w-]*\s*$")
+
+
+class PatchError(ValueError):
+    """
+    The diff could not be parsed or does not match the original content.
+    """
+
+
+def _strip_fences(diff: str) -> List[str]:
+    lines = diff.replace("\r\n", "\n").split("\n")
+    return [line for line in lines if not FENCE.match(line.strip())]
+
+
+def _parse_hunks(diff: str) -> List[Tuple[int, List[str], List[str]]]:
+    """
+    Returns [(hinted old start (0-based), old lines, new lines), ...].
+    File headers (---/+++) and "\\ No newline" markers are ignored.
+    """
+    hunks = []
+    current: Optional[Tuple[int, List[str], List[str]]] = None
+
+    for line in _strip_fences(diff):
+        header = HUNK_HEADER.match(line)
+        if header:
+            current = (max(0, int(header.group(1)) - 1), [], [])
+            hunks.append(current)
+            continue
+        if current is None or line.startswith(("--- ", "+++ ", "\\")):
+            continue
+
+        _, old, new = current
+        if line.startswith("-"):
+            old.append(line[1:])
+        elif line.startswith("+"):
+            new.append(line[1:])
+        elif line.startswith(" "):
+            old.append(line[1:])
+            new.append(line[1:])
+        elif line == "":
+            # Blank context line whose leading space was trimmed by the model
+            old.append("")
+            new.append("")
+        else:
+            raise PatchError(f"Unexpected line in hunk: {line[:60]!r}")
+
+    if not hunks:
+        raise PatchError("No hunks found in diff")
+    return hunks
+
+
+def _find(lines: List[str], needle: List[str], hint: int, start: int) -> int:
+    """
+    Locates `needle` at or after `start`, preferring positions closest to
+    `hint`. Model-written line numbers are often off; context is trusted.
+    """
+    if not needle:
+        return max(start, min(hint, len(lines)))
+
+    last = len(lines) - len(needle)
+    candidates = [
+        i for i in range(start, last + 1)
+        if lines[i] == needle[0] and lines[i:i + len(needle)] == needle
+    ]
+    if not candidates:
+        # Tolerate trailing-whitespace drift in context lines
+        stripped = [n.rstrip() for n in needle]
+        candidates = [
+            i for i in range(start, last + 1)
+            if [l.rstrip() for l in lines[i:i + len(needle)]] == stripped
+        ]
+    if not candidates:
+        raise PatchError("Hunk context not found in original content")
+    return min(candidates, key=lambda i: abs(i - hint))
+
+
+def apply_unified_diff(original: str, diff: str) -> str:
+    """
+    Applies a unified diff to `original` and returns the patched text.
+    Raises PatchError if any hunk does not apply cleanly.
+    """
+    hunks = _parse_hunks(diff)
+    had_trailing_newline = original.endswith("\n")
+    lines = original.replace("\r\n", "\n").split("\n")
+    if had_trailing_newline:
+        lines = lines[:-1]
+
+    # Trailing blank "context" lines are often artefacts of the diff's final newline
+    cleaned = []
+    for hint, old, new in hunks:
+        while old and new and old[-1] == "" and new[-1] == "":
+            old.pop()
+            new.pop()
+        cleaned.append((hint, old, new))
+
+    result: List[str] = []
+    cursor = 0
+    for hint, old, new in cleaned:
+        pos = _find(lines, old, hint, cursor)
+        result.extend(lines[cursor:pos])
+        result.extend(new)
+        cursor = pos + len(old)
+    result.extend(lines[cursor:])
+
+    patched = "\n".join(result)
+    if had_trailing_newline:
+        patched += "\n"
+    return patched
@@ -0,0 +1,74 @@
+# backend/utils/prompt_cache.py
+
+import hashlib
+import os
+from functools import lru_cache
+from typing import Any, Optional
+
+from utils.logger import get_logger
+from utils.metrics import metrics
+
+logger = get_logger(__name__)
+
+# Measurement mode: log the cached-token ratio of every model call
+PROMPT_CACHE_STATS = os.getenv("INFRASCRIBE_PROMPT_CACHE_STATS", "").lower() in ("1", "true", "yes")
+
+
+@lru_cache(maxsize=32)
+def prefix_id(prefix: str) -> str:
+    """
+    Short fingerprint of a static prompt prefix. Identical across calls and
+    processes as long as the prefix is byte-identical (which provider-side
+    prompt caching requires).
+    """
+    return hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:12]
+
+
+def cached_tokens(usage: Any) -> Optional[int]:
+    """
+    Cached prompt tokens from a usage object: chat completions report them in
+    prompt_tokens_details, the Responses API in input_tokens_details.
+    """
+    for field in ("prompt_tokens_details", "input_tokens_details"):
+        details = getattr(usage, field, None)
+        value = getattr(details, "cached_tokens", None) if details is not None else None
+        if value is not None:
+            return value
+    return None
+
+
+def record_prompt_cache(operation: str, usage: Any, prefix: str) -> Optional[float]:
+    """
+    Records prompt/cached token counts for one call under prompt_cache.<operation>.*
+    and returns the cached ratio (None when the provider reported no usage).
+    """
+    if usage is None:
+        return None
+
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    if prompt_tokens is None:
+        prompt_tokens = getattr(usage, "input_tokens", None)
+    if not prompt_tokens:
+        return None
+
+    cached = cached_tokens(usage) or 0
+    ratio = cached / prompt_tokens
+
+    metrics.incr(f"prompt_cache.{operation}.calls")
+    metrics.incr(f"prompt_cache.{operation}.prompt_tokens", prompt_tokens)
+    metrics.incr(f"prompt_cache.{operation}.cached_tokens", cached)
+    metrics.observe(f"prompt_cache.{operation}.ratio", ratio)
+
+    if PROMPT_CACHE_STATS:
+        logger.info(
+            f"Prompt cache {operation}: {cached}/{prompt_tokens} prompt tokens cached "
+            f"({ratio:.0%}), prefix {prefix_id(prefix)}",
+            extra={
+                "operation": operation,
+                "prefix": prefix_id(prefix),
+                "prompt_tokens": prompt_tokens,
+                "cached_tokens": cached,
+                "ratio": round(ratio, 3),
+            },
+        )
+    return ratio
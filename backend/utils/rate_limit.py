@@ -0,0 +1,361 @@
+# backend/utils/rate_limit.py
+
+import asyncio
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from utils.logger import get_logger
+from utils.metrics import metrics
+from utils.storage import connect_sqlite, data_path
+
+logger = get_logger(__name__)
+
+RATE_LIMIT_BACKEND = os.getenv("INFRASCRIBE_RATE_LIMIT_BACKEND", "memory")  # "memory" | "sqlite" | "off"
+# "<count>/<second|minute|hour|day>" or "<count>/<seconds>s"; "0" disables a budget
+RATE_LIMIT_AI = os.getenv("INFRASCRIBE_RATE_LIMIT_AI", "20/minute")
+RATE_LIMIT_RULE_BASED = os.getenv("INFRASCRIBE_RATE_LIMIT_RULE_BASED", "120/minute")
+RATE_LIMIT_DB = os.getenv("INFRASCRIBE_RATE_LIMIT_DB") or None
+# Clients tracked by the memory backend; the least recently seen are dropped
+RATE_LIMIT_MAX_KEYS = int(os.getenv("INFRASCRIBE_RATE_LIMIT_MAX_KEYS", "100000"))
+# Key guests by the first X-Forwarded-For hop (only behind a trusted proxy)
+TRUST_FORWARDED_FOR = os.getenv("INFRASCRIBE_RATE_LIMIT_TRUST_FORWARDED", "").lower() in ("1", "true", "yes")
+
+# Where the decision for the current request is kept for the header middleware
+SCOPE_KEY = "infrascribe.rate_limit"
+# Exposed to browsers via CORS
+RATE_LIMIT_HEADER_NAMES = [
+    "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy", "Retry-After",
+]
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+_LIMIT_SPEC = re.compile(r"^\s*(\d+)\s*/\s*(?:(\d+(?:\.\d+)?)s|(second|minute|hour|day)s?)\s*$")
+
+
+class RateLimit:
+    """
+    `count` requests per `period` seconds, enforced as GCRA (the
+    token-bucket equivalent that stores one timestamp per client): a full
+    budget may be spent in a burst, after which one request frees up every
+    period / count seconds.
+    """
+
+    def __init__(self, count: int, period: float):
+        if count <= 0 or period <= 0:
+            raise ValueError("Rate limit count and period must be positive")
+        self.count = count
+        self.period = float(period)
+        self.interval = self.period / count
+
+    @property
+    def policy(self) -> str:
+        return f"{self.count};w={int(self.period)}"
+
+
+def parse_limit(spec: Optional[str]) -> Optional[RateLimit]:
+    """
+    "20/minute" -> RateLimit(20, 60); empty, "0" or "off" -> None.
+    """
+    if not spec or spec.strip().lower() in ("0", "off", "none"):
+        return None
+    match = _LIMIT_SPEC.match(spec.lower())
+    if match is None:
+        raise ValueError(f"Invalid rate limit: {spec!r}")
+    count, seconds, unit = match.groups()
+    period = float(seconds) if seconds else _PERIODS[unit]
+    if int(count) == 0:
+        return None
+    return RateLimit(int(count), period)
+
+
+def _gcra(
+    tat: Optional[float], limit: RateLimit, cost: int, now: float
+) -> Tuple[Optional[float], Dict[str, Any]]:
+    """
+    One GCRA step. `tat` is the client's theoretical arrival time (when its
+    budget is full again). Returns the new tat (None if rejected, nothing to
+    store) and the decision: {"allowed", "limit", "remaining", "reset",
+    "retry_after", "policy"}.
+    """
+    tat = now if tat is None or tat < now else tat
+    new_tat = tat + limit.interval * cost
+    allow_at = new_tat - limit.period
+
+    decision = {"limit": limit.count, "policy": limit.policy}
+    # The epsilon keeps float rounding from rejecting the last request of a burst
+    if allow_at > now + 1e-9:
+        decision.update(
+            allowed=False,
+            remaining=max(0, int((now - (tat - limit.period)) / limit.interval + 1e-9)),
+            reset=tat - now,
+            retry_after=allow_at - now,
+        )
+        return None, decision
+
+    decision.update(
+        allowed=True,
+        remaining=max(0, int((now - allow_at) / limit.interval + 1e-9)),
+        reset=new_tat - now,
+        retry_after=0.0,
+    )
+    return new_tat, decision
+
+
+class MemoryRateLimitStore:
+    """
+    Per-process store: one float per client, O(1) per check. Each uvicorn
+    worker enforces its own budget, so with N workers a client can get up
+    to N times the limit; use the SQLite store to share budgets on a host.
+    """
+
+    blocking = False
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max(1, max_keys)
+        self._lock = threading.Lock()
+        self._tats: "OrderedDict[str, float]" = OrderedDict()
+
+    def hit(self, key: str, limit: RateLimit, cost: int, now: float) -> Dict[str, Any]:
+        with self._lock:
+            new_tat, decision = _gcra(self._tats.get(key), limit, cost, now)
+            if new_tat is not None:
+                self._tats[key] = new_tat
+                self._tats.move_to_end(key)
+                while len(self._tats) > self.max_keys:
+                    # Least recently seen client; losing its state only ever loosens its limit
+                    self._tats.popitem(last=False)
+        return decision
+
+    def close(self) -> None:
+        pass
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key  TEXT PRIMARY KEY,
+    tat  REAL NOT NULL
+) WITHOUT ROWID;
+"""
+_SELECT_TAT = "SELECT tat FROM rate_limits WHERE key = ?"
+_UPSERT_TAT = (
+    "INSERT INTO rate_limits (key, tat) VALUES (?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET tat = excluded.tat"
+)
+_PRUNE = "DELETE FROM rate_limits WHERE tat < ?"
+
+
+class SQLiteRateLimitStore:
+    """
+    Host-wide store shared by all uvicorn workers: one row per client,
+    read and updated inside a BEGIN IMMEDIATE transaction so concurrent
+    workers never both spend the last unit of a budget. Rows whose budget
+    is full again carry no information and are pruned periodically.
+    """
+
+    blocking = True
+    PRUNE_EVERY = 1000
+
+    def __init__(self, db_path: Optional[str] = RATE_LIMIT_DB):
+        self.db_path = db_path or str(data_path("rate_limits.sqlite3"))
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._hits = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect_sqlite(self.db_path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def hit(self, key: str, limit: RateLimit, cost: int, now: float) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(_SELECT_TAT, (key,)).fetchone()
+                new_tat, decision = _gcra(row["tat"] if row else None, limit, cost, now)
+                if new_tat is not None:
+                    conn.execute(_UPSERT_TAT, (key, new_tat))
+                self._hits += 1
+                if self._hits % self.PRUNE_EVERY == 0:
+                    conn.execute(_PRUNE, (now,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return decision
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class RateLimiter:
+    """
+    Named budgets ("ai", "rule_based") over one store. Clients are keyed
+    by verified identity when there is one (request.state.user, set by
+    auth.dependencies.authenticate_request) and by client IP otherwise.
+    """
+
+    def __init__(self, limits: Dict[str, Optional[RateLimit]], store):
+        self.limits = limits
+        self.store = store
+
+    async def hit(self, key: str, bucket: str, cost: int = 1) -> Optional[Dict[str, Any]]:
+        """
+        Spends `cost` units of `bucket` for `key`. None when the bucket is
+        unlimited or the store failed (rate limiting fails open).
+        """
+        limit = self.limits.get(bucket)
+        if limit is None or self.store is None:
+            return None
+        # A request bigger than the whole budget still goes through once it is full
+        cost = max(1, min(cost, limit.count))
+        scoped_key = f"{bucket}:{key}"
+
+        started = time.perf_counter()
+        try:
+            if self.store.blocking:
+                decision = await asyncio.to_thread(
+                    self.store.hit, scoped_key, limit, cost, time.time()
+                )
+            else:
+                decision = self.store.hit(scoped_key, limit, cost, time.time())
+        except sqlite3.Error as e:
+            metrics.incr("rate_limit.errors")
+            logger.warning(f"Rate limit check failed, allowing request: {e}")
+            return None
+        finally:
+            metrics.observe("rate_limit.check_seconds", time.perf_counter() - started)
+
+        metrics.incr(f"rate_limit.{'allowed' if decision['allowed'] else 'rejected'}.{bucket}")
+        return decision
+
+    def close(self) -> None:
+        if self.store is not None:
+            self.store.close()
+
+
+def _build_limiter() -> RateLimiter:
+    limits = {
+        "ai": parse_limit(RATE_LIMIT_AI),
+        "rule_based": parse_limit(RATE_LIMIT_RULE_BASED),
+    }
+    backend = RATE_LIMIT_BACKEND.lower()
+    if backend == "off":
+        store = None
+    elif backend == "sqlite":
+        store = SQLiteRateLimitStore()
+    else:
+        store = MemoryRateLimitStore()
+    return RateLimiter(limits, store)
+
+
+rate_limiter = _build_limiter()
+
+
+def client_key(request: Request) -> str:
+    """
+    "user:<provider>:<sub>" for authenticated callers, "ip:<address>" for guests.
+    """
+    user = getattr(request.state, "user", None)
+    if user and user.get("sub"):
+        return f"user:{user.get('provider')}:{user['sub']}"
+
+    address = None
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            address = forwarded.split(",")[0].strip()
+    if not address and request.client is not None:
+        address = request.client.host
+    return f"ip:{address or 'unknown'}"
+
+
+def rate_limit_headers(decision: Dict[str, Any]) -> Dict[str, str]:
+    """
+    RateLimit-* response headers (IETF draft), plus Retry-After when rejected.
+    """
+    headers = {
+        "RateLimit-Limit": str(decision["limit"]),
+        "RateLimit-Remaining": str(decision["remaining"]),
+        "RateLimit-Reset": str(math.ceil(decision["reset"])),
+        "RateLimit-Policy": decision["policy"],
+    }
+    if not decision["allowed"]:
+        headers["Retry-After"] = str(max(1, math.ceil(decision["retry_after"])))
+    return headers
+
+
+async def enforce_rate_limit(request: Request, bucket: str, cost: int = 1) -> None:
+    """
+    Charges the caller's `bucket` budget; raises 429 with Retry-After once
+    it is spent. The decision is kept on the request so that
+    RateLimitHeadersMiddleware can add RateLimit-* headers to any response,
+    streaming ones included.
+    """
+    decision = await rate_limiter.hit(client_key(request), bucket, cost)
+    if decision is None:
+        return
+    request.scope[SCOPE_KEY] = decision
+    if not decision["allowed"]:
+        logger.info(
+            "Rate limit exceeded",
+            extra={"bucket": bucket, "retry_after": round(decision["retry_after"], 2)},
+        )
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded for {bucket} requests; retry in "
+            f"{max(1, math.ceil(decision['retry_after']))}s",
+            headers=rate_limit_headers(decision),
+        )
+
+
+def rate_limited(bucket: str, cost: int = 1):
+    """
+    Route dependency: `dependencies=[Depends(rate_limited("ai"))]`.
+    """
+
+    async def dependency(request: Request) -> None:
+        await enforce_rate_limit(request, bucket, cost)
+
+    return dependency
+
+
+class RateLimitHeadersMiddleware:
+    """
+    ASGI middleware adding the current request's RateLimit-* headers to
+    its response. Pure ASGI rather than BaseHTTPMiddleware so streamed
+    bodies (SSE, ZIPs) pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            decision = scope.get(SCOPE_KEY)
+            if message["type"] == "http.response.start" and decision is not None:
+                present = {name.lower() for name, _ in message.get("headers", [])}
+                extra: List[Tuple[bytes, bytes]] = [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in rate_limit_headers(decision).items()
+                    if name.lower().encode("latin-1") not in present
+                ]
+                message = {**message, "headers": list(message.get("headers", [])) + extra}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
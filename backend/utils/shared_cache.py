@@ -0,0 +1,453 @@
+# backend/utils/shared_cache.py
+
+import asyncio
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from utils.logger import get_logger
+from utils.metrics import metrics
+from utils.storage import connect_sqlite, data_path
+
+logger = get_logger(__name__)
+
+# "memory" (per worker) | "sqlite" (one file per host, all workers) |
+# "redis" (any RESP server: Redis, Valkey, or `python cli.py cache-server`) | "off"
+CACHE_BACKEND = os.getenv("INFRASCRIBE_CACHE_BACKEND", "memory")
+CACHE_URL = os.getenv("INFRASCRIBE_CACHE_URL", "redis://127.0.0.1:6380/0")
+CACHE_DB = os.getenv("INFRASCRIBE_CACHE_DB") or None
+# Size cap of the memory and SQLite backends (RESP servers enforce their own)
+CACHE_MAX_BYTES = int(os.getenv("INFRASCRIBE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+CACHE_DEFAULT_TTL_SECONDS = int(os.getenv("INFRASCRIBE_CACHE_TTL_SECONDS", "86400"))
+CACHE_TIMEOUT_SECONDS = float(os.getenv("INFRASCRIBE_CACHE_TIMEOUT_SECONDS", "0.5"))
+CACHE_POOL_SIZE = int(os.getenv("INFRASCRIBE_CACHE_POOL_SIZE", "8"))
+
+# ---------------------- Serialization ---------------------- #
+#
+# Every backend stores the same bytes: MAGIC, one flags byte, then the body.
+# JSON (never pickle: a shared tier must not execute what it reads) or raw
+# bytes, zlib-compressed above COMPRESS_MIN_BYTES. Keys are namespaced and
+# versioned so a format change never reads old entries.
+
+MAGIC = b"IS1"
+FLAG_RAW = 0x01
+FLAG_ZLIB = 0x02
+COMPRESS_MIN_BYTES = 1024
+KEY_PREFIX = "infrascribe:v1"
+
+
+class CacheBackendError(Exception):
+    """
+    The cache backend could not be reached or answered with an error.
+    """
+
+
+def encode_value(value: Any) -> bytes:
+    if isinstance(value, (bytes, bytearray)):
+        flags, body = FLAG_RAW, bytes(value)
+    else:
+        flags, body = 0, json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if len(body) >= COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(body, 1)
+        if len(compressed) < len(body):
+            flags, body = flags | FLAG_ZLIB, compressed
+    return MAGIC + bytes([flags]) + body
+
+
+def decode_value(data: bytes) -> Any:
+    if data[:3] != MAGIC or len(data) < 4:
+        raise ValueError("Not a cache entry")
+    flags, body = data[3], data[4:]
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+    if flags & FLAG_RAW:
+        return body
+    return json.loads(body)
+
+
+def cache_key(namespace: str, key: str) -> str:
+    return f"{KEY_PREFIX}:{namespace}:{key}"
+
+
+# ---------------------- Backends ---------------------- #
+# get/set/delete/clear on encoded bytes; `blocking` backends run off the loop.
+
+class MemoryCacheBackend:
+    """
+    Per-process LRU bounded by total bytes. Every worker has its own copy,
+    which is what the shared backends avoid; also the store behind the
+    stand-in RESP server (utils/cache_server.py).
+    """
+
+    name = "memory"
+    blocking = False
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max(1, max_bytes)
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] and time.time() >= entry[0]:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _drop(self, key: str) -> None:
+        _, value = self._entries.pop(key)
+        self._bytes -= len(key) + len(value)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float]) -> None:
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.time() + ttl if ttl else 0.0, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._drop(key)
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self) -> None:
+        pass
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key         TEXT PRIMARY KEY,
+    value       BLOB NOT NULL,
+    size        INTEGER NOT NULL,
+    expires_at  REAL NOT NULL,
+    stored_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cache_stored ON cache_entries(stored_at);
+"""
+_SELECT = "SELECT value, expires_at FROM cache_entries WHERE key = ?"
+_UPSERT = (
+    "INSERT INTO cache_entries (key, value, size, expires_at, stored_at) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+    "expires_at = excluded.expires_at, stored_at = excluded.stored_at"
+)
+_DELETE = "DELETE FROM cache_entries WHERE key = ?"
+_DELETE_EXPIRED = "DELETE FROM cache_entries WHERE expires_at > 0 AND expires_at < ?"
+_TOTAL_SIZE = "SELECT COALESCE(SUM(size), 0) AS bytes FROM cache_entries"
+# Oldest writes go first once over the cap (FIFO: reads never write)
+_EVICT_OLDEST = (
+    "DELETE FROM cache_entries WHERE key IN "
+    "(SELECT key FROM cache_entries ORDER BY stored_at LIMIT ?)"
+)
+
+
+class SQLiteCacheBackend:
+    """
+    Host-wide cache in one SQLite file shared by every worker: WAL so
+    readers never block the writer, and the file memory-mapped (mmap_size)
+    so hot reads are served from the page cache without read() copies.
+    One connection per thread; the cap is enforced every EVICT_EVERY writes.
+    """
+
+    name = "sqlite"
+    blocking = True
+    EVICT_EVERY = 256
+
+    def __init__(self, db_path: Optional[str] = CACHE_DB, max_bytes: int = CACHE_MAX_BYTES):
+        self.db_path = db_path or str(data_path("cache.sqlite3"))
+        self.max_bytes = max(1, max_bytes)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.db_path, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={self.max_bytes * 2}")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._connection().execute(_SELECT, (key,)).fetchone()
+        if row is None or (row["expires_at"] and time.time() >= row["expires_at"]):
+            return None
+        return bytes(row["value"])
+
+    def set(self, key: str, value: bytes, ttl: Optional[float]) -> None:
+        now = time.time()
+        conn = self._connection()
+        conn.execute(_UPSERT, (key, value, len(key) + len(value), now + ttl if ttl else 0.0, now))
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.EVICT_EVERY == 0
+        if evict:
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(_DELETE_EXPIRED, (now,))
+        total = conn.execute(_TOTAL_SIZE).fetchone()["bytes"]
+        if total > self.max_bytes:
+            count = conn.execute("SELECT COUNT(*) AS n FROM cache_entries").fetchone()["n"]
+            # Drop the oldest share of entries proportional to the overshoot (+10%)
+            share = min(1.0, (total - self.max_bytes) / total + 0.1)
+            conn.execute(_EVICT_OLDEST, (max(1, int(count * share)),))
+
+    def delete(self, key: str) -> bool:
+        return self._connection().execute(_DELETE, (key,)).rowcount > 0
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM cache_entries")
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def _resp_command(*args: Any) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def _resp_read(reader) -> Any:
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise CacheBackendError("Connection closed by cache server")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode("utf-8")
+    if kind == b"-":
+        raise CacheBackendError(body.decode("utf-8", "replace"))
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        if len(data) != length + 2:
+            raise CacheBackendError("Connection closed by cache server")
+        return data[:-2]
+    if kind == b"*":
+        length = int(body)
+        return None if length < 0 else [_resp_read(reader) for _ in range(length)]
+    raise CacheBackendError(f"Unexpected reply from cache server: {line[:32]!r}")
+
+
+class RedisCacheBackend:
+    """
+    Client for any Redis-protocol (RESP2) server, so several hosts can
+    share one cache: Redis/Valkey in production, or the stand-in daemon
+    (`python cli.py cache-server`) on a single host without installing
+    anything. Speaks the handful of commands needed over a small pool of
+    blocking sockets; no client library required.
+    """
+
+    name = "redis"
+    blocking = True
+    RETRY_SECONDS = 5.0
+
+    def __init__(
+        self,
+        url: str = CACHE_URL,
+        timeout: float = CACHE_TIMEOUT_SECONDS,
+        pool_size: int = CACHE_POOL_SIZE,
+    ):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("redis", "tcp"):
+            raise ValueError(f"Unsupported cache URL: {url}")
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.timeout = timeout
+        self._down_until = 0.0
+        self._pool: "queue.LifoQueue[Tuple[socket.socket, Any]]" = queue.LifoQueue(maxsize=max(1, pool_size))
+
+    def _connect(self) -> Tuple[socket.socket, Any]:
+        # After a failed connect, skip the server for a while instead of
+        # making every request wait for its own connect timeout
+        if time.monotonic() < self._down_until:
+            raise CacheBackendError(f"Cache server {self.host}:{self.port} unavailable")
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError as e:
+            self._down_until = time.monotonic() + self.RETRY_SECONDS
+            raise CacheBackendError(f"Cannot reach cache server {self.host}:{self.port}: {e}")
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile("rb"))
+        if self.password:
+            self._send(conn, "AUTH", self.password)
+        if self.db:
+            self._send(conn, "SELECT", self.db)
+        return conn
+
+    @staticmethod
+    def _send(conn: Tuple[socket.socket, Any], *args: Any) -> Any:
+        sock, reader = conn
+        sock.sendall(_resp_command(*args))
+        return _resp_read(reader)
+
+    @contextmanager
+    def _connection(self) -> Iterator[Tuple[socket.socket, Any]]:
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        except (OSError, CacheBackendError, ValueError):
+            # Half-read replies would desynchronise the stream: never reuse
+            conn[0].close()
+            raise
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn[0].close()
+
+    def command(self, *args: Any) -> Any:
+        try:
+            with self._connection() as conn:
+                return self._send(conn, *args)
+        except OSError as e:
+            raise CacheBackendError(str(e))
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.command("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float]) -> None:
+        if ttl:
+            self.command("SET", key, value, "PX", int(ttl * 1000))
+        else:
+            self.command("SET", key, value)
+
+    def delete(self, key: str) -> bool:
+        return bool(self.command("DEL", key))
+
+    def clear(self) -> None:
+        self.command("FLUSHDB")
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._pool.get_nowait()[0].close()
+            except queue.Empty:
+                break
+
+
+def create_backend(name: str = CACHE_BACKEND):
+    name = (name or "memory").lower()
+    if name == "off":
+        return None
+    if name == "sqlite":
+        return SQLiteCacheBackend()
+    if name == "redis":
+        return RedisCacheBackend()
+    if name != "memory":
+        logger.warning(f"Unknown cache backend {name!r}, using memory")
+    return MemoryCacheBackend()
+
+
+# ---------------------- Facade ---------------------- #
+
+class SharedCache:
+    """
+    Namespaced get/set of JSON values or bytes over the configured backend.
+    Backend failures count as misses (and skipped writes): the cache may
+    make a request faster, never fail it.
+    """
+
+    def __init__(self, backend=None, default_ttl: int = CACHE_DEFAULT_TTL_SECONDS):
+        self.backend = backend
+        self.default_ttl = default_ttl
+
+    async def _call(self, method: str, *args: Any) -> Any:
+        fn = getattr(self.backend, method)
+        if self.backend.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def get(self, namespace: str, key: str) -> Any:
+        if self.backend is None:
+            return None
+        started = time.perf_counter()
+        try:
+            data = await self._call("get", cache_key(namespace, key))
+            value = decode_value(data) if data is not None else None
+        except (CacheBackendError, OSError, sqlite3.Error, ValueError) as e:
+            metrics.incr("cache.errors")
+            logger.warning(f"Cache get failed ({self.backend.name}): {e}")
+            value = None
+        finally:
+            metrics.observe(f"cache.get_seconds.{self.backend.name}", time.perf_counter() - started)
+        metrics.incr(f"cache.{namespace}.{'hits' if value is not None else 'misses'}")
+        return value
+
+    async def set(self, namespace: str, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        if self.backend is None or value is None:
+            return
+        started = time.perf_counter()
+        try:
+            await self._call(
+                "set", cache_key(namespace, key), encode_value(value),
+                self.default_ttl if ttl is None else ttl,
+            )
+        except (CacheBackendError, OSError, sqlite3.Error, TypeError, ValueError) as e:
+            metrics.incr("cache.errors")
+            logger.warning(f"Cache set failed ({self.backend.name}): {e}")
+        finally:
+            metrics.observe(f"cache.set_seconds.{self.backend.name}", time.perf_counter() - started)
+
+    async def delete(self, namespace: str, key: str) -> None:
+        if self.backend is None:
+            return
+        try:
+            await self._call("delete", cache_key(namespace, key))
+        except (CacheBackendError, OSError, sqlite3.Error) as e:
+            logger.warning(f"Cache delete failed ({self.backend.name}): {e}")
+
+    def close(self) -> None:
+        if self.backend is not None:
+            self.backend.close()
+
+
+shared_cache = SharedCache(create_backend())
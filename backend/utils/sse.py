@@ -0,0 +1,71 @@
+# backend/utils/sse.py
+
+import asyncio
+import contextlib
+import json
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # disable proxy buffering (nginx)
+}
+
+HEARTBEAT_SECONDS = 15.0
+
+
+def format_sse(event: str, data: Any) -> str:
+    """
+    Encode one Server-Sent Event. `data` is JSON-encoded unless already a string.
+    """
+    payload = data if isinstance(data, str) else json.dumps(data, default=str)
+    lines = "".join(f"data: {line}\n" for line in payload.splitlines() or [""])
+    return f"event: {event}\n{lines}\n"
+
+
+def heartbeat() -> str:
+    """
+    SSE comment line – keeps idle connections open through proxies.
+    """
+    return ": heartbeat\n\n"
+
+
+async def pump_events(
+    events: AsyncIterator[Dict[str, Any]],
+    deadline: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """
+    Encodes {"event", "data"} dicts as SSE, sending a heartbeat whenever the
+    source is quiet for HEARTBEAT_SECONDS. If the time.monotonic() `deadline`
+    passes first, the source is cancelled and a final "error" event is sent.
+    """
+    iterator = events.__aiter__()
+    next_event = asyncio.ensure_future(iterator.__anext__())
+    try:
+        while True:
+            timeout = HEARTBEAT_SECONDS
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    yield format_sse(
+                        "error", {"reason": "deadline", "detail": "Request deadline exceeded"}
+                    )
+                    return
+                timeout = min(timeout, remaining)
+
+            done, _ = await asyncio.wait({next_event}, timeout=timeout)
+            if not done:
+                if deadline is None or time.monotonic() < deadline:
+                    yield heartbeat()
+                continue
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield format_sse(event["event"], event["data"])
+            next_event = asyncio.ensure_future(iterator.__anext__())
+    finally:
+        next_event.cancel()
+        with contextlib.suppress(asyncio.CancelledError, StopAsyncIteration, Exception):
+            await next_event
+        await iterator.aclose()
@@ -0,0 +1,36 @@
+# backend/utils/storage.py
+
+import os
+import sqlite3
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent  # backend/
+
+# Local state (job queue, stores, ledgers). Override per deployment.
+DATA_DIR = Path(os.getenv("INFRASCRIBE_DATA_DIR", str(BASE_DIR / "var")))
+
+
+def data_path(filename: str) -> Path:
+    """
+    Path of a file inside DATA_DIR, creating the directory on first use.
+    """
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    return DATA_DIR / filename
+
+
+def connect_sqlite(path: Path, check_same_thread: bool = False) -> sqlite3.Connection:
+    """
+    Opens an SQLite connection tuned for many readers + one writer across
+    uvicorn worker processes (WAL, relaxed fsync, busy timeout).
+    """
+    conn = sqlite3.connect(
+        str(path),
+        timeout=10.0,
+        check_same_thread=check_same_thread,
+        isolation_level=None,  # autocommit; use explicit BEGIN for batches
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=10000")
+    return conn
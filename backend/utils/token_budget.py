@@ -0,0 +1,228 @@
+# backend/utils/token_budget.py
+
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Iterator, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # in requirements.txt; the character estimate is only a fallback
+    tiktoken = None
+
+from utils.logger import get_logger
+from utils.prompt_cache import cached_tokens
+
+logger = get_logger(__name__)
+
+# Per-call prompt budget for explain; larger files are chunked (map-reduce)
+EXPLAIN_MAX_INPUT_TOKENS = int(os.getenv("INFRASCRIBE_EXPLAIN_MAX_INPUT_TOKENS", "12000"))
+# Refine must see the whole file at once; beyond this the request is rejected
+REFINE_MAX_INPUT_TOKENS = int(os.getenv("INFRASCRIBE_REFINE_MAX_INPUT_TOKENS", "30000"))
+# Hard cap on any single file, chunked or not
+MAX_CONTENT_TOKENS = int(os.getenv("INFRASCRIBE_MAX_CONTENT_TOKENS", "200000"))
+MAX_EXPLAIN_CHUNKS = 12
+
+HASH_COMMENT_SUFFIXES = (
+    ".yaml", ".yml", ".tf", ".tfvars", ".toml", ".sh", ".py", ".conf", ".ini",
+)
+HASH_COMMENT_NAMES = ("Dockerfile", "Jenkinsfile", "Makefile", ".gitlab-ci.yml", "Procfile")
+
+
+class TokenBudgetExceeded(ValueError):
+    """
+    Content is larger than any budget we are willing to send to the model.
+    """
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    if tiktoken is None:
+        logger.warning("tiktoken is not installed; token budgets use a ~4 chars/token estimate")
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # Encodings are downloaded on first use; offline hosts need a pre-filled
+        # TIKTOKEN_CACHE_DIR, or fall back to the estimate
+        logger.warning(f"Could not load tiktoken encoding for {model}, estimating tokens: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """
+    Local token count. Exact with tiktoken installed, otherwise ~4 chars/token
+    (slightly pessimistic for config files, which is the safe direction).
+    """
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+# ---------------------- Compaction ---------------------- #
+
+def _is_hash_comment_file(filename: str) -> bool:
+    base = os.path.basename(filename or "")
+    return base in HASH_COMMENT_NAMES or base.lower().endswith(HASH_COMMENT_SUFFIXES)
+
+
+def compact_content(filename: str, content: str, aggressive: bool = False) -> str:
+    """
+    Shrinks content for explanation prompts without changing what it does:
+      - trailing whitespace and runs of blank lines are removed
+      - valid JSON is minified
+      - aggressive: full-line "#" comments are dropped (directives kept)
+
+    Never used for refine, where the user gets the text back verbatim.
+    """
+    text = content.replace("\r\n", "\n")
+
+    if (filename or "").lower().endswith(".json"):
+        try:
+            return json.dumps(json.loads(text), separators=(",", ":"), ensure_ascii=False)
+        except ValueError:
+            pass
+
+    lines = [line.rstrip() for line in text.split("\n")]
+
+    if aggressive and _is_hash_comment_file(filename):
+        lines = [
+            line for line in lines
+            if not (
+                line.lstrip().startswith("#")
+                and not line.lstrip().startswith(("#!", "# syntax", "# escape", "#cloud-config"))
+            )
+        ]
+
+    compacted: List[str] = []
+    for line in lines:
+        if line == "" and compacted and compacted[-1] == "":
+            continue
+        compacted.append(line)
+
+    return "\n".join(compacted).strip("\n")
+
+
+# ---------------------- Chunking ---------------------- #
+
+# Preferred split points: YAML documents, blank lines, top-level keys/blocks
+_BOUNDARY = re.compile(r"^(---\s*$|\s*$|[A-Za-z_\"{}\[\]])")
+
+
+def _split_long_lines(lines: List[str], max_tokens: int, model: str) -> Iterator[str]:
+    # Last resort for single lines over budget (minified bundles, base64 blobs)
+    for line in lines:
+        tokens = count_tokens(line, model)
+        if tokens <= max_tokens:
+            yield line
+            continue
+        step = max(1, len(line) * max_tokens // (tokens * 2))
+        for start in range(0, len(line), step):
+            yield line[start:start + step]
+
+
+def chunk_content(content: str, max_tokens: int, model: str = "gpt-4o-mini") -> List[str]:
+    """
+    Splits content into chunks of at most ~max_tokens, cutting on structural
+    boundaries where possible and on plain line breaks otherwise.
+    """
+    if count_tokens(content, model) <= max_tokens:
+        return [content]
+
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    last_boundary = 0
+
+    for line in _split_long_lines(content.split("\n"), max_tokens, model):
+        line_tokens = count_tokens(line + "\n", model)
+
+        if current and current_tokens + line_tokens > max_tokens:
+            cut = last_boundary if last_boundary > len(current) // 2 else len(current)
+            chunks.append("\n".join(current[:cut]))
+            current = current[cut:]
+            current_tokens = count_tokens("\n".join(current), model)
+            last_boundary = 0
+
+        if _BOUNDARY.match(line):
+            last_boundary = len(current)
+        current.append(line)
+        current_tokens += line_tokens
+
+    if current:
+        chunks.append("\n".join(current))
+    return [c for c in chunks if c.strip()]
+
+
+def fit_for_explain(
+    filename: str,
+    content: str,
+    max_tokens: int = EXPLAIN_MAX_INPUT_TOKENS,
+    model: str = "gpt-4o-mini",
+) -> dict:
+    """
+    Measures and compacts content for /explain. Returns
+    {"chunks": [...], "content_tokens", "compacted_tokens"}; one chunk means
+    a single call, several mean a map-reduce pass.
+    """
+    content_tokens = count_tokens(content, model)
+    if content_tokens > MAX_CONTENT_TOKENS:
+        raise TokenBudgetExceeded(
+            f"File is ~{content_tokens} tokens; the limit is {MAX_CONTENT_TOKENS}"
+        )
+
+    compacted = compact_content(filename, content)
+    compacted_tokens = count_tokens(compacted, model)
+    if compacted_tokens > max_tokens:
+        compacted = compact_content(filename, content, aggressive=True)
+        if "\n" not in compacted and compacted.startswith(("{", "[")):
+            # Minified JSON has no line breaks to chunk on: one value per line
+            try:
+                compacted = json.dumps(json.loads(compacted), indent=0, ensure_ascii=False)
+            except ValueError:
+                pass
+        compacted_tokens = count_tokens(compacted, model)
+
+    chunks = chunk_content(compacted, max_tokens, model)
+    if len(chunks) > MAX_EXPLAIN_CHUNKS:
+        raise TokenBudgetExceeded(
+            f"File needs {len(chunks)} explanation passes; the limit is {MAX_EXPLAIN_CHUNKS}"
+        )
+
+    return {
+        "chunks": chunks,
+        "content_tokens": content_tokens,
+        "compacted_tokens": compacted_tokens,
+    }
+
+
+def usage_from_completion(completion, into: Optional[dict] = None) -> dict:
+    """
+    Adds the provider-reported usage of one completion (chat or Responses API)
+    to a running total, including prompt tokens served from the provider cache.
+    """
+    total = into if into is not None else {}
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return total
+    for field, alias in (
+        ("prompt_tokens", "input_tokens"),
+        ("completion_tokens", "output_tokens"),
+        ("total_tokens", None),
+    ):
+        value = getattr(usage, field, None)
+        if value is None and alias:
+            value = getattr(usage, alias, None)
+        if value is not None:
+            total[field] = total.get(field, 0) + value
+    cached = cached_tokens(usage)
+    if cached is not None:
+        total["cached_tokens"] = total.get("cached_tokens", 0) + cached
+    return total
@@ -1,82 +1,285 @@
   # backend/utils/zip_builder.py
 
 import io
+import threading
 import zipfile
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import BinaryIO, Dict, Any, Iterator, List, Optional, Tuple
 
 BASE_DIR = Path(__file__).resolve().parent.parent  # backend/
 DOCS_TEMPLATE_DIR = BASE_DIR / "templates" / "docs"
 
+DIAGRAM_FILES = ["architecture-diagram.png", "pipeline-sequence.png"]
 
-def build_zip_from_result(result: Dict[str, Any]) -> io.BytesIO:
+# Folders that are identical for every service of a monorepo and are
+# written once at the archive root instead of once per service.
+SHARED_PREFIXES = ("infra/terraform/", "gitops/")
+
+# Top-level folders a monorepo archive writes itself; service folders may
+# not use them or their files would mix with the shared ones.
+MONOREPO_ROOT_DIRS = ("infra", "gitops", "docs")
+
+
+def iter_bundle_files(result: Dict[str, Any]) -> Iterator[Tuple[str, str]]:
     """
-    Builds a ZIP bundle based on the generation output.
+    Yields (archive path, file content) for every artefact in a generation result.
+    Shared by the ZIP builders and the CLI directory writer so layouts never drift.
     """
-    zip_buffer = io.BytesIO()
+    dockerfile: Optional[str] = result.get("dockerfile")
+    cicd_meta: Optional[Dict[str, Any]] = result.get("cicd_meta")
+    k8s_manifests: Optional[Dict[str, str]] = result.get("k8s_manifests")
+    helm_chart: Optional[Dict[str, str]] = result.get("helm_chart")
+    argocd_apps: Optional[Dict[str, str]] = result.get("argocd_app")
+    terraform_configs: Optional[Dict[str, Dict[str, str]]] = result.get("terraform_configs")
+    monitoring_configs: Optional[Dict[str, str]] = result.get("monitoring_configs")
+
+    # README guide
+    if result.get("readme_md"):
+        yield "README.md", result["readme_md"]
+
+    # ------------------- Dockerfile -------------------
+    if dockerfile:
+        yield "Dockerfile", dockerfile
+
+    # ------------------- CI/CD ------------------------
+    if cicd_meta:
+        filename = cicd_meta.get("filename", "pipeline.yaml")
+        content = cicd_meta.get("content", "") or ""
+        yield f"ci-cd/{filename}", content
+    else:
+        cicd_str = result.get("cicd_config")
+        if isinstance(cicd_str, str) and cicd_str.strip():
+            yield "ci-cd/pipeline.yaml", cicd_str
+
+    # ------------------- K8s --------------------------
+    if k8s_manifests:
+        for filename, content in k8s_manifests.items():
+            yield f"k8s/{filename}", content
+
+    # ------------------- Helm -------------------------
+    if helm_chart:
+        for filename, content in helm_chart.items():
+            yield f"helm/{filename}", content
+
+    # ------------------- GitOps (ArgoCD) --------------
+    if argocd_apps:
+        for filename, content in argocd_apps.items():
+            yield f"gitops/{filename}", content
+
+    # ------------------- Monitoring -------------------
+    if monitoring_configs:
+        for filename, content in monitoring_configs.items():
+            yield f"monitoring/{filename}", content
+
+    # ------------------- Terraform --------------------
+    # Structure: terraform_configs = { "eks": {...}, "ec2": {...}, "ecs": {...} }
+    if terraform_configs:
+        for preset, files in terraform_configs.items():
+            for filename, content in files.items():
+                yield f"infra/terraform/{preset}/{filename}", content
+
+
+def set_bundle_file(result: Dict[str, Any], arcname: str, content: str) -> bool:
+    """
+    Inverse of iter_bundle_files: replaces the content of one archive path in
+    a generation result. Returns False if the path is not part of the layout.
+    """
+    if arcname == "README.md":
+        result["readme_md"] = content
+        return True
+    if arcname == "Dockerfile":
+        result["dockerfile"] = content
+        return True
 
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-        dockerfile: Optional[str] = result.get("dockerfile")
-        cicd_meta: Optional[Dict[str, Any]] = result.get("cicd_meta")
-        k8s_manifests: Optional[Dict[str, str]] = result.get("k8s_manifests")
-        helm_chart: Optional[Dict[str, str]] = result.get("helm_chart")
-        argocd_apps: Optional[Dict[str, str]] = result.get("argocd_app")
-        terraform_configs: Optional[Dict[str, Dict[str, str]]] = result.get("terraform_configs")
-        monitoring_configs: Optional[Dict[str, str]] = result.get("monitoring_configs")
-        # README guide
-        if result.get("readme_md"):
-            zf.writestr("README.md", result["readme_md"])
-
-        # ------------------- Dockerfile -------------------
-        if dockerfile:
-            zf.writestr("Dockerfile", dockerfile)
-
-        # ------------------- CI/CD ------------------------
-        if cicd_meta:
-            filename = cicd_meta.get("filename", "pipeline.yaml")
-            content = cicd_meta.get("content", "") or ""
-            zf.writestr(f"ci-cd/{filename}", content)
-        else:
-            cicd_str = result.get("cicd_config")
-            if isinstance(cicd_str, str) and cicd_str.strip():
-                zf.writestr("ci-cd/pipeline.yaml", cicd_str)
-
-        # ------------------- K8s --------------------------
-        if k8s_manifests:
-            for filename, content in k8s_manifests.items():
-                zf.writestr(f"k8s/{filename}", content)
-
-        # ------------------- Helm -------------------------
-        if helm_chart:
-            for filename, content in helm_chart.items():
-                zf.writestr(f"helm/{filename}", content)
-
-        # ------------------- GitOps (ArgoCD) --------------
-        if argocd_apps:
-            for filename, content in argocd_apps.items():
-                zf.writestr(f"gitops/{filename}", content)
-
-        # ------------------- Monitoring -------------------
-        if monitoring_configs:
-            for filename, content in monitoring_configs.items():
-                zf.writestr(f"monitoring/{filename}", content)
-        # ------------------- Terraform --------------------
-        # Structure: terraform_configs = { "eks": {...}, "ec2": {...}, "ecs": {...} }
-        if terraform_configs:
-            for preset, files in terraform_configs.items():
-                for filename, content in files.items():
-                    zf.writestr(f"infra/terraform/{preset}/{filename}", content)
-
-
-       
+    folder, _, name = arcname.partition("/")
+    if folder == "ci-cd":
+        if result.get("cicd_meta"):
+            result["cicd_meta"] = {**result["cicd_meta"], "content": content}
+        result["cicd_config"] = content
+        return True
+
+    keys = {
+        "k8s": "k8s_manifests",
+        "helm": "helm_chart",
+        "gitops": "argocd_app",
+        "monitoring": "monitoring_configs",
+    }
+    if folder in keys and name in (result.get(keys[folder]) or {}):
+        result[keys[folder]][name] = content
+        return True
+
+    if arcname.startswith("infra/terraform/"):
+        preset, _, name = arcname[len("infra/terraform/"):].partition("/")
+        files = (result.get("terraform_configs") or {}).get(preset)
+        if files is not None and name in files:
+            files[name] = content
+            return True
+    return False
+
+
+def _write_diagrams(zf: zipfile.ZipFile) -> None:
+    for fname in DIAGRAM_FILES:
+        fpath = DOCS_TEMPLATE_DIR / fname
+        if fpath.exists():
+            zf.write(fpath, arcname=f"docs/{fname}")
+
+
+class BuildCancelled(Exception):
+    """
+    The cancel event passed to a ZIP build was set; the archive is incomplete.
+    """
+
+
+def write_zip_from_result(
+    result: Dict[str, Any], fileobj: BinaryIO, cancel: Optional[threading.Event] = None
+) -> None:
+    """
+    Writes the ZIP bundle for a generation result into any binary file object.
+    Checks `cancel` between files, so a build in a worker thread stops soon
+    after the request that wanted it is abandoned.
+    """
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as zf:
+        for arcname, content in iter_bundle_files(result):
+            if cancel is not None and cancel.is_set():
+                raise BuildCancelled(arcname)
+            zf.writestr(arcname, content)
 
         # ------------------- Diagrams ---------------------
-        for fname in ["architecture-diagram.png", "pipeline-sequence.png"]:
-            fpath = DOCS_TEMPLATE_DIR / fname
-            if fpath.exists():
-                zf.write(fpath, arcname=f"docs/{fname}")
+        _write_diagrams(zf)
 
-       
 
+def build_zip_from_result(
+    result: Dict[str, Any], cancel: Optional[threading.Event] = None
+) -> io.BytesIO:
+    """
+    Builds a ZIP bundle based on the generation output.
+    """
+    zip_buffer = io.BytesIO()
+    write_zip_from_result(result, zip_buffer, cancel)
     zip_buffer.seek(0)
     return zip_buffer
+
+
+def write_result_to_dir(result: Dict[str, Any], target: Path) -> Tuple[int, int]:
+    """
+    Writes the same layout as build_zip_from_result, but as plain files.
+    Returns (files written, bytes written).
+    """
+    files = 0
+    size = 0
+    for arcname, content in iter_bundle_files(result):
+        path = target / arcname
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = (content or "").encode("utf-8")
+        path.write_bytes(data)
+        files += 1
+        size += len(data)
+
+    for fname in DIAGRAM_FILES:
+        fpath = DOCS_TEMPLATE_DIR / fname
+        if fpath.exists():
+            dest = target / "docs" / fname
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            data = fpath.read_bytes()
+            dest.write_bytes(data)
+            files += 1
+            size += len(data)
+
+    return files, size
+
+
+# ---------------------- Streaming / monorepo archives ---------------------- #
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only, non-seekable sink. zipfile falls back to streaming mode
+    (data descriptors) so finished entries can be flushed to the client
+    while later ones are still being compressed.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def split_shared_files(
+    results: Dict[str, Dict[str, Any]],
+) -> Tuple[Dict[str, str], Dict[str, List[Tuple[str, str]]]]:
+    """
+    Splits a set of per-service results into:
+      - shared files (Terraform / ArgoCD) that every service agrees on
+      - the remaining per-service files
+
+    A shared-candidate path only moves to the root if every service produces
+    it with identical content; otherwise each service keeps its own copy.
+    """
+    per_service: Dict[str, List[Tuple[str, str]]] = {
+        name: list(iter_bundle_files(result)) for name, result in results.items()
+    }
+
+    candidates: Dict[str, Optional[str]] = {}
+    producers: Dict[str, int] = {}
+    for files in per_service.values():
+        for arcname, content in files:
+            if not arcname.startswith(SHARED_PREFIXES):
+                continue
+            producers[arcname] = producers.get(arcname, 0) + 1
+            if arcname not in candidates:
+                candidates[arcname] = content
+            elif candidates[arcname] != content:
+                candidates[arcname] = None  # conflicting → keep per-service
+
+    shared = {
+        path: body
+        for path, body in candidates.items()
+        if body is not None and producers[path] == len(per_service)
+    }
+
+    service_files = {
+        name: [(arcname, content) for arcname, content in files if arcname not in shared]
+        for name, files in per_service.items()
+    }
+    return shared, service_files
+
+
+def iter_monorepo_zip(results: Dict[str, Dict[str, Any]]) -> Iterator[bytes]:
+    """
+    Streams a single ZIP for many services:
+
+        <service>/Dockerfile, <service>/ci-cd/..., <service>/k8s/...
+        infra/terraform/...   (shared, written once)
+        gitops/...            (shared, written once)
+        docs/...              (diagrams, written once)
+
+    Yields compressed bytes after every entry instead of buffering the
+    whole archive in memory.
+    """
+    shared, service_files = split_shared_files(results)
+    sink = _ChunkSink()
+
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, files in service_files.items():
+            for arcname, content in files:
+                zf.writestr(f"{name}/{arcname}", content)
+                yield sink.drain()
+
+        for arcname, content in shared.items():
+            zf.writestr(arcname, content)
+            yield sink.drain()
+
+        _write_diagrams(zf)
+
+    # Central directory is written on close
+    yield sink.drain()